@@ -133,6 +133,63 @@ STATICFILES_DIRS = [
 LOGIN_REDIRECT_URL = 'ledger_ui:index'
 
 LEDGER_ENTRY_COUNT = 20
+# How many of the latest submitted entries can be reverted one by one.
+LEDGER_UNDO_LEVELS = 10
+# How many of the asynchronous submissions get written at once, and
+# after how many seconds the ones still being written are assumed to
+# be abandoned (marked as failed, so they don't keep the user's later
+# ones waiting).
+LEDGER_SUBMIT_QUEUE_BATCH = 100
+LEDGER_SUBMIT_QUEUE_TIMEOUT = 300
+# For how many seconds a submission's idempotency_key is remembered,
+# and after how many seconds a submission still being handled is
+# assumed to be abandoned (e.g. its worker was killed on a timeout),
+# so it can be retried with the same key.
+LEDGER_IDEMPOTENCY_TTL = 24 * 60 * 60
+LEDGER_IDEMPOTENCY_TIMEOUT = 60
+# How many postings the register shows at once.
+LEDGER_REGISTER_COUNT = 200
 LEDGER_DEFAULT_CURRENCY = '$'
 LEDGER_DEFAULT_FROM = 'Liabilities:Credit Card'
 LEDGER_DEFAULT_TO = 'Expenses:Uncategorized'
+
+# Where to keep the data derived from the Ledger files, like the
+# entry indexes used by the journal view.  Set to None to keep it
+# only in memory.  By default it's the per-user cache directory,
+# outside of the source tree.
+LEDGER_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'ledger-web',
+)
+
+# How many processes to use to parse the large Ledger files when
+# they need to be indexed from scratch, and how large (in bytes) the
+# parsed part needs to be for it.  0 disables the parallel parsing.
+LEDGER_PARSE_WORKERS = 0
+LEDGER_PARALLEL_PARSE_THRESHOLD = 32 * 2**20
+
+# How many long-lived ledger processes to keep for running the reports
+# (like the lists of accounts and payees), so that the journal isn't
+# parsed from scratch each time, and after how many idle seconds they
+# are stopped.  They're restarted whenever the journal changes, but
+# not when only the files it includes do.  0 disables them.
+LEDGER_CLI_WORKERS = 0
+LEDGER_CLI_IDLE_TIMEOUT = 300
+
+# How many outputs of the ledger reports (like the lists of accounts
+# and payees) to remember, until the journal changes.  Changes to only
+# the files it includes are not noticed, set to 0 if that's a problem.
+LEDGER_REPORT_CACHE_SIZE = 32
+
+# What computes the balance and register pages: 'ledger' or 'native'.
+# The native engine parses the journal on its own, but falls back to
+# ledger if the journal uses any directives or features it doesn't
+# support.  With it the charts use the monthly totals kept in the
+# database too, updated as the entries get added, as long as they're
+# all in LEDGER_DEFAULT_CURRENCY.
+#
+# The native engine is experimental: its output (and so the charts'
+# rollups) hasn't been verified against ledger's yet, which is what
+# NativeEngineDifferentialTests in ledger_ui does once ledger is
+# installed.  Keep it opt-in until that test passes in CI.
+LEDGER_ENGINE = 'ledger'
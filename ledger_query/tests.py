@@ -1,3 +1,246 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from parameterized import parameterized
+from unittest import mock
+import json
+import os
+import shutil
+import tempfile
+
+from .views import stream_entries
+from ledger_ui.models import LedgerPath
+from utils import ledger_api
+
+
+class TransactionsTests(TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, 'ledger.dat')
+
+        patcher = mock.patch.multiple(
+            ledger_api.Journal,
+            cache_dir=None,
+            _indexes={},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(
+            username='tester',
+        )
+        LedgerPath.objects.create(
+            user=self.user,
+            path=self.path,
+        )
+        self.client.force_login(self.user)
+
+        journal = ledger_api.Journal(self.path)
+        open(self.path, 'w').close()
+        for day, payee, note in [
+                (1, 'AUCHAN WARSZAWA', ''),
+                (2, 'Pizza Hut', ':food:'),
+                (3, 'Lidl', ':automatic:'),
+                (4, 'AUCHAN KRAKOW', ':automatic:'),
+                (5, 'Lidl', ''),
+        ]:
+            journal.append(ledger_api.Entry(
+                date='2019-02-{:02d}'.format(day),
+                payee=payee,
+                note=note,
+                accounts=[
+                    ('Expenses:Food', '10 PLN'),
+                    ('Liabilities:Credit Card',),
+                ],
+            ))
+
+    def get(self, **params):
+        response = self.client.get(
+            reverse('ledger_query:transactions'),
+            params,
+        )
+        return response
+
+    def payees(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [entry['payee'] for entry in response.json()['entries']]
+
+    @parameterized.expand([
+        (
+            {},
+            [
+                'Lidl', 'AUCHAN KRAKOW', 'Lidl', 'Pizza Hut',
+                'AUCHAN WARSZAWA',
+            ],
+        ),
+        ({'count': 2}, ['Lidl', 'AUCHAN KRAKOW']),
+        ({'payee': 'AUCHAN.*'}, ['AUCHAN KRAKOW', 'AUCHAN WARSZAWA']),
+        ({'payee': 'AUCHAN.*', 'count': 1}, ['AUCHAN KRAKOW']),
+        ({'note': ':automatic:'}, ['AUCHAN KRAKOW', 'Lidl']),
+        ({'payee': 'Lidl', 'note': ':automatic:'}, ['Lidl']),
+    ])
+    def test_transactions(self, params, expected_payees):
+        self.assertEqual(self.payees(self.get(**params)), expected_payees)
+
+    @parameterized.expand([
+        ({},),
+        ({'count': 2},),
+        ({'payee': 'AUCHAN.*'},),
+        ({'payee': 'nobody'},),
+    ])
+    def test_stream(self, params):
+        expected = self.get(**params).json()
+        response = self.get(stream='1', **params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(
+            json.loads(b''.join(response.streaming_content)),
+            expected,
+        )
+
+    def test_stream_batches(self):
+        entries = [{'payee': str(i)} for i in range(5)]
+        for batch_size in [1, 2, 5, 10]:
+            with self.subTest(batch_size=batch_size):
+                self.assertEqual(
+                    json.loads(''.join(
+                        stream_entries(entries, batch_size),
+                    )),
+                    {'entries': entries},
+                )
+
+    @parameterized.expand([
+        (
+            {'count': 2},
+            [
+                ['Lidl', 'AUCHAN KRAKOW'],
+                ['Lidl', 'Pizza Hut'],
+                ['AUCHAN WARSZAWA'],
+            ],
+        ),
+        (
+            {'count': 1, 'payee': 'AUCHAN.*'},
+            [['AUCHAN KRAKOW'], ['AUCHAN WARSZAWA'], []],
+        ),
+        ({'count': 5}, [['Lidl', 'AUCHAN KRAKOW', 'Lidl', 'Pizza Hut',
+                         'AUCHAN WARSZAWA'], []]),
+    ])
+    def test_pagination(self, params, expected_pages):
+        pages = []
+        cursor = None
+        while True:
+            if cursor is not None:
+                params['before'] = cursor
+            response = self.get(**params)
+            pages.append(self.payees(response))
+            self.assertEqual(
+                json.loads(b''.join(
+                    self.get(stream='1', **params).streaming_content,
+                )),
+                response.json(),
+            )
+            cursor = response.json()['next']
+            if cursor is None:
+                break
+        self.assertEqual(pages, expected_pages)
+
+    def test_pagination_without_count(self):
+        cursor = self.get(count=3).json()['next']
+        self.assertEqual(
+            self.payees(self.get(before=cursor)),
+            ['Pizza Hut', 'AUCHAN WARSZAWA'],
+        )
+        self.assertEqual(
+            self.payees(self.get(before=cursor, payee='AUCHAN.*')),
+            ['AUCHAN WARSZAWA'],
+        )
+        self.assertIsNone(self.get(before=cursor).json()['next'])
+
+    def test_pagination_survives_append(self):
+        cursor = self.get(count=4).json()['next']
+        ledger_api.Journal(self.path).append(ledger_api.Entry(
+            date='2019-02-06',
+            payee='Newest',
+            accounts=[('Expenses:Food', '10 PLN'), ('Assets:Cash',)],
+        ))
+        self.assertEqual(
+            self.payees(self.get(before=cursor, count=4)),
+            ['AUCHAN WARSZAWA'],
+        )
+
+    @parameterized.expand([
+        (
+            {'since': '2019-02-02'},
+            ['Lidl', 'AUCHAN KRAKOW', 'Lidl', 'Pizza Hut'],
+        ),
+        ({'until': '2019-02-02'}, ['Pizza Hut', 'AUCHAN WARSZAWA']),
+        (
+            {'since': '2019-02-02', 'until': '2019-02-03'},
+            ['Lidl', 'Pizza Hut'],
+        ),
+        ({'since': '2019-02-02', 'payee': 'Lidl'}, ['Lidl', 'Lidl']),
+        (
+            {'since': '2019-02-02', 'count': 3},
+            ['Lidl', 'AUCHAN KRAKOW', 'Lidl'],
+        ),
+        ({'since': '2019-03-01'}, []),
+    ])
+    def test_date_range(self, params, expected_payees):
+        self.assertEqual(self.payees(self.get(**params)), expected_payees)
+
+    def test_date_range_pagination(self):
+        response = self.get(since='2019-02-02', count=3)
+        self.assertEqual(
+            self.payees(self.get(
+                since='2019-02-02', count=3, before=response.json()['next'],
+            )),
+            ['Pizza Hut'],
+        )
+
+    @parameterized.expand([
+        ('since', '2019-02-30'),
+        ('until', 'yesterday'),
+    ])
+    def test_bad_date(self, param, date):
+        response = self.get(**{param: date})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json(), {'error': {param: date}})
+
+    @parameterized.expand([
+        ('not a cursor',),
+        ('bWFueQ',),  # "many"
+        ('LTE',),  # "-1"
+    ])
+    def test_bad_cursor(self, cursor):
+        response = self.get(before=cursor)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json(), {'error': {'before': cursor}})
+
+    def test_entry_format(self):
+        entry = self.get(count=1).json()['entries'][0]
+        self.assertEqual(
+            entry,
+            {
+                'body': (
+                    '2019-02-05 Lidl\n'
+                    '    Expenses:Food                              10.00 PLN\n'
+                    '    Liabilities:Credit Card'
+                ),
+                'date': '2019-02-05',
+                'payee': 'Lidl',
+                'note': '',
+            },
+        )
+
+    @parameterized.expand([
+        ('many',),
+        ('-1',),
+    ])
+    def test_bad_count(self, count):
+        response = self.get(count=count)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json(), {'error': {'count': count}})
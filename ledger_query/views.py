@@ -1,32 +1,69 @@
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
+import base64
+import bisect
+import datetime
 import itertools
 import re
 
 from ledger_submit.models import Rule
+from ledger_submit.rules import CompiledRule
 from ledger_submit.views import check_rule
 from utils import ledger_api
 
 
-@login_required
-def transactions(request):
-    entries = reversed(list(ledger_api.Journal(request.user.ledger_path.path)))
+def encode_cursor(offset):
+    """Make an opaque pagination cursor out of an entry offset."""
+    return base64.urlsafe_b64encode(str(offset).encode()).decode().rstrip('=')
 
-    payee = request.GET.get('payee')
-    note = request.GET.get('note')
 
-    rule = Rule(payee=payee, note=note)
+def decode_cursor(cursor):
+    """The inverse of encode_cursor(), raises ValueError if invalid."""
+    offset = int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if offset < 0:
+        raise ValueError(cursor)
+    return offset
 
-    entries = (
-        entry for entry in entries
-        if check_rule(entry, rule) is not None
-    )
+
+def stream_entries(entries, batch_size=100, trailer=dict):
+    """Encode {"entries": [...]} piece by piece, like JsonResponse would.
+
+    Yields a chunk per batch_size entries, so only these few entries
+    are kept in memory at once.  The trailer gets called once all
+    the entries are consumed and returns the remaining keys of the
+    encoded object.
+
+    """
+    encoder = DjangoJSONEncoder()
+    yield '{"entries": ['
+    separator = ''
+    entries = iter(entries)
+    while True:
+        batch = list(itertools.islice(entries, batch_size))
+        if not batch:
+            break
+        yield separator + ', '.join(
+            encoder.encode(dict(entry)) for entry in batch
+        )
+        separator = ', '
+    yield ']'
+    for key, value in trailer().items():
+        yield ', {}: {}'.format(encoder.encode(key), encoder.encode(value))
+    yield '}'
+
+
+@login_required
+def transactions(request):
+    journal = ledger_api.Journal(request.user.ledger_path.path)
 
     count = request.GET.get('count')
     if count is not None:
         try:
+            if int(count) < 0:
+                raise ValueError(count)
             count = int(count)
         except ValueError:
             return JsonResponse(
@@ -37,6 +74,88 @@ def transactions(request):
                 },
                 status=422,
             )
-        entries = itertools.islice(entries, count)
 
-    return JsonResponse({'entries': list(entries)})
+    before = request.GET.get('before')
+    if before is not None:
+        try:
+            before = decode_cursor(before)
+        except ValueError:
+            return JsonResponse(
+                {
+                    'error': {
+                        'before': before,
+                    }
+                },
+                status=422,
+            )
+
+    dates = {}
+    for param in ['since', 'until']:
+        date = request.GET.get(param)
+        if date is not None:
+            try:
+                date = datetime.datetime.strptime(
+                    date, "%Y-%m-%d",
+                ).date().isoformat()
+            except ValueError:
+                return JsonResponse(
+                    {
+                        'error': {
+                            param: date,
+                        }
+                    },
+                    status=422,
+                )
+        dates[param] = date
+
+    if count is not None and not any(dates.values()):
+        # Only the latest entries are needed, there is no need to
+        # look at the whole journal.
+        entries = journal.reverse_entries(before)
+    else:
+        # All the entries need to be checked (or the ones from the
+        # date range found), the index makes it cheaper than parsing
+        # them all again.
+        entries = journal.entries(**dates)
+        if before is not None:
+            entries = entries[:bisect.bisect_left(entries.offsets, before)]
+        entries = zip(reversed(entries.offsets), reversed(entries))
+
+    payee = request.GET.get('payee')
+    note = request.GET.get('note')
+
+    # Compiled once for all the entries.
+    rule = CompiledRule(Rule(payee=payee, note=note))
+
+    entries = (
+        (offset, entry) for offset, entry in entries
+        if check_rule(entry, rule) is not None
+    )
+
+    page = {'next': None}
+
+    def paginated(entries):
+        if count is None:
+            for _, entry in entries:
+                yield entry
+            return
+        for returned, (offset, entry) in enumerate(
+                itertools.islice(entries, count),
+                start=1,
+        ):
+            if returned == count:
+                # There might be more entries, the next page is going
+                # to start right before this one.
+                page['next'] = encode_cursor(offset)
+            yield entry
+
+    stream = request.GET.get('stream', 'false').lower() not in ['false', '0']
+    if stream:
+        return StreamingHttpResponse(
+            stream_entries(paginated(entries), trailer=lambda: page),
+            content_type='application/json',
+        )
+    return JsonResponse({
+        'entries': list(map(dict, paginated(entries))),
+        **page,
+    })
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LedgerSubmitConfig(AppConfig):
     name = 'ledger_submit'
     verbose_name = 'Ledger Submit'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ledger_submit import write_queue
+
+
+class Command(BaseCommand):
+    help = 'Write the queued asynchronous submissions to the journals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='How many submissions to write at once.',
+        )
+
+    def handle(self, *args, **options):
+        processed = write_queue.drain(options['batch_size'])
+        self.stdout.write('Processed {} submissions.'.format(processed))
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('ledger_submit', '0006_auto_20190531_2258'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RuleSetVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='auth.user')),
+                ('stamp', models.UUIDField(default=uuid.uuid4)),
+            ],
+        ),
+    ]
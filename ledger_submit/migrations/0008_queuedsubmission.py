@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ledger_submit', '0007_rulesetversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedSubmission',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticket', models.UUIDField(default=uuid.uuid4, unique=True)),
+                ('params_json', models.TextField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('writing', 'Writing'), ('written', 'Written'), ('failed', 'Failed')], default='queued', max_length=16)),
+                ('claim', models.UUIDField(null=True)),
+                ('claimed_at', models.DateTimeField(null=True)),
+                ('result_json', models.TextField(blank=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='queuedsubmission',
+            index=models.Index(fields=['status', 'id'], name='ledger_subm_status_5654ee_idx'),
+        ),
+    ]
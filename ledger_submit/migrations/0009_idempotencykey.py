@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ledger_submit', '0008_queuedsubmission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint', models.CharField(max_length=64)),
+                ('key', models.CharField(max_length=256)),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('status', models.PositiveSmallIntegerField(null=True)),
+                ('response_json', models.TextField(blank=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'endpoint', 'key')},
+            },
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.contrib.auth.models import User
 from django.core.validators import MinLengthValidator
 from django.db import models
 
+import uuid
+
 
 class Rule(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -19,6 +21,22 @@ class Rule(models.Model):
         unique_together = (('payee', 'user', 'note'))
 
 
+class RuleSetVersion(models.Model):
+    """Changes along with any of the user's rules.
+
+    Lets the processes caching the rules know they need to reload
+    them.  A random stamp (instead of a counter) can't ever be
+    mistaken for an older version.
+
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    stamp = models.UUIDField(default=uuid.uuid4)
+
+
 class Token(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     token = models.CharField(
@@ -36,3 +54,60 @@ class Token(models.Model):
 
     def __str__(self):
         return "{}({})".format(self.user, self.short_token())
+
+
+class QueuedSubmission(models.Model):
+    """A v2 submission accepted to be written to the journal later.
+
+    See write_queue.  The ticket is what the client can check the
+    status with.
+
+    """
+    QUEUED = 'queued'
+    WRITING = 'writing'
+    WRITTEN = 'written'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (WRITING, 'Writing'),
+        (WRITTEN, 'Written'),
+        (FAILED, 'Failed'),
+    ]
+
+    ticket = models.UUIDField(default=uuid.uuid4, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    params_json = models.TextField()
+    status = models.CharField(
+        max_length=16,
+        choices=STATUSES,
+        default=QUEUED,
+    )
+    # Which drain() took it and when.
+    claim = models.UUIDField(null=True)
+    claimed_at = models.DateTimeField(null=True)
+    # The written entry or the error, as JSON.
+    result_json = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'])]
+
+
+class IdempotencyKey(models.Model):
+    """The response to a submission made with an idempotency_key.
+
+    A repeated submission with the same key (to the same view) gets
+    this response instead of being submitted again.  The status is None
+    while the first one is still being handled.
+
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The name of the view, the responses of the other ones would have
+    # a different shape.
+    endpoint = models.CharField(max_length=64)
+    key = models.CharField(max_length=256)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    status = models.PositiveSmallIntegerField(null=True)
+    response_json = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = (('user', 'endpoint', 'key'))
@@ -0,0 +1,305 @@
+from django.db.models.functions import Length
+
+from collections import deque
+import re
+import threading
+import uuid
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    # Before Python 3.11.
+    import sre_parse
+
+from .models import Rule, RuleSetVersion
+
+
+class CompiledRule:
+    """A Rule with its conditions compiled once.
+
+    The payee and note conditions of a rule are regexps that need to
+    match the whole field.  They get compiled when the CompiledRule
+    is created, so checking a rule against many entries doesn't
+    depend on the re module cache.  A rule with an invalid regexp
+    never matches anything.
+
+    """
+
+    FIELDS = ['payee', 'note']
+
+    def __init__(self, rule):
+        self.rule = rule
+        # The compiled conditions of the non-empty fields.
+        self.conditions = {}
+        self.valid = True
+        for field in self.FIELDS:
+            condition = getattr(rule, field)
+            if condition:
+                try:
+                    self.conditions[field] = re.compile(
+                        '^(?:{})$'.format(condition),
+                    )
+                except re.error:
+                    self.valid = False
+        self._legacy_payee = None
+
+    def check(self, ledger_data):
+        """Return the match objects of the conditions, by field.
+
+        Returns None if any of them doesn't match.
+
+        """
+        if not self.valid:
+            return None
+        matches = {}
+        for field, condition in self.conditions.items():
+            matches[field] = condition.match(ledger_data[field])
+            if not matches[field]:
+                return None
+        return matches
+
+    def legacy_payee_match(self, payee):
+        """Match the payee the way the v1 API always did."""
+        if self._legacy_payee is None:
+            try:
+                self._legacy_payee = re.compile(self.rule.payee)
+            except re.error:
+                self._legacy_payee = False
+        if self._legacy_payee is False:
+            return None
+        return self._legacy_payee.fullmatch(payee)
+
+
+def required_literals(regexp):
+    """Return strings, one of which is in anything the regexp matches.
+
+    The alternatives are chosen so that the shortest of them is as
+    long as possible.  Returns [''] if there are no such strings or
+    they're not obvious from the regexp.
+
+    >>> required_literals(re.compile('^(?:AUCHAN .*)$'))
+    ['AUCHAN ']
+    >>> required_literals(re.compile('^(?:Pizza (Hut|Dominium) W?arszawa)$'))
+    ['arszawa']
+    >>> required_literals(re.compile('^(?:Lidl|Biedronka)$'))
+    ['Lidl', 'Biedronka']
+    >>> required_literals(re.compile('^(?:Lidl|.*)$'))
+    ['']
+    >>> required_literals(re.compile('^(?:lidl)$', re.IGNORECASE))
+    ['']
+    >>> required_literals(re.compile('^(?:Lidl (?i:krakow))$'))
+    ['Lidl ']
+    """
+    if regexp.flags & re.IGNORECASE:
+        return ['']
+
+    def best(alternatives):
+        return max(alternatives, key=lambda literals: min(map(len, literals)))
+
+    def walk(items):
+        # Each element of the sequence may give its own requirement,
+        # all of them need to be met, so the best one is enough.
+        requirements = [['']]
+        literal = []
+        for op, arg in items:
+            if op is sre_parse.LITERAL:
+                literal.append(chr(arg))
+                continue
+            requirements.append([''.join(literal)])
+            literal = []
+            if op is sre_parse.SUBPATTERN:
+                # The group has to match anyway.
+                group, add_flags, del_flags, group_items = arg
+                if not add_flags & sre_parse.SRE_FLAG_IGNORECASE:
+                    requirements.append(walk(group_items))
+            elif op is sre_parse.BRANCH:
+                # One of the branches has to match.
+                literals = []
+                for branch in arg[1]:
+                    literals.extend(walk(branch))
+                requirements.append(
+                    [''] if '' in literals else sorted(
+                        set(literals), key=literals.index,
+                    )
+                )
+        requirements.append([''.join(literal)])
+        return best(requirements)
+
+    return walk(sre_parse.parse(regexp.pattern, regexp.flags))
+
+
+class LiteralAutomaton:
+    """An Aho-Corasick automaton finding many literals in a text at once.
+
+    Built from (literal, value) pairs, search() returns the values of
+    all the literals found in a text in a single pass over it.
+
+    """
+
+    def __init__(self, literals):
+        self.goto = [{}]
+        outputs = [set()]
+        for literal, value in literals:
+            node = 0
+            for char in literal:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    outputs.append(set())
+                node = next_node
+            outputs[node].add(value)
+
+        # Where to continue from if the next character doesn't match:
+        # the node of the longest suffix of the current match being
+        # a prefix of some literal.  The nodes are visited in the
+        # order of their depth, so the nodes the failure links point
+        # to are already complete.
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                outputs[child] |= outputs[self.fail[child]]
+        self.outputs = [frozenset(output) for output in outputs]
+
+    def __bool__(self):
+        return len(self.goto) > 1
+
+    def search(self, text):
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                found |= outputs[node]
+        return found
+
+
+class RuleMatcher:
+    """The rules of a user, finding the ones worth checking for an entry.
+
+    Each rule condition needs one of certain literals to be present in
+    the field to match (see required_literals).  The literals of all the
+    rules are looked up at once with a LiteralAutomaton, so only the
+    rules whose literals are present (or which don't have any) need
+    to be actually checked.
+
+    """
+
+    def __init__(self, rules):
+        """rules are CompiledRules, the first ones having the priority."""
+        self.rules = list(rules)
+        self.automatons = {}
+        # The rules which can't be excluded by the field.
+        self.unfiltered = {}
+        for field in CompiledRule.FIELDS:
+            literals = []
+            unfiltered = set()
+            for position, rule in enumerate(self.rules):
+                if not rule.valid:
+                    # Never matches anything anyway.
+                    continue
+                condition = rule.conditions.get(field)
+                required = (
+                    required_literals(condition) if condition else ['']
+                )
+                if '' in required:
+                    unfiltered.add(position)
+                else:
+                    literals.extend(
+                        (literal, position) for literal in required
+                    )
+            self.automatons[field] = LiteralAutomaton(literals)
+            self.unfiltered[field] = unfiltered
+
+    def __iter__(self):
+        return iter(self.rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def candidates(self, ledger_data):
+        """Return the rules that might match, in their priority order.
+
+        The rules not returned are guaranteed not to match.
+
+        """
+        positions = None
+        for field in CompiledRule.FIELDS:
+            found = self.unfiltered[field]
+            if self.automatons[field]:
+                found = found | self.automatons[field].search(
+                    ledger_data[field],
+                )
+            if positions is None:
+                positions = found
+            else:
+                positions = positions & found
+        return [self.rules[position] for position in sorted(positions)]
+
+
+def compiled(rule):
+    """Return the rule as a CompiledRule, compiling it if needed."""
+    if isinstance(rule, CompiledRule):
+        return rule
+    return CompiledRule(rule)
+
+
+# The RuleMatcher of each user and the stamp of their RuleSetVersion,
+# by user id.
+_rule_sets = {}
+_rule_sets_lock = threading.Lock()
+
+
+def user_rules(user):
+    """Return the RuleMatcher of the user's rules, the most specific first.
+
+    The rules are cached by the current process for as long as the
+    user's RuleSetVersion doesn't change, so in the steady state the
+    only query is the one fetching it.
+
+    """
+    stamp = RuleSetVersion.objects.filter(
+        pk=user.pk,
+    ).values_list('stamp', flat=True).first()
+    if stamp is None:
+        version, _ = RuleSetVersion.objects.get_or_create(user_id=user.pk)
+        stamp = version.stamp
+
+    cached = _rule_sets.get(user.pk)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    # The stamp was read before the rules, so if they change in the
+    # meantime, they're reloaded on the next call.
+    rules = RuleMatcher(
+        CompiledRule(rule)
+        for rule in Rule.objects.filter(user=user).order_by(
+            *(Length(field).desc() for field in CompiledRule.FIELDS)
+        )
+    )
+    with _rule_sets_lock:
+        _rule_sets[user.pk] = (stamp, rules)
+    return rules
+
+
+def rules_changed(user_id):
+    """Invalidate the cached rules of the user in all the processes."""
+    with _rule_sets_lock:
+        _rule_sets.pop(user_id, None)
+    # No process could have cached the rules without the version
+    # existing, so there is no need to create it.  It would also
+    # break deleting the users, as it's done along with their rules.
+    RuleSetVersion.objects.filter(pk=user_id).update(stamp=uuid.uuid4())
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Rule
+from .rules import rules_changed
+
+
+@receiver(post_save, sender=Rule)
+@receiver(post_delete, sender=Rule)
+def invalidate_rules(sender, instance, **kwargs):
+    rules_changed(instance.user_id)
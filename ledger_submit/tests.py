@@ -1,12 +1,38 @@
+from django.conf import settings
+from django.core.management import call_command
 from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.utils import timezone
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from parameterized import parameterized
+from unittest import mock
+import doctest
+import fcntl
+import io
+import os
+import re
+import threading
+import time
+import uuid
 
-from .models import Rule, Token
-from ledger_ui.models import LedgerPath
+from . import rules, write_queue
+from .models import (
+    IdempotencyKey,
+    QueuedSubmission,
+    Rule,
+    RuleSetVersion,
+    Token,
+)
+from ledger_ui.models import LedgerPath, UndoRecord
+from ledger_ui.tests import JournalTestCase
+from utils import ledger_api
+
+
+def load_tests(loader, tests, ignore):
+    tests.addTests(doctest.DocTestSuite(rules))
+    return tests
 
 
 class SubmitTestsV1(TestCase):
@@ -789,3 +815,676 @@ class SubmitTestsV2(TestCase):
 
         self.assertEqual(response.status_code, 201)
         self.assertEqual(response_dict['payee'], effective_payee)
+
+
+class JournalSubmitTestCase(JournalTestCase):
+    """Submits the entries to a real journal in a temporary directory."""
+
+    good_token = 'awesometesttoken'
+
+    def setUp(self):
+        super().setUp()
+        self.write('; -*- mode: ledger; -*-\n')
+
+        self.user = User.objects.create_user(
+            username='tester',
+        )
+        LedgerPath.objects.create(
+            user=self.user,
+            path=self.path,
+        )
+        Token.objects.create(
+            user=self.user,
+            token=self.good_token,
+        )
+        Rule.objects.create(
+            user=self.user,
+            payee='AUCHAN WARSZ.*',
+            new_payee='Auchan',
+            account='Expenses:Food',
+        )
+
+    def payees(self):
+        return [entry['payee'] for entry in ledger_api.Journal(self.path)]
+
+
+class SubmitTestsV3Batch(JournalSubmitTestCase):
+
+    def submit(self, entries, token=JournalSubmitTestCase.good_token):
+        return self.client.post(
+            reverse('ledger_submit:json_v3_batch'),
+            content_type='application/json',
+            data={'entries': entries, 'token': token},
+        )
+
+    def test_batch(self):
+        with mock.patch.object(
+                ledger_api.Journal,
+                'append_entries',
+                wraps=ledger_api.Journal(self.path).append_entries,
+        ) as append_entries:
+            response = self.submit([
+                {
+                    'payee': 'AUCHAN WARSZAWA',
+                    'date': '2019-02-01',
+                    'accounts': [
+                        ['Expenses:Uncategorized', '10,50', 'PLN'],
+                        ['Liabilities:Credit Card'],
+                    ],
+                },
+                {
+                    'payee': 'CARREFOUR',
+                    'date': 'yesterday',
+                    'accounts': [['Expenses:Uncategorized', '1 PLN']],
+                },
+                {
+                    'payee': 'CARREFOUR',
+                    'date': '2019-02-02',
+                    'accounts': [['Expenses:Uncategorized', 'one PLN']],
+                },
+                ['CARREFOUR'],
+                {'payee': 'CARREFOUR'},
+                {
+                    'payee': 'AUCHAN WARSZAWA',
+                    'date': '2019-02-03',
+                    'note': ':tag:',
+                    'skip_rules': True,
+                    'accounts': [
+                        ['Expenses:Uncategorized', '12 PLN'],
+                        ['Liabilities:Credit Card'],
+                    ],
+                },
+            ])
+        self.assertEqual(response.status_code, 201)
+        append_entries.assert_called_once()
+        self.assertEqual(
+            response.json()['entries'],
+            [
+                {
+                    'payee': 'Auchan',
+                    'date': '2019-02-01',
+                    'accounts': [
+                        ['Expenses:Food', '10.50', 'PLN'],
+                        ['Liabilities:Credit Card', None, None],
+                    ],
+                },
+                {'error': {'date': 'yesterday'}},
+                {
+                    'error': {
+                        'accounts': [['Expenses:Uncategorized', 'one PLN']],
+                    },
+                },
+                {'error': {'invalid_entry': True}},
+                {'error': {'missing': ['accounts']}},
+                {
+                    'payee': 'AUCHAN WARSZAWA',
+                    'date': '2019-02-03',
+                    'note': ':tag:',
+                    'accounts': [
+                        ['Expenses:Uncategorized', '12.00', 'PLN'],
+                        ['Liabilities:Credit Card', None, None],
+                    ],
+                },
+            ],
+        )
+
+        # A single undo point.
+        journal = ledger_api.Journal(
+            self.path,
+            UndoRecord.objects.get(user=self.user),
+        )
+        self.assertEqual(
+            [entry['payee'] for entry in journal],
+            ['Auchan', 'AUCHAN WARSZAWA'],
+        )
+        journal.revert()
+        self.assertEqual(list(journal), [])
+
+    def test_nothing_valid(self):
+        response = self.submit([{'payee': 'CARREFOUR'}])
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(UndoRecord.objects.exists())
+
+    @parameterized.expand([
+        (None, 400),
+        ({}, 400),
+    ])
+    def test_not_a_list(self, entries, expected_status):
+        response = self.submit(entries)
+        self.assertEqual(response.status_code, expected_status)
+
+    def test_authentication(self):
+        response = self.submit([], token='badtesttoken')
+        self.assertEqual(response.status_code, 403)
+
+
+class SubmitTestsV2Async(JournalSubmitTestCase):
+
+    def submit(self, payee, **params):
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch.object(write_queue.writer, 'wake') as wake:
+            response = self.client.post(
+                reverse('ledger_submit:json_v2'),
+                content_type='application/json',
+                data={
+                    'payee': payee,
+                    'accounts': [
+                        ['Expenses:Uncategorized', '10,00', 'PLN'],
+                        ['Liabilities:Credit Card'],
+                    ],
+                    'async': True,
+                    'token': self.good_token,
+                    **params,
+                },
+            )
+        if response.status_code == 202:
+            wake.assert_called_once_with()
+        return response
+
+    def status(self, ticket):
+        return self.client.post(
+            reverse('ledger_submit:json_v2_status'),
+            content_type='application/json',
+            data={'ticket': ticket, 'token': self.good_token},
+        )
+
+    def test_queued(self):
+        response = self.submit('AUCHAN WARSZAWA', date='2019-02-01')
+        self.assertEqual(response.status_code, 202)
+        ticket = response.json()['ticket']
+        self.assertEqual(response.json()['status'], 'queued')
+        self.assertEqual(self.payees(), [])
+        self.assertEqual(self.status(ticket).json()['status'], 'queued')
+
+        self.assertEqual(write_queue.drain(), 1)
+        self.assertEqual(self.payees(), ['Auchan'])
+        self.assertEqual(
+            self.status(ticket).json(),
+            {
+                'ticket': ticket,
+                'status': 'written',
+                'entry': {
+                    'payee': 'Auchan',
+                    'date': '2019-02-01',
+                    'accounts': [
+                        ['Expenses:Food', '10.00', 'PLN'],
+                        ['Liabilities:Credit Card', None, None],
+                    ],
+                },
+            },
+        )
+        self.assertTrue(
+            ledger_api.Journal(
+                self.path,
+                UndoRecord.objects.get(user=self.user),
+            ).can_revert(),
+        )
+        self.assertEqual(write_queue.drain(), 0)
+
+    def test_batches(self):
+        tickets = [
+            self.submit('Payee {}'.format(i)).json()['ticket']
+            for i in range(5)
+        ]
+        with mock.patch.object(
+                ledger_api.Journal,
+                'append_entries',
+                wraps=ledger_api.Journal(self.path).append_entries,
+        ) as append_entries:
+            self.assertEqual(write_queue.drain(batch_size=3), 5)
+        self.assertEqual(append_entries.call_count, 2)
+        self.assertEqual(
+            self.payees(),
+            ['Payee {}'.format(i) for i in range(5)],
+        )
+        for ticket in tickets:
+            self.assertEqual(self.status(ticket).json()['status'], 'written')
+        # Each of them can be reverted on its own.
+        self.assertEqual(UndoRecord.objects.count(), 5)
+
+    def test_write_error(self):
+        ticket = self.submit('Payee').json()['ticket']
+        with mock.patch.object(
+                ledger_api.Journal,
+                'append_entries',
+                side_effect=OSError,
+        ):
+            with self.assertRaises(OSError):
+                write_queue.drain()
+        self.assertEqual(self.status(ticket).json()['status'], 'queued')
+        call_command('drain_submissions', stdout=io.StringIO())
+        self.assertEqual(self.status(ticket).json()['status'], 'written')
+
+    def test_write_error_other_users(self):
+        another_path = os.path.join(self.tmp_dir, 'another.dat')
+        another_user = User.objects.create_user(
+            username='another',
+        )
+        LedgerPath.objects.create(
+            user=another_user,
+            path=another_path,
+        )
+        Token.objects.create(
+            user=another_user,
+            token='anothertoken',
+        )
+        ticket = self.submit('Payee').json()['ticket']
+        invalid = QueuedSubmission.objects.create(
+            user=self.user,
+            params_json='{"payee": "Payee"}',
+        )
+        another_ticket = self.submit(
+            'Another payee',
+            token='anothertoken',
+        ).json()['ticket']
+
+        append_entries = ledger_api.Journal.append_entries
+
+        def failing_append_entries(journal, entries):
+            if journal.path == self.path:
+                raise OSError()
+            return append_entries(journal, entries)
+
+        with mock.patch.object(
+                ledger_api.Journal,
+                'append_entries',
+                autospec=True,
+                side_effect=failing_append_entries,
+        ):
+            with self.assertRaises(OSError):
+                write_queue.drain()
+        self.assertEqual(self.status(ticket).json()['status'], 'queued')
+        invalid.refresh_from_db()
+        self.assertEqual(invalid.status, QueuedSubmission.FAILED)
+        response = self.client.post(
+            reverse('ledger_submit:json_v2_status'),
+            content_type='application/json',
+            data={'ticket': another_ticket, 'token': 'anothertoken'},
+        )
+        self.assertEqual(response.json()['status'], 'written')
+
+    def test_abandoned(self):
+        abandoned = self.submit('Abandoned').json()['ticket']
+        QueuedSubmission.objects.update(
+            status=QueuedSubmission.WRITING,
+            claim=uuid.uuid4(),
+            claimed_at=timezone.now(),
+        )
+        ticket = self.submit('Payee').json()['ticket']
+        # Waits for the older one.
+        self.assertEqual(write_queue.drain(), 0)
+
+        QueuedSubmission.objects.filter(ticket=abandoned).update(
+            claimed_at=timezone.now() - timedelta(
+                seconds=settings.LEDGER_SUBMIT_QUEUE_TIMEOUT,
+            ),
+        )
+        self.assertEqual(write_queue.drain(), 1)
+        self.assertEqual(
+            self.status(abandoned).json(),
+            {
+                'ticket': abandoned,
+                'status': 'failed',
+                'error': {'interrupted': True},
+            },
+        )
+        self.assertEqual(self.status(ticket).json()['status'], 'written')
+        self.assertEqual(self.payees(), ['Payee'])
+
+    def test_claims_serialized(self):
+        self.submit('Payee')
+        os.makedirs(self.cache_dir)
+        lock_path = os.path.join(self.cache_dir, 'submit_queue.lock')
+        with open(lock_path, 'a') as lock_file:
+            # Another drainer claiming at the moment.
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            release = threading.Timer(
+                0.2,
+                fcntl.flock,
+                [lock_file.fileno(), fcntl.LOCK_UN],
+            )
+            start = time.monotonic()
+            release.start()
+            submissions = write_queue._claim(10)
+            self.assertGreaterEqual(time.monotonic() - start, 0.2)
+            release.join()
+        self.assertEqual(len(submissions), 1)
+
+    def test_invalid(self):
+        response = self.submit('Payee', date='yesterday')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.json(), {'error': {'date': 'yesterday'}})
+        self.assertFalse(QueuedSubmission.objects.exists())
+
+    def test_unknown_ticket(self):
+        for ticket in [str(uuid.uuid4()), 'invalid', None]:
+            with self.subTest(ticket=ticket):
+                self.assertEqual(self.status(ticket).status_code, 404)
+
+        ticket = self.submit('Payee').json()['ticket']
+        another_user = User.objects.create_user(
+            username='another',
+        )
+        Token.objects.create(
+            user=another_user,
+            token='anothertoken',
+        )
+        response = self.client.post(
+            reverse('ledger_submit:json_v2_status'),
+            content_type='application/json',
+            data={'ticket': ticket, 'token': 'anothertoken'},
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class SubmitTestsIdempotency(JournalSubmitTestCase):
+
+    def submit(self, payee, url='ledger_submit:json_v2', **params):
+        data = {
+            'payee': payee,
+            'accounts': [
+                ['Expenses:Uncategorized', '10 PLN'],
+                ['Liabilities:Credit Card'],
+            ],
+            'date': '2019-02-01',
+            'token': self.good_token,
+            **params,
+        }
+        if url == 'ledger_submit:json_v1':
+            data.update(
+                amount='10 PLN',
+                account_from='Liabilities:Credit Card',
+                account_to='Expenses:Uncategorized',
+            )
+        return self.client.post(
+            reverse(url),
+            content_type='application/json',
+            data=data,
+        )
+
+    @parameterized.expand([
+        ('ledger_submit:json_v1',),
+        ('ledger_submit:json_v2',),
+    ])
+    def test_repeated(self, url):
+        response = self.submit('Payee', url, idempotency_key='key')
+        self.assertEqual(response.status_code, 201)
+        with mock.patch('ledger_submit.views.apply_rules') as apply_rules, \
+                mock.patch('ledger_submit.views.user_rules') as user_rules:
+            repeated = self.submit('Payee', url, idempotency_key='key')
+        apply_rules.assert_not_called()
+        user_rules.assert_not_called()
+        self.assertEqual(repeated.status_code, 201)
+        self.assertEqual(repeated.json(), response.json())
+        self.assertEqual(self.payees(), ['Payee'])
+
+        self.submit('Payee', url, idempotency_key='another key')
+        self.submit('Payee', url)
+        self.assertEqual(self.payees(), ['Payee'] * 3)
+
+    def test_async(self):
+        with mock.patch.object(write_queue.writer, 'wake'):
+            tickets = [
+                self.submit(
+                    'Payee',
+                    idempotency_key='key',
+                    **{'async': True},
+                ).json()['ticket']
+                for i in range(2)
+            ]
+        self.assertEqual(tickets[0], tickets[1])
+        self.assertEqual(QueuedSubmission.objects.count(), 1)
+
+    def test_in_progress(self):
+        IdempotencyKey.objects.create(
+            user=self.user,
+            endpoint='submit_as_json',
+            key='key',
+        )
+        response = self.submit('Payee', idempotency_key='key')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.payees(), [])
+
+        # Its request must have died.
+        IdempotencyKey.objects.update(
+            created=timezone.now() - timedelta(
+                seconds=settings.LEDGER_IDEMPOTENCY_TIMEOUT + 1,
+            ),
+        )
+        response = self.submit('Payee', idempotency_key='key')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            self.submit('Payee', idempotency_key='key').json(),
+            response.json(),
+        )
+        self.assertEqual(self.payees(), ['Payee'])
+
+    def test_per_endpoint(self):
+        self.submit('Payee', 'ledger_submit:json_v1', idempotency_key='key')
+        response = self.submit('Payee', idempotency_key='key')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['payee'], 'Payee')
+        self.assertIn('accounts', response.json())
+        self.assertEqual(self.payees(), ['Payee', 'Payee'])
+
+    def test_failed(self):
+        with mock.patch.object(
+                ledger_api.Journal,
+                'append_entries',
+                side_effect=OSError,
+        ):
+            with self.assertRaises(OSError):
+                self.submit('Payee', idempotency_key='key')
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.submit(
+            'Payee',
+            idempotency_key='key',
+            date='yesterday',
+            **{'async': True},
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        # Retried successfully.
+        response = self.submit('Payee', idempotency_key='key')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.payees(), ['Payee'])
+
+    def test_expired(self):
+        self.submit('Payee', idempotency_key='key')
+        IdempotencyKey.objects.update(
+            created=timezone.now() - timedelta(
+                seconds=settings.LEDGER_IDEMPOTENCY_TTL + 1,
+            ),
+        )
+        self.submit('Another payee', idempotency_key='another key')
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+        self.submit('Payee', idempotency_key='key')
+        self.assertEqual(
+            self.payees(),
+            ['Payee', 'Another payee', 'Payee'],
+        )
+
+    def test_per_user(self):
+        another_user = User.objects.create_user(
+            username='another',
+        )
+        LedgerPath.objects.create(
+            user=another_user,
+            path=self.path,
+        )
+        Token.objects.create(
+            user=another_user,
+            token='anothertoken',
+        )
+        self.submit('Payee', idempotency_key='key')
+        self.submit(
+            'Another payee',
+            idempotency_key='key',
+            token='anothertoken',
+        )
+        self.assertEqual(self.payees(), ['Payee', 'Another payee'])
+
+    @parameterized.expand([
+        (0,),
+        ('',),
+        ('x' * 257,),
+    ])
+    def test_invalid_key(self, key):
+        response = self.submit('Payee', idempotency_key=key)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.payees(), [])
+
+
+class CompiledRuleTests(TestCase):
+
+    @parameterized.expand([
+        ({'payee': 'AUCHAN.*'}, {'payee': 'AUCHAN KRAKOW', 'note': ''}, True),
+        ({'payee': 'AUCHAN'}, {'payee': 'AUCHAN KRAKOW', 'note': ''}, False),
+        ({'payee': 'A|AUCHAN .*'}, {'payee': 'AUCHAN KRAKOW', 'note': ''}, True),
+        (
+            {'payee': 'Lidl', 'note': ':automatic:'},
+            {'payee': 'Lidl', 'note': ':automatic:'},
+            True,
+        ),
+        (
+            {'payee': 'Lidl', 'note': ':automatic:'},
+            {'payee': 'Lidl', 'note': ''},
+            False,
+        ),
+        ({'payee': 'AUCHAN('}, {'payee': 'AUCHAN(', 'note': ''}, False),
+        ({'note': '['}, {'payee': 'Lidl', 'note': '['}, False),
+    ])
+    def test_check(self, rule, ledger_data, expected):
+        rule = rules.CompiledRule(Rule(**rule))
+        self.assertEqual(rule.check(ledger_data) is not None, expected)
+
+    def test_compiled_once(self):
+        with mock.patch.object(
+                rules.re, 'compile',
+                wraps=re.compile,
+        ) as compile_regexp:
+            rule = rules.CompiledRule(Rule(payee='Lidl', note='(:x:'))
+            self.assertFalse(rule.valid)
+            for payee in ['Lidl', 'Auchan', 'Lidl']:
+                self.assertIsNone(rule.check({'payee': payee, 'note': ':x:'}))
+        self.assertEqual(compile_regexp.call_count, 2)
+
+
+class UserRulesTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='tester',
+        )
+        Rule.objects.create(
+            user=self.user,
+            payee='AUCHAN.*',
+            new_payee='Auchan',
+        )
+        Rule.objects.create(
+            user=self.user,
+            payee='AUCHAN WARSZAWA',
+            new_payee='Auchan Warszawa',
+        )
+
+    def payees(self):
+        return [rule.rule.payee for rule in rules.user_rules(self.user)]
+
+    def test_cached(self):
+        self.assertEqual(self.payees(), ['AUCHAN WARSZAWA', 'AUCHAN.*'])
+        with self.assertNumQueries(1):
+            cached = rules.user_rules(self.user)
+        self.assertIs(cached, rules.user_rules(self.user))
+
+    def test_invalidated_by_changes(self):
+        self.payees()
+        rule = Rule.objects.create(
+            user=self.user,
+            payee='Lidl',
+        )
+        self.assertEqual(
+            self.payees(),
+            ['AUCHAN WARSZAWA', 'AUCHAN.*', 'Lidl'],
+        )
+        rule.payee = 'Lidl.*'
+        rule.save()
+        self.assertEqual(
+            self.payees(),
+            ['AUCHAN WARSZAWA', 'AUCHAN.*', 'Lidl.*'],
+        )
+        rule.delete()
+        self.assertEqual(self.payees(), ['AUCHAN WARSZAWA', 'AUCHAN.*'])
+
+    def test_invalidated_by_other_processes(self):
+        self.payees()
+        # Changed behind our back, without invalidating our cache.
+        Rule.objects.filter(payee='AUCHAN.*').update(payee='Auchan.*')
+        self.assertEqual(self.payees(), ['AUCHAN WARSZAWA', 'AUCHAN.*'])
+        # What the other processes do when changing the rules.
+        RuleSetVersion.objects.filter(pk=self.user.pk).update(
+            stamp=uuid.uuid4(),
+        )
+        self.assertEqual(self.payees(), ['AUCHAN WARSZAWA', 'Auchan.*'])
+
+    def test_delete_user(self):
+        self.payees()
+        self.user.delete()
+        self.assertFalse(Rule.objects.exists())
+        self.assertFalse(RuleSetVersion.objects.exists())
+
+
+class RuleMatcherTests(TestCase):
+
+    def test_candidates(self):
+        matcher = rules.RuleMatcher(
+            rules.CompiledRule(Rule(**rule))
+            for rule in [
+                {'payee': 'AUCHAN WARSZAWA'},
+                {'payee': 'AUCHAN.*'},
+                {'payee': 'Lidl|Biedronka'},
+                {'payee': 'Lidl', 'note': ':automatic:'},
+                {'payee': 'Lidl('},
+                {'note': '.*:food:.*'},
+            ]
+        )
+        self.assertEqual(
+            [
+                rule.rule.payee or rule.rule.note
+                for rule in matcher.candidates({
+                    'payee': 'AUCHAN KRAKOW',
+                    'note': ':food:',
+                })
+            ],
+            ['AUCHAN.*', '.*:food:.*'],
+        )
+        self.assertEqual(
+            [
+                rule.rule.payee or rule.rule.note
+                for rule in matcher.candidates({
+                    'payee': 'Biedronka',
+                    'note': '',
+                })
+            ],
+            ['Lidl|Biedronka'],
+        )
+        self.assertEqual(
+            [
+                rule.rule.payee
+                for rule in matcher.candidates({
+                    'payee': 'Lidl',
+                    'note': ':automatic:',
+                })
+            ],
+            ['Lidl|Biedronka', 'Lidl'],
+        )
+
+    def test_literal_automaton(self):
+        automaton = rules.LiteralAutomaton(
+            (literal, literal)
+            for literal in ['he', 'she', 'his', 'hers', 'is']
+        )
+        self.assertEqual(automaton.search('ushers'), {'he', 'she', 'hers'})
+        self.assertEqual(automaton.search('this'), {'his', 'is'})
+        self.assertEqual(automaton.search(''), set())
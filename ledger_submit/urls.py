@@ -7,4 +7,6 @@ urlpatterns = [
     path('', views.submit_as_json_v1),
     path('v1/', views.submit_as_json_v1, name='json_v1'),
     path('v2/', views.submit_as_json, name='json_v2'),
+    path('v2/status/', views.submission_status, name='json_v2_status'),
+    path('v3/batch/', views.submit_batch, name='json_v3_batch'),
 ]
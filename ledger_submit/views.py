@@ -1,25 +1,35 @@
 from django.conf import settings
-from django.db.models.functions import Length
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.http import JsonResponse
+from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import re
 
-from .models import Rule, Token
-from ledger_ui.models import Undo
+from . import write_queue
+from .models import IdempotencyKey, QueuedSubmission, Token
+from .rules import compiled, user_rules
+from ledger_ui import rollups, undo_log
 from utils import ledger_api
 
 
 def require_token(view):
+    """Authenticate the request with the token from its JSON body.
+
+    The parsed body is available to the view as request.json.
+
+    """
     def inner(request, *args, **kwargs):
         try:
             params = json.loads(request.body)
             token = params['token']
             token_obj = Token.objects.get(token=token)
             request.user = token_obj.user
+            request.json = params
         except json.decoder.JSONDecodeError:
             return JsonResponse(
                 {
@@ -52,6 +62,101 @@ def require_token(view):
     return inner
 
 
+def idempotent(view):
+    """Respond to a repeated submission with the response to the first one.
+
+    Applies only to the requests with an idempotency_key in their JSON
+    body (see require_token), the other ones are passed through.  The
+    successful responses are remembered for LEDGER_IDEMPOTENCY_TTL
+    seconds, so a retried submission doesn't get written twice.  A
+    submission still not handled after LEDGER_IDEMPOTENCY_TIMEOUT
+    seconds is assumed to be abandoned and can be retried.
+
+    """
+    def replay(key, record):
+        if record is None or record.status is None:
+            # Still being handled, it's unknown yet whether it succeeds.
+            return JsonResponse(
+                {
+                    'error': {
+                        'in_progress': key,
+                    },
+                },
+                status=409,
+            )
+        return JsonResponse(
+            json.loads(record.response_json),
+            status=record.status,
+        )
+
+    def take_over(record, now):
+        """Start handling the submission again if it was abandoned.
+
+        Returns False if it wasn't, or if someone else just took it
+        over.
+
+        """
+        return bool(IdempotencyKey.objects.filter(
+            pk=record.pk,
+            status=None,
+            created__lt=now - timedelta(
+                seconds=settings.LEDGER_IDEMPOTENCY_TIMEOUT,
+            ),
+        ).update(created=now))
+
+    def inner(request, *args, **kwargs):
+        key = request.json.get('idempotency_key')
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not isinstance(key, str) or not 1 <= len(key) <= 256:
+            return JsonResponse(
+                {
+                    'error': {
+                        'idempotency_key': key,
+                    },
+                },
+                status=400,
+            )
+
+        now = timezone.now()
+        expiry = now - timedelta(seconds=settings.LEDGER_IDEMPOTENCY_TTL)
+        keys = IdempotencyKey.objects.filter(
+            user=request.user,
+            endpoint=view.__name__,
+            key=key,
+        )
+        record = keys.filter(created__gte=expiry).first()
+        if record is None:
+            IdempotencyKey.objects.filter(created__lt=expiry).delete()
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=request.user,
+                        endpoint=view.__name__,
+                        key=key,
+                    )
+            except IntegrityError:
+                # The same submission made concurrently.
+                return replay(key, keys.first())
+        elif record.status is not None or not take_over(record, now):
+            return replay(key, record)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            record.delete()
+            raise
+        if 200 <= response.status_code < 300:
+            record.status = response.status_code
+            record.response_json = response.content.decode()
+            record.save(update_fields=['status', 'response_json'])
+        else:
+            # Let it be retried.
+            record.delete()
+        return response
+    return inner
+
+
 # <LEGACY>
 def add_ledger_entry_v1(
         user,
@@ -65,19 +170,16 @@ def add_ledger_entry_v1(
 ):
     ledger_path = user.ledger_path.path
     if not skip_rules:
-        replacement_rules = (
-            Rule.objects.filter(user=user).order_by(Length('payee').desc())
+        replacement_rules = sorted(
+            user_rules(user),
+            key=lambda rule: len(rule.rule.payee),
+            reverse=True,
         )
         for rule in replacement_rules:
-            try:
-                match = re.fullmatch(rule.payee, payee)
-            except re.error:
-                pass
-            else:
-                if match:
-                    payee = rule.new_payee or payee
-                    account_to = rule.account or account_to
-                    break
+            if rule.legacy_payee_match(payee):
+                payee = rule.rule.new_payee or payee
+                account_to = rule.rule.account or account_to
+                break
 
     amount = amount.replace(",", ".").strip()
 
@@ -96,23 +198,19 @@ def add_ledger_entry_v1(
         ],
         date=date,
     )
-    old, new = ledger_api.Journal(ledger_path).append(entry)
-    Undo.objects.update_or_create(
-        pk=user.id,
-        defaults={
-            'last_entry': entry,
-            'old_position': old,
-            'new_position': new,
-        },
-    )
+    journal = ledger_api.Journal(ledger_path)
+    old, new, data = journal.append(entry)
+    rollups.entry_appended(user, journal, entry, old, new)
+    undo_log.record(user, entry, old, new, data)
     return entry
 
 
 @require_POST
 @csrf_exempt
 @require_token
+@idempotent
 def submit_as_json_v1(request):
-    params = json.loads(request.body)
+    params = request.json
     ledger_data = {
         'payee': params['payee'],
         'amount': params['amount'],
@@ -137,57 +235,46 @@ def submit_as_json_v1(request):
 # </LEGACY>
 
 
+ANY_REGEXP = re.compile(r'^.*$')
+
+
 def check_rule(ledger_data, rule):
-    matches = {}
-    for field in ['payee', 'note']:
-        condition = getattr(rule, field)
-        if condition:
-            try:
-                matches[field] = re.match(
-                    '^(?:{})$'.format(condition),
-                    ledger_data[field],
-                )
-                if not matches[field]:
-                    return None
-            except re.error:
-                return None
-    if all(matches.values()):
-        return matches
-    else:
-        return None
+    """Check the rule (either a Rule or a CompiledRule) against an entry.
+
+    Pass a CompiledRule when checking many entries, so the rule gets
+    compiled only once.
+
+    """
+    return compiled(rule).check(ledger_data)
 
 
 def apply_rule(ledger_data, rule):
-    matches = check_rule(ledger_data, rule)
+    rule = compiled(rule)
+    matches = rule.check(ledger_data)
 
     if matches is not None:
         for field in ['payee', 'note']:
-            replacement = getattr(rule, 'new_{}'.format(field))
+            replacement = getattr(rule.rule, 'new_{}'.format(field))
             if replacement or field in matches:
                 try:
                     regex = matches[field].re
                 except KeyError:
-                    regex = re.compile(r'^.*$')
+                    regex = ANY_REGEXP
                 ledger_data[field] = regex.sub(
-                    getattr(rule, 'new_{}'.format(field)),
+                    replacement,
                     ledger_data[field],
                 )
         for account in ledger_data['accounts']:
             acc_name = account[0]
             if acc_name == settings.LEDGER_DEFAULT_TO:
-                account[0] = rule.account or acc_name
+                account[0] = rule.rule.account or acc_name
         return True
     else:
         return False
 
 
 def apply_rules(ledger_data, user):
-    replacement_rules = (
-        Rule.objects.filter(user=user).order_by(
-            *(Length(field).desc() for field in ['payee', 'note'])
-        )
-    )
-    for rule in replacement_rules:
+    for rule in user_rules(user).candidates(ledger_data):
         if apply_rule(ledger_data, rule):
             return True
     return False
@@ -202,11 +289,31 @@ def normalize_data(ledger_data):
     return ledger_data
 
 
+def entry_response(entry):
+    response_data = {
+        'payee': entry.payee,
+        'date': entry.date,
+        'accounts': [
+            list(account._asdict().values())
+            for account in entry.accounts
+        ],
+    }
+    optionals = {}
+    if entry.note:
+        optionals['note'] = entry.note
+    response_data.update(optionals)
+    return response_data
+
+
 @require_POST
 @csrf_exempt
 @require_token
+@idempotent
 def submit_as_json(request):
-    params = json.loads(request.body)
+    params = request.json
+    if params.get('async', False):
+        return submit_async(request)
+
     ledger_data = {
         'payee': params['payee'],
         'date': params.get('date', datetime.now().strftime("%F")),
@@ -220,27 +327,178 @@ def submit_as_json(request):
 
     entry = ledger_api.Entry(**ledger_data)
 
-    old, new = ledger_api.Journal(request.user.ledger_path.path).append(entry)
-    Undo.objects.update_or_create(
-        pk=request.user.id,
-        defaults={
-            'last_entry': entry,
-            'old_position': old,
-            'new_position': new,
+    journal = ledger_api.Journal(request.user.ledger_path.path)
+    old, new, data = journal.append(entry)
+    rollups.entry_appended(request.user, journal, entry, old, new)
+    undo_log.record(request.user, entry, old, new, data)
+
+    return JsonResponse(entry_response(entry), status=201)
+
+
+def submit_async(request):
+    """Queue the v2 submission to be written in the background.
+
+    Only checks whether the entry is valid, the rules are applied
+    when it gets written.  Responds with the ticket to check its
+    status with (see submission_status).
+
+    """
+    params = {
+        key: value
+        for key, value in request.json.items()
+        if key not in ['token', 'async', 'idempotency_key']
+    }
+    try:
+        ledger_data = validated_data(params)
+    except ValueError as e:
+        return JsonResponse({'error': e.args[0]}, status=422)
+    # The date of the submission, not of the write.
+    params['date'] = ledger_data['date']
+
+    submission = write_queue.enqueue(request.user, params)
+    return JsonResponse(
+        {
+            'ticket': submission.ticket,
+            'status': submission.status,
         },
+        status=202,
     )
 
+
+@require_POST
+@csrf_exempt
+@require_token
+def submission_status(request):
+    ticket = request.json.get('ticket')
+    try:
+        submission = QueuedSubmission.objects.get(
+            user=request.user,
+            ticket=ticket,
+        )
+    except (QueuedSubmission.DoesNotExist, ValidationError):
+        return JsonResponse(
+            {
+                'error': {
+                    'ticket': ticket,
+                },
+            },
+            status=404,
+        )
+
     response_data = {
-        'payee': entry.payee,
-        'date': entry.date,
-        'accounts': [
-            list(account._asdict().values())
-            for account in entry.accounts
-        ],
+        'ticket': submission.ticket,
+        'status': submission.status,
     }
-    optionals = {}
-    if entry.note:
-        optionals['note'] = entry.note
-    response_data.update(optionals)
+    if submission.status == QueuedSubmission.WRITTEN:
+        response_data['entry'] = json.loads(submission.result_json)
+    elif submission.status == QueuedSubmission.FAILED:
+        response_data.update(json.loads(submission.result_json))
+    return JsonResponse(response_data)
+
+
+def validated_data(params):
+    """Check a single v2 entry, returning its ledger_data.
+
+    The amounts in the returned data are already normalized.  Raises
+    ValueError with the error details if the entry is invalid.
+
+    """
+    if not isinstance(params, dict):
+        raise ValueError({'invalid_entry': True})
+    missing = [field for field in ['payee', 'accounts'] if field not in params]
+    if missing:
+        raise ValueError({'missing': missing})
+
+    ledger_data = {
+        'payee': params['payee'],
+        'date': params.get('date', datetime.now().strftime("%F")),
+        'accounts': params['accounts'],
+        'note': params.get('note', ''),
+    }
+    for field in ['payee', 'date', 'note']:
+        if not isinstance(ledger_data[field], str):
+            raise ValueError({field: ledger_data[field]})
+    try:
+        datetime.strptime(ledger_data['date'], "%Y-%m-%d")
+    except ValueError:
+        raise ValueError({'date': ledger_data['date']}) from None
+    if (not isinstance(ledger_data['accounts'], list)
+            or not all(
+                isinstance(account, list)
+                and 1 <= len(account) <= 3
+                and isinstance(account[0], str)
+                for account in ledger_data['accounts']
+            )):
+        raise ValueError({'accounts': ledger_data['accounts']})
+    # The rules modify the accounts in place.
+    ledger_data['accounts'] = [
+        list(account) for account in ledger_data['accounts']
+    ]
+    normalize_data(ledger_data)
+
+    try:
+        ledger_api.Entry(**ledger_data)
+    except (TypeError, ValueError):
+        raise ValueError({'accounts': params['accounts']}) from None
+    return ledger_data
+
+
+def batch_entry(params, rules):
+    """Build an Entry out of a single element of a batch, like v2 does.
+
+    Raises ValueError with the error details if it's invalid.
+
+    """
+    ledger_data = validated_data(params)
+    if not params.get('skip_rules', False):
+        for rule in rules.candidates(ledger_data):
+            if apply_rule(ledger_data, rule):
+                break
+    return ledger_api.Entry(**ledger_data)
+
+
+@require_POST
+@csrf_exempt
+@require_token
+@idempotent
+def submit_batch(request):
+    """Submit many entries at once, each one like with submit_as_json.
+
+    The valid entries get written with a single append and can be
+    reverted together, the invalid ones are reported in their place.
+
+    """
+    entries = request.json.get('entries')
+    if not isinstance(entries, list):
+        return JsonResponse(
+            {
+                'error': {
+                    'entries': entries,
+                },
+            },
+            status=400,
+        )
+
+    rules = user_rules(request.user)
+    results = []
+    batch = ledger_api.EntryBatch()
+    for params in entries:
+        try:
+            entry = batch_entry(params, rules)
+        except ValueError as e:
+            results.append({'error': e.args[0]})
+        else:
+            results.append(entry_response(entry))
+            batch.append(entry)
+
+    if not batch:
+        return JsonResponse({'entries': results}, status=422)
+
+    journal = ledger_api.Journal(request.user.ledger_path.path)
+    appended = journal.append_entries(batch)
+    old, new = appended[0].old_position, appended[-1].new_position
+    data = b''.join(entry.data for entry in appended)
+    rollups.entry_appended(request.user, journal, batch, old, new)
+    undo_log.record(request.user, batch, old, new, data)
 
-    return JsonResponse(response_data, status=201)
+    return JsonResponse({'entries': results}, status=201)
@@ -0,0 +1,262 @@
+"""The queue of the submissions to be written in the background.
+
+The submissions made with "async" are only validated and stored as
+QueuedSubmissions by the view, so the client doesn't wait for the rules
+and the journal.  drain() writes them later: either in a thread of the
+process which queued them (see QueueWriter), or with the
+drain_submissions management command.
+
+"""
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from collections import OrderedDict
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import uuid
+
+from .models import QueuedSubmission
+from .rules import user_rules
+from ledger_ui import rollups, undo_log
+from utils import ledger_api
+
+
+def enqueue(user, params):
+    """Queue a validated v2 submission, returning its QueuedSubmission."""
+    submission = QueuedSubmission.objects.create(
+        user=user,
+        params_json=json.dumps(params),
+    )
+    transaction.on_commit(writer.wake)
+    return submission
+
+
+@contextlib.contextmanager
+def _claim_lock():
+    """Serialize the claims of all the drainers, in any process."""
+    lock_dir = settings.LEDGER_CACHE_DIR or tempfile.gettempdir()
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, 'submit_queue.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _claim(batch_size):
+    """Mark up to batch_size of the oldest queued submissions as ours.
+
+    The submissions of the users whose older ones are still being
+    written by someone else are skipped, to keep them in order.  For
+    that the claims are made one at a time, see _claim_lock().
+
+    The claims older than LEDGER_SUBMIT_QUEUE_TIMEOUT are assumed to
+    be abandoned, their submissions are marked as failed.  Whoever
+    claimed them could have died just after writing them, so they're
+    not retried.
+
+    """
+    with _claim_lock():
+        now = timezone.now()
+        QueuedSubmission.objects.filter(
+            status=QueuedSubmission.WRITING,
+            claimed_at__lte=now - datetime.timedelta(
+                seconds=settings.LEDGER_SUBMIT_QUEUE_TIMEOUT,
+            ),
+        ).update(
+            status=QueuedSubmission.FAILED,
+            claim=None,
+            result_json=json.dumps({'error': {'interrupted': True}}),
+        )
+
+        busy = QueuedSubmission.objects.filter(
+            status=QueuedSubmission.WRITING,
+        ).values('user')
+        pks = list(QueuedSubmission.objects.filter(
+            status=QueuedSubmission.QUEUED,
+        ).exclude(
+            user__in=busy,
+        ).order_by('pk').values_list('pk', flat=True)[:batch_size])
+
+        claim = uuid.uuid4()
+        QueuedSubmission.objects.filter(
+            pk__in=pks,
+            status=QueuedSubmission.QUEUED,
+        ).update(
+            status=QueuedSubmission.WRITING,
+            claim=claim,
+            claimed_at=now,
+        )
+    return list(QueuedSubmission.objects.filter(
+        claim=claim,
+    ).select_related('user__ledger_path').order_by('pk'))
+
+
+def _requeue(submissions):
+    """Put the claimed submissions back in the queue, to retry them later."""
+    QueuedSubmission.objects.filter(
+        pk__in=[submission.pk for submission in submissions],
+        # Unless they were considered abandoned since.
+        claim=submissions[0].claim,
+        status=QueuedSubmission.WRITING,
+    ).update(
+        status=QueuedSubmission.QUEUED,
+        claim=None,
+        claimed_at=None,
+    )
+
+
+def _write(submissions):
+    """Write the submissions of a single user with a single append.
+
+    If that fails, the valid ones are put back in the queue, and the
+    invalid ones are still marked as failed.
+
+    """
+    # Imported here, as the views use this module.
+    from .views import batch_entry, entry_response
+
+    user = submissions[0].user
+    failed = []
+    written = []
+    try:
+        rules = user_rules(user)
+        for submission in submissions:
+            try:
+                entry = batch_entry(
+                    json.loads(submission.params_json),
+                    rules,
+                )
+            except ValueError as e:
+                submission.status = QueuedSubmission.FAILED
+                submission.result_json = json.dumps({'error': e.args[0]})
+                failed.append(submission)
+            else:
+                written.append((submission, entry))
+
+        if written:
+            journal = ledger_api.Journal(user.ledger_path.path)
+            batch = ledger_api.EntryBatch(entry for _, entry in written)
+            appended = journal.append_entries(batch)
+    except BaseException:
+        # Nothing got written.
+        _requeue([
+            submission
+            for submission in submissions
+            if submission not in failed
+        ])
+        raise
+    finally:
+        QueuedSubmission.objects.bulk_update(
+            failed,
+            ['status', 'result_json'],
+        )
+    if not written:
+        return
+
+    for submission, entry in written:
+        submission.status = QueuedSubmission.WRITTEN
+        submission.result_json = json.dumps(entry_response(entry))
+    QueuedSubmission.objects.bulk_update(
+        [submission for submission, _ in written],
+        ['status', 'result_json'],
+    )
+    rollups.entry_appended(
+        user,
+        journal,
+        batch,
+        appended[0].old_position,
+        appended[-1].new_position,
+    )
+    for (submission, entry), (old, new, data) in zip(written, appended):
+        undo_log.record(user, entry, old, new, data)
+
+
+def drain(batch_size=None):
+    """Write the queued submissions to the journals, the oldest first.
+
+    They're taken batch_size (LEDGER_SUBMIT_QUEUE_BATCH by default)
+    at a time and written with a single append per user.  Each of them
+    can be reverted on its own, just like if it was submitted
+    synchronously.  Returns the number of the submissions processed.
+
+    If the submissions of some user couldn't be written, the other
+    users' ones from the same batch still are, and then the error is
+    raised.
+
+    """
+    if batch_size is None:
+        batch_size = settings.LEDGER_SUBMIT_QUEUE_BATCH
+    processed = 0
+    while True:
+        submissions = _claim(batch_size)
+        if not submissions:
+            return processed
+        by_user = OrderedDict()
+        for submission in submissions:
+            by_user.setdefault(submission.user_id, []).append(submission)
+        pending = list(by_user.values())
+        error = None
+        try:
+            while pending:
+                user_submissions = pending.pop(0)
+                try:
+                    _write(user_submissions)
+                except Exception as e:
+                    if error is None:
+                        error = e
+        finally:
+            # If interrupted.
+            for user_submissions in pending:
+                _requeue(user_submissions)
+        if error is not None:
+            raise error
+        processed += len(submissions)
+
+
+class QueueWriter:
+    """Runs drain() in a background thread whenever woken up.
+
+    The thread exits once there is nothing left to write, so an idle
+    process doesn't keep it around.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = False
+
+    def wake(self):
+        with self._lock:
+            self._pending = True
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run,
+                    daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        self._thread = None
+                        return
+                    self._pending = False
+                drain()
+        except BaseException:
+            with self._lock:
+                self._thread = None
+            raise
+        finally:
+            connection.close()
+
+
+writer = QueueWriter()
@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class LedgerUiConfig(AppConfig):
     name = 'ledger_ui'
     verbose_name = 'Ledger UI'
+
+    def ready(self):
+        from utils import ledger_api
+        ledger_api.Journal.cache_dir = settings.LEDGER_CACHE_DIR
+        ledger_api.JournalIndex.parse_workers = settings.LEDGER_PARSE_WORKERS
+        ledger_api.JournalIndex.parallel_parse_threshold = (
+            settings.LEDGER_PARALLEL_PARSE_THRESHOLD
+        )
+        ledger_api.Journal.workers.max_size = settings.LEDGER_CLI_WORKERS
+        ledger_api.Journal.workers.idle_timeout = (
+            settings.LEDGER_CLI_IDLE_TIMEOUT
+        )
+        ledger_api.Journal.report_cache.max_size = (
+            settings.LEDGER_REPORT_CACHE_SIZE
+        )
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ledger_ui', '0005_recreate_undo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='auth.user')),
+                ('inode', models.BigIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('mtime_ns', models.BigIntegerField()),
+                ('tail_digest', models.BinaryField()),
+                ('previous_size', models.BigIntegerField(null=True)),
+                ('previous_digest', models.BinaryField(null=True)),
+                ('supported', models.BooleanField(default=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('account', models.CharField(max_length=512)),
+                ('commodity', models.CharField(blank=True, max_length=64)),
+                ('amount', models.FloatField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'month', 'account', 'commodity')},
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 3.2.25 on 2026-10-18 19:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+import json
+import locale
+import pickle
+
+from utils import ledger_api
+
+
+def undo_to_records(apps, schema_editor):
+    Undo = apps.get_model('ledger_ui', 'Undo')
+    UndoRecord = apps.get_model('ledger_ui', 'UndoRecord')
+    for undo in Undo.objects.all():
+        last_entry = pickle.loads(undo.last_entry_pickle)
+        batch = isinstance(last_entry, ledger_api.EntryBatch)
+        entries = last_entry if batch else [last_entry]
+        # What Journal.append wrote.
+        data = ''.join('{}\n'.format(entry) for entry in entries)
+        UndoRecord.objects.create(
+            user_id=undo.user_id,
+            old_position=undo.old_position,
+            new_position=undo.new_position,
+            digest=ledger_api.Journal.digest(
+                data.encode(locale.getpreferredencoding(False)),
+            ),
+            entries_json=json.dumps([
+                {
+                    'date': entry.date,
+                    'payee': entry.payee,
+                    'note': entry.note,
+                    'accounts': [list(account) for account in entry.accounts],
+                }
+                for entry in entries
+            ]),
+            batch=batch,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ledger_ui', '0006_monthlyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UndoRecord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_position', models.BigIntegerField()),
+                ('new_position', models.BigIntegerField()),
+                ('digest', models.BinaryField(max_length=16)),
+                ('entries_json', models.TextField()),
+                ('batch', models.BooleanField(default=False)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(undo_to_records, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='Undo',
+        ),
+    ]
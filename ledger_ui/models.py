@@ -1,7 +1,9 @@
 from django.contrib.auth.models import User
 from django.db import models
 
-import pickle
+import json
+
+from utils import ledger_api
 
 
 class LedgerPath(models.Model):
@@ -17,21 +19,94 @@ class LedgerPath(models.Model):
         return "{}: {}".format(self.user, self.path)
 
 
-class Undo(models.Model):
-    user = models.OneToOneField(
+class UndoRecord(models.Model):
+    """An entry (or a batch of them) appended to a journal by a user.
+
+    The span of the file it was written to is identified by the digest
+    of its contents (see Journal.digest), so it can be reverted as long
+    as the journal still ends with it.  The entries themselves are kept
+    as JSON only to prefill the form when amending them.
+
+    """
+
+    user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        primary_key=True,
     )
-
-    last_entry_pickle = models.BinaryField()
-    old_position = models.PositiveIntegerField()
-    new_position = models.PositiveIntegerField()
+    old_position = models.BigIntegerField()
+    new_position = models.BigIntegerField()
+    digest = models.BinaryField(max_length=16)
+    entries_json = models.TextField()
+    # Submitted with the batch API, can't be amended.
+    batch = models.BooleanField(default=False)
 
     @property
     def last_entry(self):
-        return pickle.loads(self.last_entry_pickle)
+        entries = [
+            ledger_api.Entry(
+                date=entry['date'],
+                payee=entry['payee'],
+                note=entry['note'],
+                accounts=entry['accounts'],
+            )
+            for entry in json.loads(self.entries_json)
+        ]
+        if self.batch:
+            return ledger_api.EntryBatch(entries)
+        return entries[0]
 
     @last_entry.setter
-    def last_entry(self, entry):
-        self.last_entry_pickle = pickle.dumps(entry)
+    def last_entry(self, value):
+        self.batch = isinstance(value, ledger_api.EntryBatch)
+        self.entries_json = json.dumps([
+            {
+                'date': entry.date,
+                'payee': entry.payee,
+                'note': entry.note,
+                'accounts': [list(account) for account in entry.accounts],
+            }
+            for entry in (value if self.batch else [value])
+        ])
+
+
+class MonthlyRollup(models.Model):
+    """The monthly total of the real postings to an account."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+    )
+    # The first day of the month.
+    month = models.DateField()
+    account = models.CharField(max_length=512)
+    commodity = models.CharField(max_length=64, blank=True)
+    amount = models.FloatField()
+
+    class Meta:
+        unique_together = [['user', 'month', 'account', 'commodity']]
+
+
+class RollupState(models.Model):
+    """Which state of the journal the MonthlyRollups of a user reflect.
+
+    The journal is identified like by the JournalIndex: by the inode,
+    size and mtime of the file and the digest of its tail.  The size
+    and digest from before the last appended entry allow reverting it
+    without rebuilding the rollups.
+
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    inode = models.BigIntegerField()
+    size = models.BigIntegerField()
+    mtime_ns = models.BigIntegerField()
+    tail_digest = models.BinaryField()
+    previous_size = models.BigIntegerField(null=True)
+    previous_digest = models.BinaryField(null=True)
+    # Whether the native parser supports the journal at all.  If not,
+    # there are no rollups.
+    supported = models.BooleanField(default=True)
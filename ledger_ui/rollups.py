@@ -0,0 +1,271 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+import datetime
+import numpy as np
+import os
+import pandas as pd
+
+from .models import MonthlyRollup, RollupState
+from utils import ledger_api
+
+
+def _stat_key(ledger_file):
+    file_stat = os.fstat(ledger_file.fileno())
+    return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+
+def _totals(postings):
+    """Return the monthly totals of the real postings.
+
+    They're keyed by (month, account, commodity), the month being its
+    first day.
+
+    """
+    if not len(postings):
+        return {}
+    months = np.array([date[:7] for date in postings.dates], dtype=object)
+    df = pd.DataFrame({
+        'month': months[postings.entries],
+        'account': pd.Categorical.from_codes(
+            postings.accounts, postings.account_names,
+        ),
+        'commodity': pd.Categorical.from_codes(
+            postings.commodities, postings.commodity_names,
+        ),
+        'amount': postings.amounts,
+    })
+    # Like ledger --real.
+    df = df[~df['account'].str.match(r'[(\[]')]
+    totals = df.groupby(
+        ['month', 'account', 'commodity'], observed=True,
+    )['amount'].sum()
+    return {
+        (
+            datetime.date(int(month[:4]), int(month[5:7]), 1),
+            account,
+            commodity,
+        ): amount
+        for (month, account, commodity), amount in totals.items()
+        if round(amount, 9)
+    }
+
+
+def _entry_totals(entry):
+    """Return the monthly totals of an Entry, see _totals()."""
+    data = str(entry).encode()
+    return _totals(ledger_api.parse_postings(
+        ledger_api.JournalEntries(ledger_api.scan_entries(data), data),
+    ))
+
+
+def _add(user, totals, sign=1):
+    for (month, account, commodity), amount in totals.items():
+        rollups = MonthlyRollup.objects.filter(
+            user=user,
+            month=month,
+            account=account,
+            commodity=commodity,
+        )
+        if not rollups.update(amount=F('amount') + sign * amount):
+            MonthlyRollup.objects.create(
+                user=user,
+                month=month,
+                account=account,
+                commodity=commodity,
+                amount=sign * amount,
+            )
+    # What got reverted.
+    MonthlyRollup.objects.filter(
+        user=user,
+        amount__gt=-1e-9,
+        amount__lt=1e-9,
+    ).delete()
+
+
+def rebuild(user, journal):
+    """Compute the rollups of the whole journal, returning the RollupState."""
+    # The journal may change while it's being parsed, so let's take
+    # its older state.  The rollups get rebuilt again next time then.
+    with open(journal.path, 'rb') as ledger_file:
+        inode, size, mtime_ns = _stat_key(ledger_file)
+        tail_digest = ledger_api.tail_digest(ledger_file, size)
+    try:
+        totals = _totals(journal.postings())
+        supported = True
+    except journal.Unsupported:
+        totals = {}
+        supported = False
+
+    with transaction.atomic():
+        MonthlyRollup.objects.filter(user=user).delete()
+        MonthlyRollup.objects.bulk_create(
+            MonthlyRollup(
+                user=user,
+                month=month,
+                account=account,
+                commodity=commodity,
+                amount=amount,
+            )
+            for (month, account, commodity), amount in totals.items()
+        )
+        state, _ = RollupState.objects.update_or_create(
+            pk=user.pk,
+            defaults={
+                'inode': inode,
+                'size': size,
+                'mtime_ns': mtime_ns,
+                'tail_digest': tail_digest,
+                'previous_size': None,
+                'previous_digest': None,
+                'supported': supported,
+            },
+        )
+    return state
+
+
+def _still_unsupported(state, ledger_file, stat_key):
+    """Move the state of an unsupported journal to its new stat_key.
+
+    Returns whether it was possible, which is if the journal was only
+    appended to: what made it unsupported is still there.
+
+    """
+    inode, size, mtime_ns = stat_key
+    if (state.supported
+            or inode != state.inode
+            or size <= state.size
+            or ledger_api.tail_digest(ledger_file, state.size)
+            != bytes(state.tail_digest)):
+        return False
+    tail_digest = ledger_api.tail_digest(ledger_file, size)
+    # Unless it got rebuilt in the meantime.
+    RollupState.objects.filter(
+        pk=state.pk,
+        inode=state.inode,
+        size=state.size,
+        mtime_ns=state.mtime_ns,
+        supported=False,
+    ).update(size=size, mtime_ns=mtime_ns, tail_digest=tail_digest)
+    return True
+
+
+def monthly(user, journal):
+    """Return the monthly totals for the charts, from the rollups.
+
+    The DataFrame has the date, account and amount columns, like
+    `ledger csv --real --monthly` has.  The rollups are rebuilt if
+    the journal changed in any other way than with entry_appended()
+    and entry_reverted().
+
+    Returns None if the rollups can't be used: if the native engine
+    is disabled, or the journal isn't supported by it or uses other
+    commodities than the default one (which would need converting).
+    An unsupported journal stays so when appended to, so it isn't
+    parsed again until it changes otherwise.
+
+    """
+    if settings.LEDGER_ENGINE != 'native':
+        return None
+
+    state = RollupState.objects.filter(pk=user.pk).first()
+    with open(journal.path, 'rb') as ledger_file:
+        stat_key = _stat_key(ledger_file)
+        if (state is None
+                or stat_key != (state.inode, state.size, state.mtime_ns)
+                and not _still_unsupported(state, ledger_file, stat_key)):
+            state = rebuild(user, journal)
+    if not state.supported:
+        return None
+
+    rollups = MonthlyRollup.objects.filter(user=user).order_by(
+        'month', 'account',
+    ).values_list('month', 'account', 'commodity', 'amount')
+    rows = []
+    for month, account, commodity, amount in rollups:
+        if commodity not in ['', settings.LEDGER_DEFAULT_CURRENCY]:
+            return None
+        rows.append((month, account, amount))
+    df = pd.DataFrame(rows, columns=['date', 'account', 'amount'])
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def entry_appended(user, journal, entry, old_position, new_position):
+    """Add the entry just appended to the journal to the rollups.
+
+    Does nothing unless the rollups reflected the journal right
+    before the append, they get rebuilt when needed then.
+
+    """
+    if settings.LEDGER_ENGINE != 'native':
+        return
+
+    with transaction.atomic():
+        state = RollupState.objects.select_for_update().filter(
+            pk=user.pk,
+        ).first()
+        if state is None or not state.supported:
+            return
+        with open(journal.path, 'rb') as ledger_file:
+            inode, size, mtime_ns = _stat_key(ledger_file)
+            if (inode != state.inode
+                    or state.size != old_position
+                    or size != new_position
+                    or ledger_api.tail_digest(ledger_file, old_position)
+                    != bytes(state.tail_digest)):
+                return
+            tail_digest = ledger_api.tail_digest(ledger_file, size)
+        try:
+            totals = _entry_totals(entry)
+        except ValueError:
+            return
+
+        _add(user, totals)
+        state.previous_size = state.size
+        state.previous_digest = state.tail_digest
+        state.size = size
+        state.mtime_ns = mtime_ns
+        state.tail_digest = tail_digest
+        state.save()
+
+
+def entry_reverted(user, journal):
+    """Remove the entry just reverted (journal.last_data) from the rollups.
+
+    Does nothing unless it was the last entry added with
+    entry_appended(), the rollups get rebuilt when needed then.
+
+    """
+    if settings.LEDGER_ENGINE != 'native':
+        return
+
+    last_data = journal.last_data
+    with transaction.atomic():
+        state = RollupState.objects.select_for_update().filter(
+            pk=user.pk,
+        ).first()
+        if (state is None
+                or state.previous_size != last_data.old_position
+                or state.size != last_data.new_position):
+            return
+        with open(journal.path, 'rb') as ledger_file:
+            inode, size, mtime_ns = _stat_key(ledger_file)
+            if (inode != state.inode
+                    or size != state.previous_size
+                    or ledger_api.tail_digest(ledger_file, size)
+                    != bytes(state.previous_digest)):
+                return
+        try:
+            totals = _entry_totals(last_data.last_entry)
+        except ValueError:
+            return
+
+        _add(user, totals, -1)
+        state.size = size
+        state.mtime_ns = mtime_ns
+        state.tail_digest = state.previous_digest
+        state.previous_size = None
+        state.previous_digest = None
+        state.save()
@@ -1,3 +1,1698 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
-# Create your tests here.
+from unittest import mock, skipUnless
+import fcntl
+import itertools
+import multiprocessing
+import os
+import pickle
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+from . import rollups, undo_log, views
+from .models import LedgerPath, MonthlyRollup, UndoRecord
+from utils import ledger_api
+
+
+class JournalTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'ledger.dat')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+        patcher = mock.patch.multiple(
+            ledger_api.Journal,
+            cache_dir=self.cache_dir,
+            _indexes={},
+            _index_locks={},
+            _writers={},
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # For anything else kept there, like the submission queue lock.
+        settings_override = override_settings(LEDGER_CACHE_DIR=self.cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def write(self, data, mode='w'):
+        with open(self.path, mode) as ledger_file:
+            ledger_file.write(data)
+
+    def entry(self, day, payee, note=None):
+        return ledger_api.Entry(
+            date='2019-02-{:02d}'.format(day),
+            payee=payee,
+            note=note,
+            accounts=[
+                ('Expenses:Food', '{}.00 PLN'.format(day)),
+                ('Liabilities:Credit Card',),
+            ],
+        )
+
+
+class JournalIndexTests(TestCase):
+
+    def test_scan_entries(self):
+        data = (
+            b'; -*- mode: ledger; -*-\n'
+            b'\n'
+            b'2019-02-15 * Burger King\n'
+            b'    ; :food:\n'
+            b'    Expenses:Food      19.99 PLN   \n'
+            b'    Liabilities:Credit Card\n'
+            b'   \n'
+            b'2019/02/16 McDonald\'s\n'
+            b'    Expenses:Food      $5.00\n'
+            b'    Liabilities:Credit Card'
+        )
+        entries = list(ledger_api.scan_entries(data))
+        self.assertEqual(
+            [entry[2:] for entry in entries],
+            [
+                ('2019-02-15', 'Burger King', ':food:'),
+                ('2019/02/16', 'McDonald\'s', ''),
+            ],
+        )
+        self.assertEqual(
+            ledger_api.entry_body(
+                data[entries[0].offset:entries[0].offset + entries[0].length]
+            ),
+            '2019-02-15 * Burger King\n'
+            '    ; :food:\n'
+            '    Expenses:Food      19.99 PLN\n'
+            '    Liabilities:Credit Card',
+        )
+        self.assertEqual(entries[1].offset + entries[1].length, len(data))
+
+    def test_scan_entries_after_cr(self):
+        data = b'2019-02-15 Burger King\r\r2019-02-16 McDonald\'s\n'
+        self.assertEqual(
+            [entry[:3] for entry in ledger_api.scan_entries(data, 24)],
+            [(24, 21, '2019-02-16')],
+        )
+
+
+class JournalEntriesTests(TestCase):
+
+    def setUp(self):
+        self.data = (
+            b'2019-02-15 * Burger King\n'
+            b'    ; :food:   \n'
+            b'    Expenses:Food      19.99 PLN\n'
+            b'\n'
+            b'2019-02-16 Burger King\n'
+            b'    Expenses:Food      $5.00\n'
+        )
+        self.entries = ledger_api.JournalEntries(
+            ledger_api.scan_entries(self.data),
+            self.data,
+        )
+
+    def test_mapping(self):
+        entry = self.entries[0]
+        self.assertEqual(
+            dict(entry),
+            {
+                'body': (
+                    '2019-02-15 * Burger King\n'
+                    '    ; :food:\n'
+                    '    Expenses:Food      19.99 PLN'
+                ),
+                'date': '2019-02-15',
+                'payee': 'Burger King',
+                'note': ':food:',
+            },
+        )
+        self.assertEqual(entry, dict(entry))
+        self.assertEqual(self.entries[-1]['note'], '')
+        with self.assertRaises(KeyError):
+            entry['amount']
+
+    def test_sequence(self):
+        self.assertEqual(len(self.entries), 2)
+        self.assertEqual(
+            [entry['date'] for entry in self.entries[::-1]],
+            ['2019-02-16', '2019-02-15'],
+        )
+        self.assertEqual(
+            [entry['date'] for entry in reversed(self.entries)],
+            ['2019-02-16', '2019-02-15'],
+        )
+        self.assertEqual(list(self.entries[1:]), [self.entries[1]])
+        self.assertEqual(
+            list(self.entries[:1] + self.entries[1:]),
+            list(self.entries),
+        )
+        with self.assertRaises(IndexError):
+            self.entries[2]
+
+    def test_shared_strings(self):
+        self.assertIs(self.entries.payees[0], self.entries.payees[1])
+
+
+class DateIndexTests(TestCase):
+
+    def test_chronological(self):
+        index = ledger_api.DateIndex([
+            '2019-02-01', '2019/02/03', '2019-02-03', '2019-03-01',
+        ])
+        self.assertIsNone(index.order)
+        self.assertEqual(
+            list(index.positions('2019-02-02', '2019-02-03')),
+            [1, 2],
+        )
+        self.assertEqual(list(index.positions(since='2019-02-03')), [1, 2, 3])
+        self.assertEqual(list(index.positions(until='2019-01-31')), [])
+        self.assertEqual(list(index.positions()), [0, 1, 2, 3])
+
+    def test_out_of_order(self):
+        index = ledger_api.DateIndex([
+            '2019-03-01', '2019-02-01', '2019/02/15', '2019-01-01',
+            '2019-02-15',
+        ])
+        self.assertIsNotNone(index.order)
+        self.assertEqual(
+            list(index.positions('2019-02-01', '2019-02-28')),
+            [1, 2, 4],
+        )
+        self.assertEqual(list(index.positions(until='2019-01-31')), [3])
+        self.assertEqual(list(index.positions()), [0, 1, 2, 3, 4])
+
+
+class JournalDateRangeTests(JournalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write('')
+        journal = ledger_api.Journal(self.path)
+        for day in [1, 2, 10, 3, 20, 4]:
+            journal.append(self.entry(day, 'Payee {}'.format(day)))
+
+    def test_entries(self):
+        journal = ledger_api.Journal(self.path)
+        entries = journal.entries(since='2019-02-02', until='2019-02-04')
+        self.assertEqual(
+            [entry['payee'] for entry in entries],
+            ['Payee 2', 'Payee 3', 'Payee 4'],
+        )
+        self.assertEqual(
+            entries[-1]['body'],
+            str(self.entry(4, 'Payee 4')).strip(),
+        )
+        self.assertEqual(
+            [entry['payee'] for entry in journal.entries(since='2019-02-10')],
+            ['Payee 10', 'Payee 20'],
+        )
+
+    def test_reads_only_range(self):
+        journal = ledger_api.Journal(self.path)
+        entries = journal.entries(since='2019-02-10', until='2019-02-10')
+        self.assertEqual(
+            entries.data.decode(),
+            str(self.entry(10, 'Payee 10')).strip(),
+        )
+        self.assertEqual(len(journal.entries(since='2019-03-01')), 0)
+
+    def test_served_from_index(self):
+        with open(self.path) as ledger_file:
+            data = ledger_file.read()
+        # Longer than the digested tail.
+        self.write('; {}\n{}'.format('-' * 10000, data))
+        journal = ledger_api.Journal(self.path)
+        self.assertEqual(len(journal.entries()), 6)
+        # Not read again.
+        self.assertIs(journal.entries().data, journal.entries().data)
+        with mock.patch.object(
+                ledger_api.JournalIndex, '_read',
+                wraps=ledger_api.JournalIndex._read,
+        ) as read:
+            entries = journal.entries(since='2019-02-10', until='2019-02-10')
+            self.assertEqual(
+                [entry['payee'] for entry in entries],
+                ['Payee 10'],
+            )
+            self.assertEqual(len(journal.entries()), 6)
+            read.assert_not_called()
+
+            size = os.path.getsize(self.path)
+            journal.append(self.entry(21, 'Payee 21'))
+            entries = journal.entries()
+            self.assertEqual(entries[-1]['payee'], 'Payee 21')
+            self.assertEqual(
+                entries[-1]['body'],
+                str(self.entry(21, 'Payee 21')).strip(),
+            )
+            self.assertEqual(entries[0]['payee'], 'Payee 1')
+            # Only the new data and the digested tail.
+            for call in read.call_args_list:
+                _, start, end = call[0]
+                self.assertGreaterEqual(
+                    start,
+                    size - ledger_api.JournalIndex.TAIL_SIZE,
+                )
+
+
+class JournalIndexRefreshTests(JournalTestCase):
+
+    def test_append_parses_only_new_data(self):
+        journal = ledger_api.Journal(self.path)
+        self.write('')
+        for day in range(1, 4):
+            journal.append(self.entry(day, 'Payee {}'.format(day)))
+        self.assertEqual(len(list(journal)), 3)
+
+        journal.append(self.entry(4, 'Payee 4', note=':note:'))
+        with mock.patch.object(
+                ledger_api, 'scan_entries',
+                wraps=ledger_api.scan_entries,
+        ) as scan:
+            entries = list(journal)
+        _, start, end = scan.call_args[0]
+        with open(self.path, 'rb') as ledger_file:
+            data = ledger_file.read()
+        self.assertGreater(start, 0)
+        self.assertEqual(end, len(data))
+        self.assertEqual(data[start:end].count(b'Payee'), 2)
+        self.assertEqual(
+            [(entry['payee'], entry['note']) for entry in entries],
+            [
+                ('Payee 1', ''),
+                ('Payee 2', ''),
+                ('Payee 3', ''),
+                ('Payee 4', ':note:'),
+            ],
+        )
+        self.assertEqual(
+            entries[-1]['body'],
+            str(self.entry(4, 'Payee 4', note=':note:')).strip(),
+        )
+
+    def test_rewrite_rebuilds(self):
+        journal = ledger_api.Journal(self.path)
+        self.write(str(self.entry(1, 'Old')) + '\n')
+        self.assertEqual([e['payee'] for e in journal], ['Old'])
+
+        self.write(
+            str(self.entry(2, 'New')) + '\n' + str(self.entry(3, 'Newer'))
+        )
+        self.assertEqual([e['payee'] for e in journal], ['New', 'Newer'])
+
+    def test_same_size_edit_rebuilds(self):
+        journal = ledger_api.Journal(self.path)
+        self.write(''.join(
+            str(self.entry(day % 28 + 1, 'Alpha' if day == 0 else 'Payee'))
+            + '\n'
+            for day in range(100)
+        ))
+        self.assertEqual(next(iter(journal))['payee'], 'Alpha')
+
+        with open(self.path) as ledger_file:
+            data = ledger_file.read()
+        self.assertGreater(
+            len(data) - data.index('Payee'),
+            ledger_api.JournalIndex.TAIL_SIZE,
+        )
+        self.write(data.replace('Alpha', 'Gamma'))
+        file_stat = os.stat(self.path)
+        # Make sure the mtime differs even on the coarse filesystems.
+        os.utime(
+            self.path,
+            ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 10**9),
+        )
+        entry = next(iter(journal))
+        self.assertEqual(entry['payee'], 'Gamma')
+        self.assertIn('Gamma', entry['body'])
+
+    def test_journals_refreshed_independently(self):
+        other_path = os.path.join(self.tmp_dir, 'other.dat')
+        with open(other_path, 'w') as ledger_file:
+            ledger_file.write(str(self.entry(2, 'Other')) + '\n')
+        self.write(str(self.entry(1, 'Slow')) + '\n')
+
+        refreshing = threading.Event()
+        proceed = threading.Event()
+        slow_done = threading.Event()
+        refreshed = ledger_api.JournalIndex.refreshed
+
+        def slow_refreshed(index, ledger_file):
+            if ledger_file.name == self.path:
+                refreshing.set()
+                proceed.wait(5)
+                slow_done.set()
+            return refreshed(index, ledger_file)
+
+        with mock.patch.object(
+                ledger_api.JournalIndex,
+                'refreshed',
+                autospec=True,
+                side_effect=slow_refreshed,
+        ):
+            slow = threading.Thread(
+                target=lambda: list(ledger_api.Journal(self.path)),
+            )
+            slow.start()
+            self.assertTrue(refreshing.wait(5))
+            try:
+                self.assertEqual(
+                    [e['payee'] for e in ledger_api.Journal(other_path)],
+                    ['Other'],
+                )
+                # Didn't wait for the other journal.
+                self.assertFalse(slow_done.is_set())
+            finally:
+                proceed.set()
+                slow.join()
+
+    def test_persisted_index(self):
+        journal = ledger_api.Journal(self.path)
+        self.write(str(self.entry(1, 'Persisted')) + '\n')
+        list(journal)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        ledger_api.Journal._indexes.clear()
+        with mock.patch.object(ledger_api, 'scan_entries') as scan:
+            entries = list(ledger_api.Journal(self.path))
+        scan.assert_not_called()
+        self.assertEqual([e['payee'] for e in entries], ['Persisted'])
+
+
+class JournalParallelParseTests(JournalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write(
+            '; -*- mode: ledger; -*-\n'
+            '\n'
+            'P 2019/01/01 EUR 4.30 PLN\n'
+        )
+        journal = ledger_api.Journal(self.path)
+        for day in range(1, 21):
+            journal.append(self.entry(
+                day, 'Payee {}'.format(day),
+                note=':tag{}:'.format(day) if day % 3 == 0 else None,
+            ))
+            if day % 4 == 0:
+                self.write('; A comment\n  \n\n', mode='a')
+        with open(self.path, 'rb') as ledger_file:
+            self.data = ledger_file.read()
+
+    def test_split_ranges(self):
+        for parts in [1, 2, 3, 7, 100]:
+            with self.subTest(parts=parts):
+                ranges = ledger_api.split_ranges(
+                    self.data, 0, len(self.data), parts,
+                )
+                self.assertLessEqual(len(ranges), parts)
+                self.assertEqual(ranges[0][0], 0)
+                self.assertEqual(ranges[-1][1], len(self.data))
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    self.assertEqual(end, start)
+                self.assertEqual(
+                    [
+                        entry
+                        for start, end in ranges
+                        for entry in ledger_api.scan_entries(
+                            self.data, start, end,
+                        )
+                    ],
+                    list(ledger_api.scan_entries(self.data)),
+                )
+
+    def test_parallel_parse(self):
+        expected = list(ledger_api.Journal(self.path))
+        self.assertEqual(len(expected), 20)
+        ledger_api.Journal._indexes.clear()
+        shutil.rmtree(self.cache_dir)
+
+        with mock.patch.multiple(
+                ledger_api.JournalIndex,
+                parse_workers=3,
+                parallel_parse_threshold=0,
+        ), mock.patch.object(
+            ledger_api, 'parallel_scan_entries',
+            wraps=ledger_api.parallel_scan_entries,
+        ) as parallel_scan:
+            self.assertEqual(list(ledger_api.Journal(self.path)), expected)
+        parallel_scan.assert_called_once()
+
+
+class JournalReverseTests(JournalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write(
+            '; -*- mode: ledger; -*-\n'
+            '\n'
+            'P 2019/01/01 EUR 4.30 PLN\n'
+        )
+        journal = ledger_api.Journal(self.path)
+        for day in range(1, 11):
+            journal.append(self.entry(
+                day, 'Payee {}'.format(day),
+                note=':tag{}:'.format(day) if day % 3 == 0 else None,
+            ))
+        self.write('    Expenses:Food  1.00 PLN\n', mode='a')
+
+    def test_iter_reverse(self):
+        journal = ledger_api.Journal(self.path)
+        expected = list(journal)
+        expected.reverse()
+        for block_size in [1, 7, 100, 64 * 1024]:
+            with self.subTest(block_size=block_size):
+                journal.reverse_block_size = block_size
+                self.assertEqual(list(journal.iter_reverse()), expected)
+
+    def test_tail(self):
+        journal = ledger_api.Journal(self.path)
+        journal.reverse_block_size = 16
+        self.assertEqual(journal.tail(3), list(journal)[-3:])
+        self.assertEqual(journal.tail(100), list(journal))
+        self.assertEqual(journal.tail(0), [])
+
+
+class JournalWriterTests(JournalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write('; -*- mode: ledger; -*-\n')
+
+    def test_concurrent(self):
+        fsync = os.fsync
+        fsynced = []
+
+        def slow_fsync(fd):
+            fsynced.append(fd)
+            time.sleep(0.05)
+            fsync(fd)
+
+        entries = [
+            self.entry(day, 'Payee {}'.format(day))
+            for day in range(1, 21)
+        ]
+        positions = {}
+
+        def append(entry):
+            positions[entry.payee] = ledger_api.Journal(self.path).append(entry)
+
+        with mock.patch.object(os, 'fsync', slow_fsync):
+            threads = [
+                threading.Thread(target=append, args=(entry,))
+                for entry in entries
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # Coalesced into fewer writes.
+        self.assertLess(len(fsynced), len(entries))
+        with open(self.path) as ledger_file:
+            data = ledger_file.read()
+        self.assertEqual(
+            len(data),
+            max(new for old, new, _ in positions.values()),
+        )
+        for entry in entries:
+            old, new, entry_data = positions[entry.payee]
+            self.assertEqual(data[old:new], '{}\n'.format(entry))
+            self.assertEqual(entry_data, data[old:new].encode())
+            undo = ledger_api.Journal.LastData(
+                old, new, ledger_api.Journal.digest(data[old:new].encode()),
+            )
+            self.assertEqual(
+                ledger_api.Journal(self.path, undo).can_revert(),
+                new == len(data),
+            )
+
+    def test_concurrent_processes(self):
+        fsync = os.fsync
+        fsync_log = os.path.join(self.tmp_dir, 'fsynced')
+
+        def slow_fsync(fd):
+            with open(fsync_log, 'a') as log:
+                log.write('.')
+            time.sleep(0.05)
+            fsync(fd)
+
+        entries = [
+            self.entry(day, 'Payee {}'.format(day))
+            for day in range(1, 11)
+        ]
+
+        def append(entry):
+            appended = ledger_api.Journal(self.path).append(entry)
+            with open(os.path.join(self.tmp_dir, entry.payee), 'wb') as f:
+                pickle.dump(tuple(appended), f)
+
+        context = multiprocessing.get_context('fork')
+        with mock.patch.object(os, 'fsync', slow_fsync):
+            processes = [
+                context.Process(target=append, args=(entry,))
+                for entry in entries
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        self.assertEqual(
+            [process.exitcode for process in processes],
+            [0] * len(entries),
+        )
+
+        with open(fsync_log) as log:
+            # Coalesced into fewer writes.
+            self.assertLess(len(log.read()), len(entries))
+        with open(self.path) as ledger_file:
+            data = ledger_file.read()
+        ends = []
+        for entry in entries:
+            with open(os.path.join(self.tmp_dir, entry.payee), 'rb') as f:
+                old, new, entry_data = pickle.load(f)
+            self.assertEqual(data[old:new], '{}\n'.format(entry))
+            self.assertEqual(entry_data, data[old:new].encode())
+            ends.append(new)
+        self.assertEqual(len(data), max(ends))
+        self.assertEqual(
+            os.listdir(ledger_api.Journal(self.path)._spool_dir()), [],
+        )
+
+    def test_gone_requests_dropped(self):
+        journal = ledger_api.Journal(self.path)
+        process = multiprocessing.get_context('fork').Process(target=int)
+        process.start()
+        process.join()
+        spool_dir = journal._spool_dir()
+        os.makedirs(spool_dir)
+        for extension in ['.req', '.done']:
+            with open(os.path.join(spool_dir, '{:020d}-{}-0{}'.format(
+                    0, process.pid, extension,
+            )), 'wb') as f:
+                pickle.dump([b'Gone\n'], f)
+
+        journal.append(self.entry(1, 'Payee'))
+        with open(self.path) as ledger_file:
+            self.assertNotIn('Gone', ledger_file.read())
+        self.assertEqual(os.listdir(spool_dir), [])
+
+    def test_locked(self):
+        appended = threading.Event()
+
+        def append():
+            ledger_api.Journal(self.path).append(self.entry(1, 'Payee'))
+            appended.set()
+
+        with open(self.path) as ledger_file:
+            fcntl.flock(ledger_file.fileno(), fcntl.LOCK_SH)
+            thread = threading.Thread(target=append)
+            thread.start()
+            self.assertFalse(appended.wait(0.1))
+        thread.join()
+        self.assertTrue(appended.is_set())
+
+    def test_error(self):
+        journal = ledger_api.Journal(
+            os.path.join(self.tmp_dir, 'missing', 'ledger.dat'),
+        )
+        for attempt in range(2):
+            with self.assertRaises(FileNotFoundError):
+                journal.append(self.entry(1, 'Payee'))
+
+
+class LedgerWorkerTests(JournalTestCase):
+
+    # Mimics the ledger interactive mode, printing the process id in
+    # place of the payees.
+    FAKE_LEDGER = (
+        'import os, sys, time\n'
+        'def run(command):\n'
+        '    if command[0] == "payees":\n'
+        '        print(os.getpid())\n'
+        '    elif command[0] == "csv":\n'
+        '        print(\'"{}",{}\'.format(os.getpid(), ",".join(command[1:])))\n'
+        '    elif command[0] == "echo":\n'
+        '        print(" ".join(command[1:]))\n'
+        '    elif command[0] == "warn":\n'
+        '        print("Warning: something", file=sys.stderr)\n'
+        '        sys.stderr.flush()\n'
+        '        print("output")\n'
+        '    elif command[0] == "hang" and interactive:\n'
+        '        time.sleep(60)\n'
+        '    sys.stdout.flush()\n'
+        'interactive = len(sys.argv) == 3\n'
+        'if not interactive:\n'
+        '    print("one-shot")\n'
+        '    run(sys.argv[3:])\n'
+        '    sys.exit()\n'
+        'while True:\n'
+        '    sys.stdout.write("] ")\n'
+        '    sys.stdout.flush()\n'
+        '    line = sys.stdin.readline()\n'
+        '    if not line:\n'
+        '        break\n'
+        '    run(line.split())\n'
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.write('; -*- mode: ledger; -*-\n')
+        ledger_command = os.path.join(self.tmp_dir, 'ledger')
+        with open(ledger_command, 'w') as script:
+            script.write('#!{}\n'.format(sys.executable))
+            script.write(self.FAKE_LEDGER)
+        os.chmod(ledger_command, 0o755)
+
+        self.workers = ledger_api.LedgerWorkerPool(max_size=2)
+        self.addCleanup(self.workers.close)
+        patcher = mock.patch.multiple(
+            ledger_api.Journal,
+            ledger_command=ledger_command,
+            workers=self.workers,
+            report_cache=ledger_api.ReportCache(),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pid(self, journal):
+        output = journal.payees()
+        self.assertEqual(len(output), 1, output)
+        return int(output[0])
+
+    def test_reused(self):
+        journal = ledger_api.Journal(self.path)
+        pid = self.pid(journal)
+        self.assertEqual(self.pid(journal), pid)
+        self.assertEqual(
+            journal._call('echo', 'a', 'b'),
+            ['a b'],
+        )
+        self.assertEqual(self.pid(ledger_api.Journal(self.path)), pid)
+        self.assertEqual(self.workers._size, 1)
+
+    def test_restarted_on_change(self):
+        journal = ledger_api.Journal(self.path)
+        pid = self.pid(journal)
+        journal.append(self.entry(1, 'Payee'))
+        self.assertNotEqual(self.pid(journal), pid)
+        self.assertEqual(self.workers._size, 1)
+
+    def test_restarted_after_crash(self):
+        journal = ledger_api.Journal(self.path)
+        pid = self.pid(journal)
+        os.kill(pid, signal.SIGKILL)
+        # Depending on whether the crash is noticed before running the
+        # command, it's run by a new worker or on its own.
+        journal.payees()
+        self.assertNotEqual(self.pid(journal), pid)
+        self.assertEqual(self.workers._size, 1)
+
+    def test_falls_back(self):
+        journal = ledger_api.Journal(self.path)
+        pid = self.pid(journal)
+        # The warnings can't be told apart from the errors.
+        self.assertEqual(journal._call('warn'), ['one-shot', 'output'])
+        # Would need quoting.
+        self.assertEqual(
+            journal._call('echo', 'a b'),
+            ['one-shot', 'a b'],
+        )
+        self.assertEqual(self.pid(journal), pid)
+
+    def test_unresponsive(self):
+        self.workers.timeout = 0.1
+        journal = ledger_api.Journal(self.path)
+        self.assertEqual(journal._call('hang'), ['one-shot'])
+        self.assertEqual(self.workers._size, 0)
+        # Not retried.
+        self.assertEqual(journal.payees()[0], 'one-shot')
+
+    def test_bounded(self):
+        other_path = os.path.join(self.tmp_dir, 'other.dat')
+        shutil.copy(self.path, other_path)
+        journal = ledger_api.Journal(self.path)
+        other_journal = ledger_api.Journal(other_path)
+        self.workers.max_size = 1
+        pid = self.pid(journal)
+        self.assertNotEqual(self.pid(other_journal), pid)
+        self.assertEqual(self.workers._size, 1)
+        self.assertNotEqual(self.pid(journal), pid)
+
+    def test_idle_timeout(self):
+        journal = ledger_api.Journal(self.path)
+        self.pid(journal)
+        worker = self.workers._idle[0]
+        self.workers.reap()
+        self.assertEqual(self.workers._size, 1)
+        self.workers.idle_timeout = 0
+        self.workers.reap()
+        self.assertEqual(self.workers._size, 0)
+        self.assertIsNotNone(worker.process.poll())
+
+    def test_disabled(self):
+        self.workers.max_size = 0
+        journal = ledger_api.Journal(self.path)
+        self.assertEqual(journal.payees()[0], 'one-shot')
+
+    def test_csv_stream(self):
+        journal = ledger_api.Journal(self.path)
+        pid = self.pid(journal)
+        with journal.csv_stream('--real') as csv:
+            self.assertEqual(csv.read(), '"{}",--real\n'.format(pid))
+        self.workers.max_size = 0
+        with journal.csv_stream('--real') as csv:
+            self.assertEqual(csv.read().splitlines()[0], 'one-shot')
+
+    @skipUnless(shutil.which('ledger'), 'ledger is not installed')
+    def test_ledger(self):
+        journal = ledger_api.Journal(self.path)
+        journal.append(self.entry(1, 'Payee 1'))
+        journal.append(self.entry(2, 'Payee 2'))
+        with mock.patch.object(journal, 'ledger_command', 'ledger'):
+            with journal.csv_stream('--real') as csv:
+                pooled = csv.read()
+            self.assertEqual(self.workers._size, 1)
+            self.workers.max_size = 0
+            with journal.csv_stream('--real') as csv:
+                self.assertEqual(csv.read(), pooled)
+
+
+class ReportCacheTests(JournalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write('; -*- mode: ledger; -*-\n')
+        self.cache = ledger_api.ReportCache(max_size=2)
+        patcher = mock.patch.object(
+            ledger_api.Journal, 'report_cache', self.cache,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        run = mock.patch.object(
+            ledger_api.Journal, '_run',
+            side_effect=lambda *args: ['Assets:Cash', 'Expenses:Food'],
+        )
+        self.run = run.start()
+        self.addCleanup(run.stop)
+
+    def test_memoized(self):
+        journal = ledger_api.Journal(self.path)
+        self.assertEqual(journal.accounts(), ['Assets:Cash', 'Expenses:Food'])
+        journal.accounts().clear()
+        self.assertEqual(
+            ledger_api.Journal(self.path).accounts(),
+            ['Assets:Cash', 'Expenses:Food'],
+        )
+        self.assertEqual(self.run.call_count, 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+        self.assertEqual(
+            journal.csv('--real').read(),
+            'Assets:Cash\nExpenses:Food',
+        )
+        journal.csv('--real')
+        journal.csv('--monthly')
+        self.assertEqual(self.run.call_count, 3)
+
+    def test_journal_changed(self):
+        journal = ledger_api.Journal(self.path)
+        journal.accounts()
+        journal.append(self.entry(1, 'Payee'))
+        journal.accounts()
+        # The same size and mtime.
+        stat = os.stat(self.path)
+        with open(self.path) as ledger_file:
+            data = ledger_file.read()
+        self.write(data.replace('Payee', 'Other'))
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        journal.accounts()
+        self.assertEqual(self.run.call_count, 3)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_evicted(self):
+        journal = ledger_api.Journal(self.path)
+        journal.accounts()
+        journal.payees()
+        journal.accounts()
+        journal.currencies()
+        self.assertEqual(self.run.call_count, 3)
+        journal.accounts()
+        self.assertEqual(self.run.call_count, 3)
+        journal.payees()
+        self.assertEqual(self.run.call_count, 4)
+
+    def test_errors_not_memoized(self):
+        self.run.side_effect = ledger_api.Journal.LedgerCliError()
+        journal = ledger_api.Journal(self.path)
+        for _ in range(2):
+            with self.assertRaises(journal.LedgerCliError):
+                journal.accounts()
+        self.assertEqual(self.run.call_count, 2)
+
+    def test_disabled(self):
+        self.cache.max_size = 0
+        journal = ledger_api.Journal(self.path)
+        journal.accounts()
+        journal.accounts()
+        self.assertEqual(self.run.call_count, 2)
+
+
+class JournalMetadataTests(JournalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write('; -*- mode: ledger; -*-\n')
+        patcher = mock.patch.object(
+            ledger_api.Journal, 'report_cache', ledger_api.ReportCache(),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_concurrent(self):
+        # Passed only if all the reports are run at the same time.
+        barrier = threading.Barrier(3, timeout=5)
+
+        def run(journal, command):
+            barrier.wait()
+            return [command]
+
+        with mock.patch.object(
+                ledger_api.Journal, '_run', autospec=True, side_effect=run,
+        ):
+            self.assertEqual(
+                ledger_api.Journal(self.path).metadata(),
+                (['accounts'], ['commodities'], ['payees']),
+            )
+
+    def test_first_error(self):
+        errors = {
+            command: ledger_api.Journal.LedgerCliError(command)
+            for command in ['commodities', 'payees']
+        }
+
+        def run(journal, command):
+            if command in errors:
+                raise errors[command]
+            return [command]
+
+        with mock.patch.object(
+                ledger_api.Journal, '_run', autospec=True, side_effect=run,
+        ):
+            with self.assertRaises(ledger_api.Journal.LedgerCliError) as cm:
+                ledger_api.Journal(self.path).metadata()
+        self.assertIs(cm.exception, errors['commodities'])
+
+
+class PostingsTests(JournalTestCase):
+
+    def postings(self):
+        postings = ledger_api.Journal(self.path).postings()
+        return [
+            (
+                postings.dates[entry],
+                postings.payees[entry],
+                postings.account_names[account],
+                postings.commodity_names[commodity],
+                amount,
+            )
+            for entry, account, commodity, amount in zip(
+                postings.entries,
+                postings.accounts,
+                postings.commodities,
+                postings.amounts,
+            )
+        ]
+
+    def test_postings(self):
+        self.write(
+            '; -*- mode: ledger; -*-\n'
+            'P 2019/01/01 EUR 4.30 PLN\n'
+            '\n'
+            '2019/01/01 * (12) Shop  ; note\n'
+            '    ; comment\n'
+            '    Expenses:Food    1,010.50 PLN\n'
+            '    Expenses:Other   $5  ; note\n'
+            '    * Assets:Cash\n'
+            '\n'
+            '2019-01-02 ! Exchange\n'
+            '    Assets:EUR   10 EUR @ 4.30 PLN\n'
+            '    Assets:PLN   -43 PLN\n'
+            '    (Budget:Food)   -10 PLN\n'
+            '    [Budget:Spent]   5 PLN\n'
+            '    [Budget:Left]\n'
+            '\n'
+            '2019/01/03 Implicit price\n'
+            '    Assets:EUR   -10 EUR\n'
+            '    Assets:PLN   $43.00\n'
+        )
+        self.assertEqual(self.postings(), [
+            ('2019/01/01', 'Shop', 'Expenses:Food', 'PLN', 1010.5),
+            ('2019/01/01', 'Shop', 'Expenses:Other', '$', 5.0),
+            ('2019/01/01', 'Shop', 'Assets:Cash', 'PLN', -1010.5),
+            ('2019/01/01', 'Shop', 'Assets:Cash', '$', -5.0),
+            ('2019/01/02', 'Exchange', 'Assets:EUR', 'EUR', 10.0),
+            ('2019/01/02', 'Exchange', 'Assets:PLN', 'PLN', -43.0),
+            ('2019/01/02', 'Exchange', '(Budget:Food)', 'PLN', -10.0),
+            ('2019/01/02', 'Exchange', '[Budget:Spent]', 'PLN', 5.0),
+            ('2019/01/02', 'Exchange', '[Budget:Left]', 'PLN', -5.0),
+            ('2019/01/03', 'Implicit price', 'Assets:EUR', 'EUR', -10.0),
+            ('2019/01/03', 'Implicit price', 'Assets:PLN', '$', 43.0),
+        ])
+
+    def test_unsupported(self):
+        for data in [
+                'include other.dat\n',
+                'account Expenses:Food\n',
+                '= /Food/\n    (Budget:Food)  -1\n',
+                '2019/01/01=2019/01/02 Payee\n    A  1 PLN\n    B\n',
+                '2019/01/01 Payee\n    A  1 PLN = 5 PLN\n    B\n',
+                '2019/01/01 Payee\n    A  1 PLN {2 EUR}\n    B\n',
+                '2019/01/01 Payee\n    A  (1 PLN * 2)\n    B\n',
+                '2019/01/01 Payee\n    A  1,5 PLN\n    B\n',
+                '2019/01/01 Payee\n    A  1 PLN\n    B  1 PLN\n',
+                '2019/01/01 Payee\n    A\n    B\n',
+        ]:
+            with self.subTest(data=data):
+                self.write(data)
+                with self.assertRaises(ledger_api.Journal.Unsupported):
+                    ledger_api.Journal(self.path).postings()
+
+
+class NativeEngineDifferentialTests(JournalTestCase):
+    """Compares the native engine with ledger on random journals."""
+
+    JOURNAL_COUNT = 20
+    ENTRY_COUNT = 200
+
+    ACCOUNTS = [
+        'Assets:Bank', 'Assets:Cash', 'Expenses:Food', 'Expenses:Rent',
+        'Expenses:Eating Out', 'Income:Salary', 'Liabilities:Credit Card',
+    ]
+    COMMODITIES = ['PLN', 'EUR', '$']
+    COLUMNS = ['date', 'payee', 'account', 'currency', 'amount']
+
+    # The total time each engine took, reported after the tests.
+    timings = {'native': 0.0, 'ledger': 0.0}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.timings['ledger']:
+            sys.stderr.write(
+                '\nnative engine: {native:.3f}s, ledger: {ledger:.3f}s\n'
+                .format(**cls.timings),
+            )
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(
+            ledger_api.Journal, 'report_cache', ledger_api.ReportCache(),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def amount(rng, commodity, quantity):
+        if commodity == '$':
+            return '${:.2f}'.format(quantity)
+        if abs(quantity) >= 1000 and rng.random() < 0.5:
+            return '{:,.2f} {}'.format(quantity, commodity)
+        return '{:.2f} {}'.format(quantity, commodity)
+
+    def random_entry(self, rng, day):
+        date = '2019{0}{1:02d}{0}{2:02d}'.format(
+            rng.choice('-/'), day // 28 % 12 + 1, day % 28 + 1,
+        )
+        lines = ['{}{} Payee {}{}'.format(
+            date,
+            rng.choice(['', ' *', ' !']),
+            rng.randrange(20),
+            rng.choice(['', '  ; a note']),
+        )]
+        if rng.random() < 0.3:
+            lines.append('    ; :tag:')
+
+        def posting(account, amount=''):
+            line = '    {}{}'.format(rng.choice(['', '* ', '! ']), account)
+            if amount:
+                line += rng.choice(['  ', '\t', '    ']) + amount
+            if rng.random() < 0.1:
+                line += '  ; posting note'
+            lines.append(line)
+
+        accounts = rng.sample(self.ACCOUNTS, rng.randint(2, 4))
+        commodity = rng.choice(self.COMMODITIES)
+        kind = rng.random()
+        if kind < 0.1:
+            # A conversion, balanced by the cost.
+            quantity = rng.randint(1, 100)
+            price = rng.randint(100, 500) / 100
+            posting(accounts[0], '{} EUR @ {:.2f} PLN'.format(
+                quantity, price,
+            ))
+            posting(accounts[1], self.amount(rng, 'PLN', -quantity * price))
+        elif kind < 0.2:
+            # Several commodities balanced by a single elided amount.
+            for account, commodity in zip(accounts[:-1], self.COMMODITIES):
+                posting(account, self.amount(
+                    rng, commodity, rng.randint(1, 200000) / 100,
+                ))
+            posting(accounts[-1])
+        else:
+            total = 0
+            for account in accounts[:-1]:
+                quantity = rng.randint(-50000, 200000) / 100
+                total += quantity
+                posting(account, self.amount(rng, commodity, quantity))
+            if abs(total) < 0.005 or rng.random() < 0.5:
+                posting(accounts[-1])
+            else:
+                posting(accounts[-1], self.amount(rng, commodity, -total))
+        if rng.random() < 0.1:
+            posting('(Budget:Food)', self.amount(rng, 'PLN', -10))
+        return '\n'.join(lines) + '\n'
+
+    def random_journal(self, rng):
+        chunks = ['; -*- mode: ledger; -*-\n', 'P 2019/01/01 EUR 4.30 PLN\n']
+        for day in range(self.ENTRY_COUNT):
+            chunks.append('\n' * rng.randint(1, 2))
+            chunks.append(self.random_entry(rng, day))
+            if rng.random() < 0.05:
+                chunks.append('\n; A comment\n')
+        return ''.join(chunks)
+
+    def journals(self):
+        for seed in range(self.JOURNAL_COUNT):
+            self.write(self.random_journal(random.Random(seed)))
+            yield seed, ledger_api.Journal(self.path)
+
+    def rows(self, df):
+        """Return the entries in the file order, with the running totals.
+
+        Only the order of the postings within an entry is ignored:
+        ledger may put the ones balancing several commodities with a
+        single elided amount elsewhere than the native engine.
+
+        """
+        totals = {}
+        rows = []
+        postings = (
+            (
+                row.date.replace('-', '/'),
+                row.payee,
+                row.account,
+                row.currency,
+                round(row.amount, 2),
+            )
+            for row in df[self.COLUMNS].itertuples()
+        )
+        # The generated entries all have different dates.
+        for (date, payee), entry in itertools.groupby(
+                postings, lambda posting: posting[:2],
+        ):
+            entry = sorted(posting[2:] for posting in entry)
+            for account, currency, amount in entry:
+                totals[currency] = totals.get(currency, 0) + amount
+            rows.append((
+                date,
+                payee,
+                entry,
+                sorted(
+                    (currency, round(total, 2))
+                    for currency, total in totals.items()
+                    if round(total, 2)
+                ),
+            ))
+        return rows
+
+    def balances(self, df):
+        balances = df.groupby(
+            ['account', 'currency'], observed=True,
+        )['amount'].sum().round(2)
+        return {
+            account: amount
+            for account, amount in balances.to_dict().items()
+            if amount
+        }
+
+    def timed(self, engine, function):
+        start = time.perf_counter()
+        result = function()
+        self.timings[engine] += time.perf_counter() - start
+        return result
+
+    def test_supported(self):
+        # Whatever ledger thinks of them, the generated journals need
+        # to be handled by the native engine to test anything.
+        for seed, journal in self.journals():
+            with self.subTest(seed=seed):
+                postings = journal.postings()
+                self.assertGreaterEqual(len(postings), 2 * self.ENTRY_COUNT)
+
+    @skipUnless(shutil.which('ledger'), 'ledger is not installed')
+    def test_matches_ledger(self):
+        for seed, journal in self.journals():
+            with self.subTest(seed=seed), override_settings(
+                    LEDGER_ENGINE='native',
+            ):
+                native = self.timed(
+                    'native',
+                    lambda: views.read_postings(journal, self.COLUMNS),
+                )
+                ledger = self.timed(
+                    'ledger',
+                    lambda: views.read_csv(journal, usecols=self.COLUMNS),
+                )
+                self.assertEqual(self.balances(native), self.balances(ledger))
+                self.assertEqual(self.rows(native), self.rows(ledger))
+
+
+class CsvReportTests(JournalTestCase):
+
+    # Prints the prepared report, or fails if there is none.
+    FAKE_LEDGER = (
+        'import sys\n'
+        'try:\n'
+        '    with open(sys.argv[2] + ".csv") as report:\n'
+        '        sys.stdout.write(report.read())\n'
+        'except OSError:\n'
+        '    sys.exit("Error: no report")\n'
+    )
+
+    CSV = (
+        '"2019/02/01","","Payee 1","Expenses:Food","PLN","1.5","",""\n'
+        '"2019/02/01","","Payee 1","Assets:Cash","PLN","-1.5","",""\n'
+        '"2019/02/02","","Payee 2","Expenses:Food","EUR","2","",""\n'
+        '"2019/02/02","","Payee 2","Assets:Cash","EUR","-2","",""\n'
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.write('; -*- mode: ledger; -*-\n')
+        ledger_command = os.path.join(self.tmp_dir, 'ledger')
+        with open(ledger_command, 'w') as script:
+            script.write('#!{}\n'.format(sys.executable))
+            script.write(self.FAKE_LEDGER)
+        os.chmod(ledger_command, 0o755)
+        with open(self.path + '.csv', 'w') as report:
+            report.write(self.CSV)
+
+        patcher = mock.patch.multiple(
+            ledger_api.Journal,
+            ledger_command=ledger_command,
+            report_cache=ledger_api.ReportCache(max_size=4),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user(
+            username='tester',
+        )
+        LedgerPath.objects.create(
+            user=self.user,
+            path=self.path,
+        )
+        self.client.force_login(self.user)
+
+    def test_csv_stream(self):
+        with ledger_api.Journal(self.path).csv_stream() as csv:
+            self.assertEqual(csv.read(), self.CSV)
+
+    def test_csv_stream_error(self):
+        os.unlink(self.path + '.csv')
+        with self.assertRaises(ledger_api.Journal.LedgerCliError) as cm:
+            with ledger_api.Journal(self.path).csv_stream() as csv:
+                # The report failing makes the reader fail first.
+                if not csv.read():
+                    raise ValueError('No data')
+        self.assertEqual(cm.exception.__cause__.stderr, 'Error: no report\n')
+
+    def test_reader_error(self):
+        with self.assertRaises(ValueError):
+            with ledger_api.Journal(self.path).csv_stream():
+                raise ValueError('Not the report failing')
+
+    def test_balance(self):
+        response = self.client.get(reverse('ledger_ui:balance'))
+        self.assertEqual(
+            response.context['accounts'],
+            {
+                ('Assets:Cash', 'EUR'): -2.0,
+                ('Assets:Cash', 'PLN'): -1.5,
+                ('Expenses:Food', 'EUR'): 2.0,
+                ('Expenses:Food', 'PLN'): 1.5,
+            },
+        )
+        response = self.client.get(
+            reverse('ledger_ui:balance'),
+            {'filter': 'expenses'},
+        )
+        self.assertEqual(
+            response.context['accounts'],
+            {
+                ('Expenses:Food', 'EUR'): 2.0,
+                ('Expenses:Food', 'PLN'): 1.5,
+            },
+        )
+
+    def test_register(self):
+        response = self.client.get(
+            reverse('ledger_ui:register'),
+            {'filter': 'expenses'},
+        )
+        self.assertEqual(
+            response.context['transactions'],
+            [
+                (
+                    '2019/02/02', 'Payee 2', 'Expenses:Food',
+                    '2.00', '', 'EUR', '3.50', '',
+                ),
+                (
+                    '2019/02/01', 'Payee 1', 'Expenses:Food',
+                    '1.50', '', 'PLN', '1.50', '',
+                ),
+            ],
+        )
+        self.assertEqual(response.context['currency_count'], 2)
+        self.assertIsNone(response.context['next_offset'])
+
+    def test_register_pages(self):
+        def page(url, **params):
+            response = self.client.get(reverse(url), params)
+            self.assertEqual(response.status_code, 200)
+            return response
+
+        response = page('ledger_ui:register', count=3)
+        self.assertEqual(
+            [row[2:5] for row in response.context['transactions']],
+            [
+                ('Assets:Cash', '-2.00', 'negative-balance'),
+                ('Expenses:Food', '2.00', ''),
+                ('Assets:Cash', '-1.50', 'negative-balance'),
+            ],
+        )
+        self.assertEqual(response.context['next_offset'], 3)
+        self.assertContains(response, 'offset=3&count=3')
+
+        data = page('ledger_ui:register_data', offset=3, count=3).json()
+        self.assertEqual(
+            data['transactions'],
+            [[
+                '2019/02/01', 'Payee 1', 'Expenses:Food',
+                '1.50', '', 'PLN', '1.50', '',
+            ]],
+        )
+        self.assertIsNone(data['next'])
+
+        data = page('ledger_ui:register_data', offset=10).json()
+        self.assertEqual(data, {'transactions': [], 'next': None})
+
+        for params in [{'offset': -1}, {'count': 0}, {'count': 'all'}]:
+            with self.subTest(**params):
+                response = self.client.get(
+                    reverse('ledger_ui:register_data'),
+                    params,
+                )
+                self.assertEqual(response.status_code, 422)
+                self.assertEqual(
+                    response.json()['error'],
+                    {key: str(value) for key, value in params.items()},
+                )
+                response = self.client.get(
+                    reverse('ledger_ui:register'),
+                    params,
+                )
+                self.assertEqual(response.status_code, 422)
+
+    def test_charts(self):
+        response = self.client.get(reverse('ledger_ui:charts_data'))
+        data = response.json()
+        self.assertEqual(data['dates'], ['2019-02'])
+        self.assertEqual(
+            [(row['account'], row['amount']) for row in data['expenses']],
+            [('Expenses:Food', 1.5), ('Expenses:Food', 2.0)],
+        )
+
+    def test_charts_not_modified(self):
+        url = reverse('ledger_ui:charts_data')
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+
+        with mock.patch.object(ledger_api.subprocess, 'Popen') as popen:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(
+                url,
+                HTTP_IF_MODIFIED_SINCE=last_modified,
+            )
+            self.assertEqual(response.status_code, 304)
+        popen.assert_not_called()
+
+        # Depends on the filter.
+        response = self.client.get(
+            url,
+            {'account_filter': 'Food'},
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.write('\n', mode='a')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(LEDGER_ENGINE='native')
+    def test_native_engine(self):
+        journal = ledger_api.Journal(self.path)
+        journal.append(self.entry(1, 'Payee 1'))
+        with mock.patch.object(ledger_api.subprocess, 'Popen') as popen:
+            response = self.client.get(reverse('ledger_ui:balance'))
+        popen.assert_not_called()
+        self.assertEqual(
+            response.context['accounts'],
+            {
+                ('Expenses:Food', 'PLN'): 1.0,
+                ('Liabilities:Credit Card', 'PLN'): -1.0,
+            },
+        )
+
+        # Falls back to ledger.
+        self.write('include other.dat\n', mode='a')
+        response = self.client.get(reverse('ledger_ui:balance'))
+        self.assertEqual(len(response.context['accounts']), 4)
+
+    def test_memoized(self):
+        self.client.get(reverse('ledger_ui:register'))
+        with mock.patch.object(ledger_api.subprocess, 'Popen') as popen:
+            response = self.client.get(reverse('ledger_ui:register'))
+        popen.assert_not_called()
+        self.assertEqual(len(response.context['transactions']), 4)
+
+
+@override_settings(LEDGER_ENGINE='native', LEDGER_DEFAULT_CURRENCY='PLN')
+class RollupTests(JournalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write('')
+        self.journal = ledger_api.Journal(self.path)
+        self.journal.append(self.entry(1, 'Payee 1'))
+        self.journal.append(self.entry(2, 'Payee 2'))
+        self.write(
+            '\n2019/03/01 Payee 3\n'
+            '    Expenses:Food  3.00 PLN\n'
+            '    (Budget:Food)  -3.00 PLN\n'
+            '    Liabilities:Credit Card\n',
+            mode='a',
+        )
+
+        self.user = User.objects.create_user(
+            username='tester',
+        )
+        LedgerPath.objects.create(
+            user=self.user,
+            path=self.path,
+        )
+        self.client.force_login(self.user)
+
+    def monthly(self):
+        df = rollups.monthly(self.user, self.journal)
+        return [
+            (row.date.strftime('%Y-%m'), row.account, row.amount)
+            for row in df.itertuples()
+        ]
+
+    def append(self, entry):
+        old, new, data = self.journal.append(entry)
+        rollups.entry_appended(self.user, self.journal, entry, old, new)
+        undo_log.record(self.user, entry, old, new, data)
+
+    def test_monthly(self):
+        self.assertEqual(
+            self.monthly(),
+            [
+                ('2019-02', 'Expenses:Food', 3.0),
+                ('2019-02', 'Liabilities:Credit Card', -3.0),
+                ('2019-03', 'Expenses:Food', 3.0),
+                ('2019-03', 'Liabilities:Credit Card', -3.0),
+            ],
+        )
+
+    def test_appended(self):
+        self.monthly()
+        self.append(self.entry(4, 'Payee 4'))
+        with mock.patch.object(ledger_api.Journal, 'postings') as postings:
+            monthly = self.monthly()
+        postings.assert_not_called()
+        self.assertEqual(
+            monthly[:2],
+            [
+                ('2019-02', 'Expenses:Food', 7.0),
+                ('2019-02', 'Liabilities:Credit Card', -7.0),
+            ],
+        )
+
+    def test_reverted(self):
+        self.monthly()
+        entry = self.entry(4, 'Payee 4')
+        entry.date = '2019-04-01'
+        self.append(entry)
+        self.assertEqual(len(self.monthly()), 6)
+
+        self.client.post(reverse('ledger_ui:journal'), {'revert': '1'})
+        with mock.patch.object(ledger_api.Journal, 'postings') as postings:
+            monthly = self.monthly()
+        postings.assert_not_called()
+        self.assertEqual(len(monthly), 4)
+        self.assertEqual(MonthlyRollup.objects.count(), 4)
+
+    def test_changed_externally(self):
+        self.monthly()
+        self.write('')
+        self.append(self.entry(4, 'Payee 4'))
+        self.assertEqual(
+            self.monthly(),
+            [
+                ('2019-02', 'Expenses:Food', 4.0),
+                ('2019-02', 'Liabilities:Credit Card', -4.0),
+            ],
+        )
+
+    def test_unusable(self):
+        self.write('\n2019/03/02 Payee\n    Assets:Cash  1 EUR\n    Income\n', 'a')
+        self.assertIsNone(rollups.monthly(self.user, self.journal))
+        self.write('include other.dat\n', 'a')
+        self.assertIsNone(rollups.monthly(self.user, self.journal))
+        with override_settings(LEDGER_ENGINE='ledger'):
+            self.write('')
+            self.assertIsNone(rollups.monthly(self.user, self.journal))
+
+    def test_unsupported_not_reparsed(self):
+        self.write('include other.dat\n', 'a')
+        self.assertIsNone(rollups.monthly(self.user, self.journal))
+        self.journal.append(self.entry(4, 'Payee 4'))
+        with mock.patch.object(ledger_api.Journal, 'postings') as postings:
+            self.assertIsNone(rollups.monthly(self.user, self.journal))
+            self.assertIsNone(rollups.monthly(self.user, self.journal))
+        postings.assert_not_called()
+
+        with open(self.path) as ledger_file:
+            data = ledger_file.read()
+        self.write(data.replace('include other.dat\n', ''))
+        self.assertEqual(len(self.monthly()), 4)
+
+    def test_charts(self):
+        with mock.patch.object(ledger_api.subprocess, 'Popen') as popen:
+            response = self.client.get(reverse('ledger_ui:charts_data'))
+        popen.assert_not_called()
+        self.assertEqual(response.json()['dates'], ['2019-02', '2019-03'])
+
+
+class UndoLogTests(JournalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write('; -*- mode: ledger; -*-\n')
+        self.journal = ledger_api.Journal(self.path)
+
+        self.user = User.objects.create_user(
+            username='tester',
+        )
+        LedgerPath.objects.create(
+            user=self.user,
+            path=self.path,
+        )
+        self.client.force_login(self.user)
+
+    def append(self, entry):
+        old, new, data = self.journal.append(entry)
+        undo_log.record(self.user, entry, old, new, data)
+
+    def payees(self):
+        return [entry['payee'] for entry in self.journal]
+
+    def revert(self):
+        return self.client.post(
+            reverse('ledger_ui:journal'),
+            {'revert': 'true'},
+        ).status_code
+
+    def test_multiple_levels(self):
+        for day in range(1, 4):
+            self.append(self.entry(day, 'Payee {}'.format(day)))
+        self.assertEqual(self.revert(), 200)
+        self.assertEqual(self.payees(), ['Payee 1', 'Payee 2'])
+        self.assertEqual(self.revert(), 200)
+        self.assertEqual(self.payees(), ['Payee 1'])
+        self.append(self.entry(4, 'Payee 4'))
+        self.assertEqual(self.revert(), 200)
+        self.assertEqual(self.revert(), 200)
+        self.assertEqual(self.payees(), [])
+        self.assertEqual(self.revert(), 404)
+
+    def test_changed(self):
+        self.append(self.entry(1, 'Payee 1'))
+        self.append(self.entry(2, 'Payee 2'))
+        with open(self.path, 'r+') as ledger_file:
+            data = ledger_file.read()
+            ledger_file.seek(0)
+            ledger_file.write(data.replace('Payee 2', 'Payee 3'))
+        response = self.client.get(reverse('ledger_ui:journal'))
+        self.assertFalse(response.context['can_revert'])
+        self.assertEqual(self.revert(), 409)
+        self.assertEqual(self.payees(), ['Payee 1', 'Payee 3'])
+
+    def test_changed_before_recorded(self):
+        self.append(self.entry(1, 'Payee 1'))
+        entry = self.entry(2, 'Payee 2')
+        old, new, data = self.journal.append(entry)
+        # Replaced by someone else before it got logged.
+        with open(self.path, 'rb+') as ledger_file:
+            ledger_file.seek(old)
+            ledger_file.write(data.replace(b'Payee 2', b'Payee 3'))
+        undo_log.record(self.user, entry, old, new, data)
+        self.assertEqual(self.revert(), 409)
+        self.assertEqual(self.payees(), ['Payee 1', 'Payee 3'])
+
+    @override_settings(LEDGER_UNDO_LEVELS=2)
+    def test_levels_limited(self):
+        for day in range(1, 5):
+            self.append(self.entry(day, 'Payee {}'.format(day)))
+        self.assertEqual(UndoRecord.objects.count(), 2)
+        self.assertEqual(self.revert(), 200)
+        self.assertEqual(self.revert(), 200)
+        self.assertEqual(self.revert(), 404)
+        self.assertEqual(self.payees(), ['Payee 1', 'Payee 2'])
+
+    def test_amend(self):
+        self.append(self.entry(1, 'Payee 1', note=':tag:'))
+        with mock.patch.object(
+                ledger_api.Journal,
+                'metadata',
+                return_value=([], [], []),
+        ):
+            response = self.client.get(
+                reverse('ledger_ui:submit'),
+                {'amend': 'true'},
+            )
+        self.assertEqual(response.context['form']['payee'].value(), 'Payee 1')
+        self.assertEqual(response.context['form']['note'].value(), ':tag:')
+        self.assertEqual(
+            [
+                (form.initial['name'], form.initial['amount'])
+                for form in response.context['formset']
+            ][:2],
+            [('Expenses:Food', '1.00'), ('Liabilities:Credit Card', None)],
+        )
+
+
+class JournalViewTests(JournalTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write('')
+        journal = ledger_api.Journal(self.path)
+        for day in range(1, 6):
+            journal.append(self.entry(day, 'Payee {}'.format(day)))
+
+        self.user = User.objects.create_user(
+            username='tester',
+        )
+        LedgerPath.objects.create(
+            user=self.user,
+            path=self.path,
+        )
+        self.client.force_login(self.user)
+
+    def payees(self, **params):
+        response = self.client.get(reverse('ledger_ui:journal'), params)
+        self.assertEqual(response.status_code, 200)
+        return (
+            [entry['payee'] for entry in response.context['entries']],
+            response.context['count'],
+        )
+
+    def test_count(self):
+        self.assertEqual(
+            self.payees(count=2),
+            (['Payee 5', 'Payee 4'], 2),
+        )
+        self.assertEqual(
+            self.payees(count=2, reverse='false'),
+            (['Payee 4', 'Payee 5'], 2),
+        )
+        self.assertEqual(
+            self.payees(count=5),
+            (['Payee 5', 'Payee 4', 'Payee 3', 'Payee 2', 'Payee 1'], 'all'),
+        )
+        self.assertEqual(
+            self.payees(count=1, filter='payee 2'),
+            (['Payee 2'], 'all'),
+        )
+        self.assertEqual(
+            self.payees(count='all'),
+            (['Payee 5', 'Payee 4', 'Payee 3', 'Payee 2', 'Payee 1'], 'all'),
+        )
+        self.assertEqual(
+            self.payees(count='all', reverse='false', filter='payee 4'),
+            (['Payee 4'], 'all'),
+        )
+
+    def test_date_range(self):
+        self.assertEqual(
+            self.payees(since='2019-02-02', until='2019-02-04'),
+            (['Payee 4', 'Payee 3', 'Payee 2'], 'all'),
+        )
+        self.assertEqual(
+            self.payees(since='2019-02-02', count=2, reverse='false'),
+            (['Payee 4', 'Payee 5'], 2),
+        )
+        self.assertEqual(
+            self.payees(since='', until='', count=1),
+            (['Payee 5'], 1),
+        )
+
+    def test_bad_date(self):
+        response = self.client.get(
+            reverse('ledger_ui:journal'),
+            {'since': '2019-02-30'},
+        )
+        self.assertEqual(response.status_code, 422)
+
+    def test_bad_count(self):
+        for count in ['many', '-1']:
+            response = self.client.get(
+                reverse('ledger_ui:journal'),
+                {'count': count},
+            )
+            self.assertEqual(response.status_code, 422)
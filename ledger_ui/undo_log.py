@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.db import transaction
+
+from .models import UndoRecord
+from utils import ledger_api
+
+
+def record(user, entry, old_position, new_position, data):
+    """Log the entry (or EntryBatch) just appended, so it can be reverted.
+
+    The data is what was written, as returned by Journal.append (so
+    the journal doesn't need to be read back).  Only the
+    LEDGER_UNDO_LEVELS latest records of the user are kept.
+
+    """
+    with transaction.atomic():
+        UndoRecord.objects.create(
+            user=user,
+            old_position=old_position,
+            new_position=new_position,
+            digest=ledger_api.Journal.digest(data),
+            last_entry=entry,
+        )
+        expired = UndoRecord.objects.filter(user=user).order_by(
+            '-pk',
+        ).values_list('pk', flat=True)[settings.LEDGER_UNDO_LEVELS:]
+        UndoRecord.objects.filter(pk__in=list(expired)).delete()
+
+
+def latest(user):
+    """Return the latest UndoRecord of the user, or None."""
+    return UndoRecord.objects.filter(user=user).order_by('-pk').first()
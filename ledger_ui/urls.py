@@ -9,7 +9,9 @@ urlpatterns = [
     path('submit/', views.submit, name='submit'),
     path('balance/', views.balance, name='balance'),
     path('charts/', views.charts, name='charts'),
+    path('charts/data/', views.charts_data, name='charts_data'),
     path('register/', views.register, name='register'),
+    path('register/data/', views.register_data, name='register_data'),
     path('rules/', views.RuleIndexView.as_view(), name='rules'),
     path('rule/', views.RuleCreateView.as_view(), name='rule'),
     path('rule/<int:pk>/', views.RuleEditView.as_view(), name='rule'),
@@ -1,22 +1,112 @@
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.db.models.functions import Lower
-from django.http import Http404, HttpResponse
-from django.shortcuts import get_object_or_404, redirect, render
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
 from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic.edit import CreateView, UpdateView, DeleteView
 
+import datetime
+import hashlib
+import itertools
+import numpy as np
 import pandas as pd
 import re
 
 from .forms import SubmitForm, RuleModelForm, AccountFormSet
-from .models import Undo
+from . import rollups, undo_log
 from ledger_submit.models import Rule
 from utils import ledger_api
 
 
+# The columns of the ledger csv report and their types.
+CSV_COLUMNS = [
+    'date', 'code', 'payee', 'account', 'currency', 'amount',
+    'reconciled', 'note',
+]
+CSV_DTYPES = {
+    'date': str,
+    'code': str,
+    'payee': str,
+    'account': 'category',
+    'currency': 'category',
+    'amount': 'float64',
+    'reconciled': str,
+    'note': str,
+}
+
+
+def read_csv(journal, *args, usecols, parse_dates=()):
+    """Return the ledger csv report as a DataFrame.
+
+    The report is parsed as it's produced and remembered until the
+    journal changes.
+
+    """
+    def read():
+        with journal.csv_stream(*args) as csv:
+            return pd.read_csv(
+                csv,
+                header=None,
+                names=CSV_COLUMNS,
+                usecols=usecols,
+                dtype={
+                    column: CSV_DTYPES[column]
+                    for column in usecols
+                    if column not in parse_dates
+                },
+                parse_dates=list(parse_dates),
+            )
+
+    return journal.memoized(
+        ('read_csv', args, tuple(usecols), tuple(parse_dates)),
+        read,
+    ).copy()
+
+
+def read_postings(journal, usecols):
+    """Return the postings as a DataFrame, like read_csv() does.
+
+    With LEDGER_ENGINE set to 'native' they're parsed without
+    running ledger, unless the journal is unsupported.
+
+    """
+    def parse():
+        try:
+            postings = journal.postings()
+        except journal.Unsupported:
+            return None
+        columns = {
+            'date': lambda: np.array(
+                postings.dates, dtype=object,
+            )[postings.entries],
+            'payee': lambda: np.array(
+                postings.payees, dtype=object,
+            )[postings.entries],
+            'account': lambda: pd.Categorical.from_codes(
+                postings.accounts, postings.account_names,
+            ),
+            'currency': lambda: pd.Categorical.from_codes(
+                postings.commodities, postings.commodity_names,
+            ),
+            'amount': lambda: postings.amounts,
+        }
+        return pd.DataFrame(
+            {column: columns[column]() for column in usecols},
+            columns=usecols,
+        )
+
+    if settings.LEDGER_ENGINE == 'native':
+        df = journal.memoized(('postings', tuple(usecols)), parse)
+        if df is not None:
+            return df.copy()
+    return read_csv(journal, usecols=usecols)
+
+
 def index(request):
     return render(
         request,
@@ -28,7 +118,9 @@ def index(request):
 def journal(request):
     if request.method == 'POST':
         if request.POST.get('revert'):
-            undo = get_object_or_404(Undo, pk=request.user)
+            undo = undo_log.latest(request.user)
+            if undo is None:
+                raise Http404
 
             ledger_path = request.user.ledger_path.path
             journal = ledger_api.Journal(ledger_path, undo)
@@ -41,44 +133,79 @@ def journal(request):
                     'ledger_ui/error/cannot_revert.html',
                     status=409,
                 )
-
-    entries = list(ledger_api.Journal(request.user.ledger_path.path))
-
+            undo.delete()
+            rollups.entry_reverted(request.user, journal)
 
     entry_filter = request.GET.get('filter', '')
-    if entry_filter:
-        entries = [
-            entry
-            for entry in entries
-            if entry_filter.lower() in entry['body'].lower()
-        ]
 
     count = request.GET.get('count', settings.LEDGER_ENTRY_COUNT)
     try:
         count = int(count)
+        if count < 0:
+            raise ValueError(count)
     except ValueError:
         if count is not None and count != 'all':
             return HttpResponse(
                 '<h1>Unprocessable Entity</h1> Bad count.',
                 status=422,
             )
-    if count != 'all' and len(entries) <= count:
-        count = 'all'
-    if count != 'all':
-        entries = entries[-count:]
+
+    dates = {}
+    for param in ['since', 'until']:
+        date = request.GET.get(param) or None
+        if date is not None:
+            try:
+                date = datetime.datetime.strptime(
+                    date, "%Y-%m-%d",
+                ).date().isoformat()
+            except ValueError:
+                return HttpResponse(
+                    '<h1>Unprocessable Entity</h1> Bad date.',
+                    status=422,
+                )
+        dates[param] = date
+
+    def filtered(entries):
+        if not entry_filter:
+            return entries
+        return (
+            entry
+            for entry in entries
+            if entry_filter.lower() in entry['body'].lower()
+        )
 
     reversed_sort = request.GET.get('reverse', 'true').lower() not in ['false', '0']
-    if reversed_sort:
-        entries = reversed(entries)
 
-    ledger_path = request.user.ledger_path.path
-    journal = ledger_api.Journal(ledger_path)
-    try:
-        undo = Undo.objects.get(pk=request.user)
-    except Undo.DoesNotExist:
-        pass
+    journal = ledger_api.Journal(request.user.ledger_path.path)
+    if count == 'all' or any(dates.values()):
+        # The date range is looked up in the index, only the entries
+        # from it get read.
+        entries = journal.entries(**dates)
+        if entry_filter:
+            entries = list(filtered(entries))
+        if count != 'all':
+            if len(entries) <= count:
+                count = 'all'
+            else:
+                entries = entries[len(entries) - count:]
+        if reversed_sort:
+            entries = entries[::-1]
     else:
-        journal.last_data = undo
+        # Read the journal backwards to avoid parsing the entries
+        # that are not going to be displayed anyway.  One additional
+        # entry tells whether there is anything more to show.
+        entries = list(itertools.islice(
+            filtered(journal.iter_reverse()),
+            count + 1,
+        ))
+        if len(entries) <= count:
+            count = 'all'
+        else:
+            del entries[count:]
+        if not reversed_sort:
+            entries.reverse()
+
+    journal.last_data = undo_log.latest(request.user)
 
     return render(
         request,
@@ -88,36 +215,85 @@ def journal(request):
             'reverse': reversed_sort,
             'count': count,
             'filter': entry_filter,
+            'since': dates['since'],
+            'until': dates['until'],
             'count_step': settings.LEDGER_ENTRY_COUNT,
             'can_revert': not entry_filter and journal.can_revert(),
+            # The entries submitted in a batch can only be reverted.
+            'can_amend': not getattr(journal.last_data, 'batch', True),
         },
     )
 
 
+def charts_fingerprint(request):
+    """Return what the chart data depends on, or None if it can't be told."""
+    fingerprint = ledger_api.ReportCache.fingerprint(
+        request.user.ledger_path.path,
+    )
+    if fingerprint is None:
+        return None
+    return (
+        fingerprint,
+        request.GET.get('account_filter', ''),
+        settings.LEDGER_DEFAULT_CURRENCY,
+        settings.LEDGER_ENGINE,
+    )
+
+
+def charts_etag(request):
+    fingerprint = charts_fingerprint(request)
+    if fingerprint is None:
+        return None
+    return hashlib.sha1(repr(fingerprint).encode()).hexdigest()
+
+
+def charts_last_modified(request):
+    fingerprint = charts_fingerprint(request)
+    if fingerprint is None:
+        return None
+    inode, size, mtime_ns, tail_digest = fingerprint[0]
+    return datetime.datetime.fromtimestamp(
+        mtime_ns / 10**9,
+        datetime.timezone.utc,
+    )
+
+
 @login_required
 def charts(request):
+    return render(
+        request,
+        'ledger_ui/charts.html',
+        {
+            'account_filter': request.GET.get('account_filter', ''),
+        },
+    )
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=charts_etag, last_modified_func=charts_last_modified)
+def charts_data(request):
     ledger_path = request.user.ledger_path.path
+    journal = ledger_api.Journal(ledger_path)
 
-    csv = ledger_api.Journal(ledger_path).csv(
-        '--real',
-        '--monthly',
-        '-X', settings.LEDGER_DEFAULT_CURRENCY,
-    )
-    df = pd.read_csv(
-        csv,
-        header=None,
-        names=[
-            'date', 'code', 'payee', 'account', 'currency', 'amount',
-            'reconciled', 'note',
-        ],
-        usecols=['date', 'payee', 'account', 'amount'],
-        parse_dates=['date'],
-    )
-    if len(df) == 0:
-        return render(
-            request,
-            'ledger_ui/charts.html',
+    df = rollups.monthly(request.user, journal)
+    if df is None:
+        df = read_csv(
+            journal,
+            '--real',
+            '--monthly',
+            '-X', settings.LEDGER_DEFAULT_CURRENCY,
+            usecols=['date', 'payee', 'account', 'amount'],
+            parse_dates=['date'],
         )
+    if len(df) == 0:
+        return JsonResponse({
+            'dates': [],
+            'expenses_totals': [],
+            'income_totals': [],
+            'assets': [],
+            'expenses': [],
+        })
 
     assets = df[df['account'].str.contains("^Assets:|^Liabilities:")]
     income = df[df['account'].str.contains("^Income:")]
@@ -142,21 +318,15 @@ def charts(request):
 
     date_grouped_assets['amount'] = date_grouped_assets['amount'].cumsum()
     expenses['date'] = expenses['date'].dt.strftime("%Y-%m")
+    expenses['account'] = expenses['account'].astype(str)
 
-    return render(
-        request,
-        'ledger_ui/charts.html',
-        {
-            'dates': {'data': date_range.strftime('%Y-%m').to_series().to_list()},
-            'expenses_totals': date_grouped_expenses['amount'].round(2).to_json(),
-            'income_totals': (-date_grouped_income['amount']).round(2).to_json(),
-            'expenses': (
-                expenses[['date', 'account', 'amount']].to_json(
-                    orient='table', index=False)),
-            'assets': date_grouped_assets['amount'].round(2).to_json(),
-            'account_filter': account_filter,
-        },
-    )
+    return JsonResponse({
+        'dates': date_range.strftime('%Y-%m').to_list(),
+        'expenses_totals': date_grouped_expenses['amount'].round(2).to_list(),
+        'income_totals': (-date_grouped_income['amount']).round(2).to_list(),
+        'assets': date_grouped_assets['amount'].round(2).to_list(),
+        'expenses': expenses[['date', 'account', 'amount']].to_dict('records'),
+    })
 
 
 @login_required
@@ -166,9 +336,7 @@ def submit(request):
     ledger_errors = False
 
     try:
-        accounts = journal.accounts()
-        currencies = journal.currencies()
-        payees = journal.payees()
+        accounts, currencies, payees = journal.metadata()
     except journal.LedgerCliError as e:
         accounts = currencies = payees = []
         ledger_errors = e.__cause__
@@ -195,7 +363,9 @@ def submit(request):
             )
 
             if validated['amend']:
-                undo = get_object_or_404(Undo, pk=request.user)
+                undo = undo_log.latest(request.user)
+                if undo is None or undo.batch:
+                    raise Http404
                 journal.last_data = undo
 
                 if validated['save_rule']:
@@ -224,22 +394,21 @@ def submit(request):
                         'ledger_ui/error/cannot_revert.html',
                         status=409,
                     )
+                undo.delete()
+                rollups.entry_reverted(request.user, journal)
 
-            old, new = journal.append(entry)
-            Undo.objects.update_or_create(
-                pk=request.user.id,
-                defaults={
-                    'last_entry': entry,
-                    'old_position': old,
-                    'new_position': new,
-                },
-            )
+            old, new, data = journal.append(entry)
+            rollups.entry_appended(request.user, journal, entry, old, new)
+            undo_log.record(request.user, entry, old, new, data)
             return redirect('ledger_ui:journal')
 
     else:
         amend = request.GET.get('amend', 'false').lower() not in ['false', '0']
         if amend:
-            last_entry = get_object_or_404(Undo, pk=request.user).last_entry
+            undo = undo_log.latest(request.user)
+            if undo is None or undo.batch:
+                raise Http404
+            last_entry = undo.last_entry
             form = SubmitForm(
                 {
                     'date': last_entry.date,
@@ -289,14 +458,8 @@ def submit(request):
 def balance(request):
     ledger_path = request.user.ledger_path.path
 
-    csv = ledger_api.Journal(ledger_path).csv()
-    df = pd.read_csv(
-        csv,
-        header=None,
-        names=[
-            'date', 'code', 'payee', 'account', 'currency', 'amount',
-            'reconciled', 'note',
-        ],
+    df = read_postings(
+        ledger_api.Journal(ledger_path),
         usecols=['account', 'currency', 'amount'],
     )
 
@@ -314,7 +477,7 @@ def balance(request):
             },
         )
 
-    balance = df.groupby(['account', 'currency']).sum()
+    balance = df.groupby(['account', 'currency'], observed=True).sum()
     balance['amount'] = balance['amount'].round(2)
 
     return render(
@@ -327,18 +490,67 @@ def balance(request):
     )
 
 
-@login_required
-def register(request):
-    ledger_path = request.user.ledger_path.path
+def format_register(df):
+    """Return the register rows as tuples ready to be displayed.
+
+    Each row is (date, payee, account, amount, amount_class, currency,
+    total, total_class), with the amounts formatted and their CSS
+    classes chosen for the whole columns at once.
+
+    """
+    def formatted(column):
+        # Adding 0.0 turns -0.0 into 0.0.
+        values = np.round(column.to_numpy(dtype='float64'), 2) + 0.0
+        classes = np.select(
+            [values == 0, values < 0],
+            ['null-balance', 'negative-balance'],
+            '',
+        )
+        return np.char.mod('%.2f', values).tolist(), classes.tolist()
+
+    def text(column):
+        return column.astype(object).where(column.notna(), '').tolist()
+
+    amounts, amount_classes = formatted(df['amount'])
+    totals, total_classes = formatted(df['total'])
+    return list(zip(
+        text(df['date']),
+        text(df['payee']),
+        text(df['account']),
+        amounts,
+        amount_classes,
+        text(df['currency']),
+        totals,
+        total_classes,
+    ))
+
+
+def register_page(request):
+    """Return the requested page of the register, the newest rows first.
+
+    Returns a dict with the formatted rows, the offset of the next
+    page (None if it's the last one) and the number of the currencies
+    in the whole register.  Raises ValueError with the name of the
+    invalid parameter.
+
+    """
+    params = {}
+    for param, default, minimum in [
+            ('offset', 0, 0),
+            ('count', settings.LEDGER_REGISTER_COUNT, 1),
+    ]:
+        value = request.GET.get(param, default)
+        try:
+            params[param] = int(value)
+            if params[param] < minimum:
+                raise ValueError(value)
+        except ValueError:
+            raise ValueError(param) from None
+    offset, count = params['offset'], params['count']
 
-    csv = ledger_api.Journal(ledger_path).csv()
-    df = pd.read_csv(
-        csv,
-        header=None,
-        names=[
-            'date', 'code', 'payee', 'account', 'currency', 'amount',
-            'reconciled', 'note',
-        ],
+    ledger_path = request.user.ledger_path.path
+    df = read_postings(
+        ledger_api.Journal(ledger_path),
         usecols=['date', 'payee', 'account', 'currency', 'amount'],
     )
 
@@ -346,30 +558,60 @@ def register(request):
     if search:
         df = df[df['account'].str.contains(search, case=False)]
 
-    if len(df) == 0:
-        return render(
-            request,
-            'ledger_ui/register.html',
-            {
-                'transactions': [],
-                'filter': search,
-            },
-        )
+    # The running total covers the older rows not shown too.
+    df = df.assign(total=df['amount'].cumsum())
+    end = max(len(df) - offset, 0)
+    page = df.iloc[max(end - count, 0):end].iloc[::-1]
+
+    return {
+        'transactions': format_register(page),
+        'next_offset': offset + count if end > count else None,
+        'count': count,
+        'currency_count': df['currency'].nunique(),
+    }
 
-    transactions = df
-    transactions['total'] = transactions['amount'].cumsum().round(2)
+
+@login_required
+def register(request):
+    try:
+        page = register_page(request)
+    except ValueError as e:
+        return HttpResponse(
+            '<h1>Unprocessable Entity</h1> Bad {}.'.format(e),
+            status=422,
+        )
 
     return render(
         request,
         'ledger_ui/register.html',
         {
-            'transactions': transactions,
-            'filter': search,
-            'currency_count': transactions['currency'].unique().size,
+            **page,
+            'filter': request.GET.get('filter', ''),
         },
     )
 
 
+@login_required
+def register_data(request):
+    try:
+        page = register_page(request)
+    except ValueError as e:
+        param = str(e)
+        return JsonResponse(
+            {
+                'error': {
+                    param: request.GET.get(param),
+                }
+            },
+            status=422,
+        )
+
+    return JsonResponse({
+        'transactions': page['transactions'],
+        'next': page['next_offset'],
+    })
+
+
 @method_decorator(login_required, name='dispatch')
 class RuleIndexView(generic.ListView):
     model = Rule
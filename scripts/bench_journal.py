@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+"""Compare the journal scanner with the original line-by-line parser.
+
+Usage: ./scripts/bench_journal.py [ENTRY_COUNT]
+
+Generates a journal with ENTRY_COUNT (500000 by default) entries in
+a temporary directory, checks that both implementations produce the
+same entries and prints how long each of them took, and how much
+memory keeping all the entries takes.
+
+"""
+
+import os, sys
+sys.path.append('.')
+
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from utils import ledger_api
+
+
+def reference_iter(path):
+    """The original Journal.__iter__, kept for comparison.
+
+    The only change is grouping the date alternatives in the entry
+    start regexp, so that it doesn't choke on a date with no payee.
+
+    """
+    date_regexp = r'\d{4}-\d{2}-\d{2}|\d{4}/\d{2}/\d{2}'
+    def prepare_entry(entry_lines):
+        match = re.match(
+            r'({date}){cleared}\s+({payee})'.format(
+                date=date_regexp,
+                cleared=r'(?: [!*])?',
+                payee=r'.*'
+            ),
+            entry_lines[0],
+        )
+        date = match.group(1)
+        payee = match.group(2)
+
+        match = re.fullmatch(
+            r'\s*;\s*(.*)',
+            entry_lines[1],
+        )
+        if match:
+            note = match.group(1)
+        else:
+            note = ''
+
+        return {
+            'body': "\n".join(entry_lines),
+            'date': date,
+            'payee': payee,
+            'note': note,
+        }
+
+    entry = []
+    with open(path, 'r') as ledger_file:
+        for line in map(str.rstrip, ledger_file):
+            if not entry:
+                if re.match(r'(?:{}) '.format(date_regexp), line):
+                    entry.append(line)
+            else:
+                if line:
+                    entry.append(line)
+                else:
+                    yield prepare_entry(entry)
+                    entry = []
+        if entry:
+            yield prepare_entry(entry)
+
+
+def generate(path, count):
+    rng = random.Random(0)
+    payees = ['Payee {}'.format(i) for i in range(500)]
+    with open(path, 'w') as ledger_file:
+        print('; -*- mode: ledger; -*-', file=ledger_file)
+        for i in range(count):
+            print(
+                ledger_api.Entry(
+                    date='20{:02d}-{:02d}-{:02d}'.format(
+                        10 + i * 10 // count,
+                        rng.randint(1, 12),
+                        rng.randint(1, 28),
+                    ),
+                    payee=rng.choice(payees),
+                    note=':tag:' if rng.random() < 0.2 else None,
+                    accounts=[
+                        ('Expenses:Food', str(rng.randint(1, 10000) / 100)),
+                        ('Liabilities:Credit Card',),
+                    ],
+                ),
+                file=ledger_file,
+            )
+
+
+def bench(name, function):
+    start = time.perf_counter()
+    result = function()
+    print('{:<40} {:8.3f}s'.format(name, time.perf_counter() - start))
+    return result
+
+
+def peak_memory(name, function):
+    tracemalloc.start()
+    try:
+        result = function()
+        print('{:<40} {:8.1f} MiB'.format(
+            name, tracemalloc.get_traced_memory()[1] / 2**20,
+        ))
+    finally:
+        tracemalloc.stop()
+    return result
+
+
+def main(count):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'ledger.dat')
+        generate(path, count)
+        print('{} entries, {} MiB'.format(
+            count, os.path.getsize(path) // 2**20,
+        ))
+
+        ledger_api.Journal.cache_dir = os.path.join(tmp_dir, 'cache')
+        journal = ledger_api.Journal(path)
+
+        expected = bench(
+            'reference parser',
+            lambda: list(reference_iter(path)),
+        )
+        def scan():
+            with open(path, 'rb') as ledger_file:
+                size = os.fstat(ledger_file.fileno()).st_size
+                with ledger_api.mapped(ledger_file, size) as buf:
+                    return list(ledger_api.scan_entries(buf))
+        bench('mmap scanner (headers only)', scan)
+        bench('index build', journal.index)
+        workers = os.cpu_count()
+        if workers > 1:
+            ledger_api.Journal._indexes.clear()
+            os.unlink(journal._index_path())
+            ledger_api.JournalIndex.parse_workers = workers
+            ledger_api.JournalIndex.parallel_parse_threshold = 0
+            bench(
+                'index build ({} processes)'.format(workers),
+                journal.index,
+            )
+            ledger_api.JournalIndex.parse_workers = 0
+        ledger_api.Journal._indexes.clear()
+        bench('index load', journal.index)
+        actual = bench('iteration (indexed)', lambda: list(journal))
+        bench('postings (native parser)', journal.postings)
+        if actual != expected:
+            sys.exit('The entries differ!')
+        del actual, expected
+
+        # Everything the journal view keeps while rendering all the
+        # entries.
+        def dicts():
+            entries = list(reference_iter(path))
+            for entry in entries:
+                entry['body']
+        peak_memory('peak memory (dicts)', dicts)
+        def compact():
+            entries = journal.entries()
+            for entry in entries:
+                entry['body']
+        peak_memory('peak memory (JournalEntries)', compact)
+
+        journal.append(ledger_api.Entry(
+            payee='Appended',
+            accounts=[('Expenses:Food', '1'), ('Assets:Cash',)],
+        ))
+        bench('index refresh after append', journal.index)
+        bench(
+            'tail({})'.format(20),
+            lambda: journal.tail(20),
+        )
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
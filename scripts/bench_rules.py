@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""Compare the rule matcher with checking all the rules one by one.
+
+Usage: ./scripts/bench_rules.py [RULE_COUNT...]
+
+For each RULE_COUNT (1000 and 5000 by default) generates that many
+rules and a batch of entries, checks that both ways of matching find
+the same first rule for each entry and prints how long each of them
+took.
+
+"""
+
+import os, sys
+sys.path.append('.')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ledger.settings')
+
+import django
+django.setup()
+
+import random
+import re
+import time
+
+from ledger_submit.models import Rule
+from ledger_submit.rules import CompiledRule, RuleMatcher
+
+
+ENTRY_COUNT = 2000
+
+
+def generate_rules(rng, count):
+    rules = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.6:
+            rule = Rule(payee=re.escape('MERCHANT {:05d}'.format(i)) + '.*')
+        elif kind < 0.8:
+            rule = Rule(payee='SHOP {0:05d}|STORE {0:05d}'.format(i))
+        elif kind < 0.95:
+            rule = Rule(
+                payee='PAYEE {:05d}'.format(i),
+                note='.*:tag{}:.*'.format(i % 50),
+            )
+        else:
+            rule = Rule(note='.*:note{:05d}:.*'.format(i))
+        rules.append(rule)
+    # The order the rules are checked in by the views.
+    rules.sort(key=lambda rule: (len(rule.payee), len(rule.note)),
+               reverse=True)
+    return [CompiledRule(rule) for rule in rules]
+
+
+def generate_entries(rng, count):
+    prefixes = ['MERCHANT', 'SHOP', 'STORE', 'PAYEE', 'UNKNOWN']
+    return [
+        {
+            'payee': '{} {:05d} WARSZAWA'.format(
+                rng.choice(prefixes), rng.randrange(count),
+            ),
+            'note': ':tag{}:'.format(rng.randrange(50))
+            if rng.random() < 0.5 else '',
+        }
+        for _ in range(ENTRY_COUNT)
+    ]
+
+
+def first_match(rules, entry):
+    for rule in rules:
+        if rule.check(entry):
+            return rule
+    return None
+
+
+def bench(name, function):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:8.3f}s {:8.1f}us/entry'.format(
+        name, elapsed, elapsed / ENTRY_COUNT * 1e6,
+    ))
+    return result
+
+
+def main(counts):
+    for count in counts:
+        rng = random.Random(count)
+        rules = generate_rules(rng, count)
+        entries = generate_entries(rng, count)
+        print('{} rules, {} entries'.format(count, ENTRY_COUNT))
+
+        matcher = bench('matcher build', lambda: RuleMatcher(rules))
+        expected = bench(
+            'all the rules',
+            lambda: [first_match(rules, entry) for entry in entries],
+        )
+        actual = bench(
+            'literal prefilter',
+            lambda: [
+                first_match(matcher.candidates(entry), entry)
+                for entry in entries
+            ],
+        )
+        if actual != expected:
+            sys.exit('The matched rules differ!')
+        print('matched: {}/{}'.format(
+            sum(rule is not None for rule in actual), ENTRY_COUNT,
+        ))
+
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]] or [1000, 5000])
@@ -0,0 +1,42 @@
+"use strict";
+
+// Append the older rows in place instead of following the link to
+// the next page.
+const loadMore = document.getElementById('load-more');
+
+loadMore.addEventListener('click', function (event) {
+  event.preventDefault();
+  fetch(loadMore.dataset.url, {credentials: 'same-origin'})
+    .then(response => response.json())
+    .then(data => {
+      const table = document.querySelector('.ledger-table').tBodies[0];
+      data.transactions.forEach(([date, payee, account, amount, amountClass,
+                                  currency, total, totalClass]) => {
+        const row = table.insertRow();
+        row.className = amountClass;
+        [
+          [date, ''],
+          [payee, ''],
+          [account, ''],
+          [amount, 'color-amount balance'],
+          [currency, 'color-amount'],
+          [total, totalClass + ' balance'],
+        ].forEach(([text, className]) => {
+          const cell = row.insertCell();
+          cell.textContent = text;
+          cell.className = className;
+        });
+      });
+
+      if (data.next === null) {
+        loadMore.remove();
+      } else {
+        for (const attribute of ['href', 'data-url']) {
+          const url = new URL(loadMore.getAttribute(attribute),
+                              window.location.href);
+          url.searchParams.set('offset', data.next);
+          loadMore.setAttribute(attribute, url.pathname + url.search);
+        }
+      }
+    });
+});
@@ -1,9 +1,29 @@
 #!/usr/bin/env python3
 
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping, Sequence
+import array
+import bisect
+import concurrent.futures
+import contextlib
+import fcntl
+import hashlib
 import io
+import itertools
+import locale
+import math
+import mmap
+import numpy as np
+import operator
+import os
+import pickle
 import re
+import selectors
+import stat
 import subprocess
+import sys
+import tempfile
+import threading
 import time
 
 
@@ -17,6 +37,95 @@ EntryAccount = namedtuple(
 )
 
 
+DATE_REGEXP = r'\d{4}-\d{2}-\d{2}|\d{4}/\d{2}/\d{2}'
+# A line starting an entry: a date followed by something more than
+# just whitespace.
+ENTRY_START_REGEXP = re.compile(
+    r'(?:{}) [^\r\n]*?\S'.format(DATE_REGEXP).encode(),
+)
+# A whole entry starting at the match position, capturing its date,
+# payee, note (if the second line is a comment) and the empty lines
+# following it.  Matches exactly where ENTRY_START_REGEXP does.
+ENTRY_REGEXP = re.compile(
+    r'({date})(?= )(?: [!*])?[ \t\f\v]+(\S(?:[^\r\n]*\S)?)'
+    r'(?:[ \t\f\v]*(?:\r\n?|\n)[ \t\f\v]*;[ \t\f\v]*((?:[^\r\n]*\S)?))?'
+    r'(?:[ \t\f\v]*(?:\r\n?|\n)[ \t\f\v]*\S(?:[^\r\n]*\S)?)*'
+    r'((?:[ \t\f\v]*(?:\r\n?|\n))*)'.format(
+        date=DATE_REGEXP,
+    ).encode(),
+)
+# The same for files using only LF line endings, which can be found
+# with a simpler (and faster) regexp since the lines can't end with
+# a lone CR.
+LF_ENTRY_REGEXP = re.compile(
+    r'(?m)^({date})(?= )(?: [!*])?[ \t\f\v]+(\S.*)'
+    r'(?:\n[ \t\f\v]*;[ \t\f\v]*(.*))?'
+    r'(?:\n[ \t\f\v]*\S.*)*'
+    r'((?:[ \t\f\v]*\n)*)'.format(
+        date=DATE_REGEXP,
+    ).encode(),
+)
+BLANK_LINES_REGEXP = re.compile(rb'(?:[ \t\f\v]*(?:\r\n?|\n))*')
+LINE_ENTRY_START_REGEXP = re.compile(
+    b'(?:\r\n?|\n)(?=' + ENTRY_START_REGEXP.pattern + b')',
+)
+# A line break followed by at least one line of only whitespace,
+# i.e. what separates the entries.
+PARAGRAPH_BREAK_REGEXP = re.compile(
+    rb'(?:\r\n?|\n)(?:[ \t\f\v]*(?:\r\n?|\n))+',
+)
+HEADER_REGEXP = re.compile(
+    r'({date}){cleared}\s+({payee})'.format(
+        date=DATE_REGEXP,
+        cleared=r'(?: [!*])?',
+        payee=r'.*',
+    )
+)
+NOTE_REGEXP = re.compile(r'\s*;\s*(.*)')
+# The first line of an entry, as ledger splits it: the date, state,
+# code, payee and the note.
+TRANSACTION_REGEXP = re.compile(
+    r'({date})(?: +[*!])?[ \t]+(?:\([^)]*\)[ \t]*)?(.*?)'
+    r'(?:(?:\t|  )[ \t]*;.*)?'.format(
+        date=DATE_REGEXP,
+    )
+)
+# A posting: its account and what follows it (the amount, the cost
+# and the note).  The account ends with two spaces or a tab.
+POSTING_REGEXP = re.compile(
+    r'[ \t]+(?:[*!][ \t]*)?([^ \t;](?:[^ \t]| (?! ))*)'
+    r'(?:(?:\t|  )[ \t]*(.*))?'
+)
+COMMODITY_PATTERN = r'[^\s\d\-+.,;:?!*/^&|=<>{}\[\]()@"]+'
+AMOUNT_REGEXP = re.compile(
+    r'(-)?(?:({commodity}) *)?(-)?'
+    r'(\d+(?:,\d{{3}})*(?:\.(\d+))?|\.(\d+))'
+    r'(?: *({commodity}))?'.format(
+        commodity=COMMODITY_PATTERN,
+    )
+)
+# An amount with its cost.
+COST_REGEXP = re.compile(r'(.*?)\s*(@@?)\s*(.*)')
+# The lines outside of the entries which don't affect the postings:
+# comments and the commodity prices.
+NEUTRAL_LINE_REGEXP = re.compile(
+    rb'[ \t\f\v]*(?:;.*)?|[#%|*].*|P .*',
+    re.DOTALL,
+)
+
+
+IndexedEntry = namedtuple(
+    'IndexedEntry',
+    [
+        'offset',
+        'length',
+        'date',
+        'payee',
+        'note',
+    ],
+)
+
+
 class Entry:
     """A single Ledger entry.
 
@@ -181,6 +290,1422 @@ class Entry:
         return "\n".join(output)
 
 
+class EntryBatch(list):
+    """Entries appended together, printed the way they get written.
+
+    >>> print(EntryBatch([
+    ...    Entry(payee="A", accounts=[("Expenses:Food", "1 $"), ("Assets",)],
+    ...          date="2019-02-15"),
+    ...    Entry(payee="B", accounts=[("Expenses:Food", "2 $"), ("Assets",)],
+    ...          date="2019-02-16"),
+    ... ]))
+    <BLANKLINE>
+    2019-02-15 A
+        Expenses:Food                              $1.00
+        Assets
+    <BLANKLINE>
+    2019-02-16 B
+        Expenses:Food                              $2.00
+        Assets
+    """
+
+    def __str__(self):
+        return "\n".join(map(str, self))
+
+
+def decode(data):
+    return data.decode('utf-8', errors='replace')
+
+
+def entry_body(data):
+    """Normalize the raw bytes of an entry the way they're displayed."""
+    return "\n".join(decode(line).rstrip() for line in data.splitlines())
+
+
+def entry_header(entry_lines):
+    """Extract the date, payee and note from the decoded first lines
+    of an entry.
+
+    """
+    match = HEADER_REGEXP.match(entry_lines[0])
+    date = match.group(1)
+    payee = match.group(2)
+
+    match = None
+    if len(entry_lines) > 1:
+        match = NOTE_REGEXP.fullmatch(entry_lines[1])
+    if match:
+        note = match.group(1)
+    else:
+        # In Django strings usually aren't nullable, let's
+        # keep this convention and just store an empty string.
+        note = ''
+
+    return date, payee, note
+
+
+def _entry_matches(buf, start, end):
+    """Yield ENTRY_REGEXP matches of all the entries in buf[start:end]."""
+    position = BLANK_LINES_REGEXP.match(buf, start, end).end()
+    while position < end:
+        match = ENTRY_REGEXP.match(buf, position, end)
+        if match is None:
+            # Skipping the non-entries preceding the entry, if any.
+            paragraph_break = PARAGRAPH_BREAK_REGEXP.search(
+                buf, position, end,
+            )
+            paragraph_end = paragraph_break.start() if paragraph_break else end
+            entry_start = LINE_ENTRY_START_REGEXP.search(
+                buf, position, paragraph_end,
+            )
+            if entry_start is None:
+                position = BLANK_LINES_REGEXP.match(
+                    buf, paragraph_end, end,
+                ).end()
+                continue
+            match = ENTRY_REGEXP.match(buf, entry_start.end(), end)
+        yield match
+        position = match.end()
+
+
+def scan_entries(buf, start=0, end=None):
+    """Find the entries in the raw journal data.
+
+    buf may be anything supporting the buffer protocol, most notably
+    a mmap of the journal file.  Yields an IndexedEntry for every
+    entry starting in buf[start:end].  Only the header fields of the
+    entries get decoded.
+
+    """
+    if end is None or end > len(buf):
+        end = len(buf)
+
+    # The preceding line break counts too, the LF_ENTRY_REGEXP entries
+    # can only start after an LF.
+    if buf.find(b'\r', max(0, start - 1), end) == -1:
+        matches = LF_ENTRY_REGEXP.finditer(buf, start, end)
+    else:
+        matches = _entry_matches(buf, start, end)
+
+    for match in matches:
+        entry_start = match.start()
+        entry_end = match.start(4)
+        # Only LF_ENTRY_REGEXP leaves the trailing whitespace in.
+        while buf[entry_end - 1] in b' \t\f\v':
+            entry_end -= 1
+        date, payee, note, _ = match.groups()
+        yield IndexedEntry(
+            entry_start,
+            entry_end - entry_start,
+            date.decode(),
+            payee.decode('utf-8', errors='replace').rstrip(),
+            # In Django strings usually aren't nullable, let's
+            # keep this convention and just store an empty string.
+            (
+                note.decode('utf-8', errors='replace').rstrip()
+                if note is not None
+                else ''
+            ),
+        )
+
+
+@contextlib.contextmanager
+def mapped(ledger_file, size):
+    """Map the first size bytes of a regular file to memory.
+
+    A shared lock is held as long as the file is mapped, so it
+    doesn't get truncated under our feet by Journal.revert (which
+    would end with a SIGBUS).
+
+    """
+    if size == 0:
+        # mmap refuses to map empty files.
+        yield b''
+        return
+    fd = ledger_file.fileno()
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    try:
+        if os.fstat(fd).st_size == 0:
+            # Truncated in the meantime.
+            yield b''
+        else:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as buf:
+                yield buf
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _paragraph_entry(paragraph):
+    """Build an entry from the non-empty lines between two empty ones.
+
+    The paragraph is a list of (offset, stripped_line) pairs in the
+    reverse order.  Just like when reading the file forwards, the
+    entry starts at the first line looking like an entry header and
+    spans until the end of the paragraph.
+
+    """
+    for i, (offset, line) in enumerate(reversed(paragraph)):
+        if ENTRY_START_REGEXP.match(line):
+            break
+    else:
+        return None
+
+    last_offset, last_line = paragraph[0]
+    lines = [
+        decode(line).rstrip()
+        for _, line in reversed(paragraph[:len(paragraph) - i])
+    ]
+    return (
+        IndexedEntry(
+            offset, last_offset + len(last_line) - offset,
+            *entry_header(lines[:2])
+        ),
+        "\n".join(lines),
+    )
+
+
+def reverse_scan_entries(ledger_file, end, block_size=64 * 1024):
+    """Find the entries in a binary file, starting from the last one.
+
+    Reads the file backwards from the offset end in blocks of
+    block_size bytes, so only the data after the yielded entries is
+    ever read.  Yields (IndexedEntry, body) pairs.
+
+    """
+    position = end
+    # The file data from position to the end of the latest paragraph
+    # that wasn't completely read yet.
+    pending = b''
+    while position > 0:
+        start = max(0, position - block_size)
+        ledger_file.seek(start)
+        data = ledger_file.read(position - start) + pending
+        lines = data.splitlines(keepends=True)
+        if start > 0:
+            # The first line might not be complete, let's leave it
+            # for the next block.
+            lines = lines[1:]
+
+        offset = start + len(data)
+        processed = offset
+        paragraph = []
+        for line in reversed(lines):
+            offset -= len(line)
+            stripped = line.rstrip()
+            if stripped:
+                paragraph.append((offset, stripped))
+            else:
+                if paragraph:
+                    entry = _paragraph_entry(paragraph)
+                    if entry is not None:
+                        yield entry
+                    paragraph = []
+                processed = offset
+
+        if start == 0 and paragraph:
+            entry = _paragraph_entry(paragraph)
+            if entry is not None:
+                yield entry
+
+        pending = data[:processed - start]
+        position = start
+
+
+class JournalEntry(Mapping):
+    """A read-only view of a single entry of JournalEntries.
+
+    Behaves like a dict with the body, date, payee and note keys, the
+    body being decoded only when accessed.
+
+    """
+
+    __slots__ = ('entries', 'position')
+
+    KEYS = ('body', 'date', 'payee', 'note')
+
+    def __init__(self, entries, position):
+        self.entries = entries
+        self.position = position
+
+    def __getitem__(self, key):
+        if key == 'body':
+            return self.entries.body(self.position)
+        elif key == 'date':
+            return self.entries.dates[self.position]
+        elif key == 'payee':
+            return self.entries.payees[self.position]
+        elif key == 'note':
+            return self.entries.notes[self.position]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def __repr__(self):
+        return 'JournalEntry({!r})'.format(dict(self))
+
+
+class JournalEntries(Sequence):
+    """A compact sequence of journal entries.
+
+    Instead of a dict per entry, the offsets and lengths of the
+    entries are kept in arrays and their headers in lists of interned
+    strings.  The bodies are sliced from the raw journal data shared
+    by all the entries when accessed.  The data may be just a part of
+    the journal starting at the data_start offset.  The items are
+    JournalEntry views created on demand.
+
+    """
+
+    __slots__ = (
+        'data', 'data_start',
+        'offsets', 'lengths', 'dates', 'payees', 'notes',
+    )
+
+    def __init__(self, entries=(), data=b''):
+        """Build the container from an iterable of IndexedEntry."""
+        entries = list(entries)
+        offsets, lengths, dates, payees, notes = (
+            map(operator.itemgetter(field), entries)
+            for field in range(len(IndexedEntry._fields))
+        )
+        self.data = data
+        self.data_start = 0
+        self.offsets = array.array('q', offsets)
+        self.lengths = array.array('q', lengths)
+        # Many entries share the same dates and payees.
+        self.dates = list(map(sys.intern, dates))
+        self.payees = list(map(sys.intern, payees))
+        self.notes = list(map(sys.intern, notes))
+
+    @classmethod
+    def from_columns(cls, columns, data=b'', data_start=0):
+        """The inverse of columns(), the columns are used as they are."""
+        entries = cls.__new__(cls)
+        entries.data = data
+        entries.data_start = data_start
+        (entries.offsets, entries.lengths,
+         entries.dates, entries.payees, entries.notes) = columns
+        return entries
+
+    def columns(self):
+        return self.offsets, self.lengths, self.dates, self.payees, self.notes
+
+    def with_data(self, data, data_start=0):
+        """Return the same entries reading their bodies from data."""
+        return self.from_columns(self.columns(), data, data_start)
+
+    def span(self):
+        """Return the (start, end) offsets of the data of all the entries."""
+        if not self:
+            return 0, 0
+        return (
+            min(self.offsets),
+            max(map(operator.add, self.offsets, self.lengths)),
+        )
+
+    def body(self, position):
+        offset = self.offsets[position] - self.data_start
+        return entry_body(self.data[offset:offset + self.lengths[position]])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.from_columns(
+                [column[key] for column in self.columns()],
+                self.data,
+                self.data_start,
+            )
+
+        size = len(self)
+        if key < 0:
+            key += size
+        if not 0 <= key < size:
+            raise IndexError('entry index out of range')
+        return JournalEntry(self, key)
+
+    def __iter__(self):
+        return map(JournalEntry, itertools.repeat(self), range(len(self)))
+
+    def __reversed__(self):
+        return map(
+            JournalEntry,
+            itertools.repeat(self),
+            reversed(range(len(self))),
+        )
+
+    def take(self, positions):
+        """Return the entries at the passed positions, in their order."""
+        offsets, lengths, dates, payees, notes = (
+            list(map(column.__getitem__, positions))
+            for column in self.columns()
+        )
+        return self.from_columns(
+            [
+                array.array('q', offsets),
+                array.array('q', lengths),
+                dates,
+                payees,
+                notes,
+            ],
+            self.data,
+            self.data_start,
+        )
+
+    def __add__(self, other):
+        return self.from_columns(
+            [
+                mine + theirs
+                for mine, theirs in zip(self.columns(), other.columns())
+            ],
+            self.data,
+            self.data_start,
+        )
+
+
+def normalize_date(date):
+    """Make the entry dates comparable with each other.
+
+    >>> normalize_date('2019/02/15')
+    '2019-02-15'
+    >>> normalize_date('2019-02-15')
+    '2019-02-15'
+    """
+    return date.replace('/', '-')
+
+
+class DateIndex:
+    """The positions of the entries sorted by their dates.
+
+    Allows finding the entries from a date range with a binary search
+    instead of looking at all of them.  As the journal entries are
+    usually written in the chronological order, the permutation
+    sorting them is only kept if they aren't.
+
+    """
+
+    def __init__(self, dates):
+        normalized = {}
+        keys = [
+            normalized.get(date) or normalized.setdefault(
+                date, normalize_date(date),
+            )
+            for date in dates
+        ]
+        if all(map(operator.le, keys, itertools.islice(keys, 1, None))):
+            self.order = None
+            self.keys = keys
+        else:
+            # sorted() is stable, so the entries with the same date
+            # stay in the file order.
+            self.order = array.array(
+                'q', sorted(range(len(keys)), key=keys.__getitem__),
+            )
+            self.keys = list(map(keys.__getitem__, self.order))
+
+    def positions(self, since=None, until=None):
+        """Return the positions of the entries dated from since to until.
+
+        Both ends are inclusive and are normalized dates, None meaning
+        no limit.  The positions are returned in the file order.
+
+        """
+        low = 0 if since is None else bisect.bisect_left(self.keys, since)
+        high = (
+            len(self.keys) if until is None
+            else bisect.bisect_right(self.keys, until)
+        )
+        if self.order is None:
+            return range(low, high)
+        return sorted(self.order[low:high])
+
+
+def split_ranges(buf, start, end, parts):
+    """Split buf[start:end] into at most parts ranges of similar sizes.
+
+    The ranges start only right after the empty lines, where no entry
+    can continue, so scanning them separately finds the same entries
+    as scanning the whole buf[start:end].  Returns a list of (start,
+    end) pairs.
+
+    """
+    bounds = [start]
+    step = (end - start) // parts
+    for part in range(1, parts):
+        position = max(start + part * step, bounds[-1])
+        paragraph_break = PARAGRAPH_BREAK_REGEXP.search(buf, position, end)
+        if paragraph_break is None:
+            break
+        bounds.append(paragraph_break.end())
+    bounds.append(end)
+    return [
+        (range_start, range_end)
+        for range_start, range_end in zip(bounds, bounds[1:])
+        if range_start < range_end
+    ]
+
+
+def _scan_range(path, inode, start, end):
+    """Scan a part of a journal file in a worker process.
+
+    Returns the columns of the found JournalEntries, or None if the
+    file got replaced in the meantime.
+
+    """
+    with open(path, 'rb') as ledger_file:
+        file_stat = os.fstat(ledger_file.fileno())
+        if file_stat.st_ino != inode or file_stat.st_size < end:
+            return None
+        with mapped(ledger_file, end) as buf:
+            return JournalEntries(scan_entries(buf, start, end)).columns()
+
+
+def parallel_scan_entries(ledger_file, buf, start, end, workers):
+    """Find the entries in buf[start:end] using a pool of processes.
+
+    buf is the data of ledger_file, which gets split into one range
+    per worker.  The workers read the file on their own and the
+    entries they found are merged in the file order.  Returns
+    JournalEntries, or None if the workers couldn't do their job.
+
+    """
+    ranges = split_ranges(buf, start, end, workers)
+    inode = os.fstat(ledger_file.fileno()).st_ino
+    try:
+        with concurrent.futures.ProcessPoolExecutor(len(ranges)) as pool:
+            parts = list(pool.map(
+                _scan_range,
+                itertools.repeat(ledger_file.name),
+                itertools.repeat(inode),
+                *zip(*ranges)
+            ))
+    except (OSError, concurrent.futures.process.BrokenProcessPool):
+        return None
+    if None in parts:
+        return None
+
+    entries = JournalEntries()
+    for columns in parts:
+        entries += JournalEntries.from_columns(columns)
+    return entries
+
+
+class Postings:
+    """The postings of the journal entries, in NumPy arrays.
+
+    Each posting has the position of its entry (entries), its account
+    and commodity (as indexes into account_names and commodity_names)
+    and its amount.  The dates (YYYY/MM/DD, like in the ledger
+    reports) and payees are kept by the entry.
+
+    """
+
+    def __init__(self, entries, accounts, commodities, amounts,
+                 account_names, commodity_names, dates, payees):
+        self.entries = entries
+        self.accounts = accounts
+        self.commodities = commodities
+        self.amounts = amounts
+        self.account_names = account_names
+        self.commodity_names = commodity_names
+        self.dates = dates
+        self.payees = payees
+
+    def __len__(self):
+        return len(self.amounts)
+
+
+def parse_amount(amount):
+    """Parse an amount into (quantity, commodity, precision).
+
+    Raises ValueError if it's not a plain amount.
+
+    >>> parse_amount('-1,000.50 PLN')
+    (-1000.5, 'PLN', 2)
+    >>> parse_amount('$-10')
+    (-10.0, '$', 0)
+    >>> parse_amount('10 EUR @ 4.30 PLN')
+    Traceback (most recent call last):
+      ...
+    ValueError: Unsupported amount: 10 EUR @ 4.30 PLN
+    """
+    match = AMOUNT_REGEXP.fullmatch(amount)
+    if (not match
+            or (match.group(1) and match.group(3))
+            or (match.group(2) and match.group(7))):
+        raise ValueError('Unsupported amount: {}'.format(amount))
+    quantity = float(match.group(4).replace(',', ''))
+    if match.group(1) or match.group(3):
+        quantity = -quantity
+    commodity = match.group(2) or match.group(7) or ''
+    precision = len(match.group(5) or match.group(6) or '')
+    return quantity, commodity, precision
+
+
+def parse_postings(entries):
+    """Parse the postings of JournalEntries into Postings.
+
+    Supports the postings with plain amounts, the per-unit (@) and
+    total (@@) costs and the elided amounts, including those
+    balancing several commodities.  Raises ValueError on anything
+    else, like the balance assertions, lot prices or amount
+    expressions.
+
+    """
+    entry_positions = array.array('q')
+    accounts = array.array('q')
+    commodities = array.array('q')
+    amounts = array.array('d')
+    account_codes = {}
+    commodity_codes = {}
+    dates = []
+    payees = []
+    # The display precision of each commodity, i.e. the most decimal
+    # places it was used with so far.
+    precisions = {}
+
+    def amount_of(amount):
+        quantity, commodity, precision = parse_amount(amount)
+        precisions[commodity] = max(precisions.get(commodity, 0), precision)
+        return quantity, commodity
+
+    for position in range(len(entries)):
+        lines = entries.body(position).split('\n')
+        header = TRANSACTION_REGEXP.fullmatch(lines[0])
+        if not header:
+            raise ValueError('Unsupported entry: {}'.format(lines[0]))
+        dates.append(normalize_date(header.group(1)).replace('-', '/'))
+        payees.append(header.group(2))
+
+        # (account, quantity, commodity), or (account, None, group)
+        # for the elided amounts balancing the group.
+        postings = []
+        # The sums of the balanced postings by the balancing group
+        # (real or balanced virtual) and commodity.
+        sums = {'real': {}, 'virtual': {}}
+        elided = {}
+        for line in lines[1:]:
+            if NOTE_REGEXP.fullmatch(line):
+                continue
+            match = POSTING_REGEXP.fullmatch(line)
+            if not match:
+                raise ValueError('Unsupported posting: {}'.format(line))
+            account, rest = match.groups()
+            amount = (rest or '').partition(';')[0].strip()
+            if account.startswith('(') and account.endswith(')'):
+                group = None
+            elif account.startswith('[') and account.endswith(']'):
+                group = 'virtual'
+            else:
+                group = 'real'
+
+            if not amount:
+                if group is None or group in elided:
+                    raise ValueError('Unsupported posting: {}'.format(line))
+                elided[group] = account
+                postings.append((account, None, group))
+                continue
+
+            cost_type = None
+            if '@' in amount:
+                amount, cost_type, cost = COST_REGEXP.fullmatch(
+                    amount,
+                ).groups()
+            quantity, commodity = amount_of(amount)
+            postings.append((account, quantity, commodity))
+            if group is None:
+                continue
+            if cost_type:
+                cost_quantity, commodity = amount_of(cost)
+                if cost_type == '@':
+                    quantity *= cost_quantity
+                else:
+                    quantity = math.copysign(abs(cost_quantity), quantity)
+            sums[group][commodity] = sums[group].get(commodity, 0) + quantity
+
+        for group, group_sums in sums.items():
+            unbalanced = {
+                commodity: total
+                for commodity, total in group_sums.items()
+                if round(total, precisions[commodity])
+            }
+            if group in elided:
+                if not unbalanced:
+                    raise ValueError(
+                        'Nothing to balance: {}'.format(lines[0]),
+                    )
+            elif unbalanced and not (
+                    # ledger balances these with an implicit price.
+                    len(unbalanced) == 2
+                    and min(unbalanced.values()) < 0
+                    < max(unbalanced.values())
+            ):
+                raise ValueError('Unbalanced entry: {}'.format(lines[0]))
+            sums[group] = unbalanced
+
+        for account, quantity, commodity in postings:
+            if quantity is None:
+                balancing = [
+                    (-total, commodity)
+                    for commodity, total in sums[commodity].items()
+                ]
+            else:
+                balancing = [(quantity, commodity)]
+            for quantity, commodity in balancing:
+                entry_positions.append(position)
+                accounts.append(
+                    account_codes.setdefault(account, len(account_codes)),
+                )
+                commodities.append(
+                    commodity_codes.setdefault(
+                        commodity, len(commodity_codes),
+                    ),
+                )
+                amounts.append(quantity)
+
+    return Postings(
+        np.frombuffer(entry_positions, dtype=np.int64),
+        np.frombuffer(accounts, dtype=np.int64),
+        np.frombuffer(commodities, dtype=np.int64),
+        np.frombuffer(amounts, dtype=np.float64),
+        list(account_codes),
+        list(commodity_codes),
+        dates,
+        payees,
+    )
+
+def tail_digest(ledger_file, size):
+    """Return the digest of the end of the first size bytes of the file.
+
+    It tells whether the file was only appended to since it had that
+    size, see JournalIndex.TAIL_SIZE.
+
+    """
+    start = max(0, size - JournalIndex.TAIL_SIZE)
+    ledger_file.seek(start)
+    return hashlib.blake2b(ledger_file.read(size - start)).digest()
+
+
+class JournalIndex:
+    """The offsets and headers of all the entries in a journal file.
+
+    Keyed by the inode, size and mtime of the file.  If the file only
+    grew since the index was built (which is what Journal.append
+    does), only the new data gets parsed.  Otherwise the index is
+    rebuilt from scratch.
+
+    The saved index is a log of pickled frames, each one replacing
+    the entries after the first kept ones with the new ones, so that
+    saving an index after an append doesn't need to rewrite it whole.
+
+    """
+
+    # Bump whenever the pickled format changes.
+    VERSION = 3
+    # How many of the last indexed bytes are checked to tell apart an
+    # append from a rewrite.
+    TAIL_SIZE = 4096
+    # After this many frames the saved index gets rewritten as one.
+    MAX_FRAMES = 64
+
+    # How many processes to parse the journals with.  0 means parsing
+    # them in the current process.
+    parse_workers = 0
+    # Below this many bytes to parse, starting the processes isn't
+    # worth it.
+    parallel_parse_threshold = 32 * 2**20
+
+    def __init__(self, entries=None, stat_key=None, tail_digest=None,
+                 base=None, kept=0, data=None):
+        # JournalEntries without the data.
+        self.entries = entries if entries is not None else JournalEntries()
+        self.stat_key = stat_key
+        self.tail_digest = tail_digest
+        # The indexed data of the file, see data().
+        self._data = data
+        # The saved state of the index this one was refreshed from
+        # and how many of its entries are still valid.
+        self.base = base
+        self.kept = kept
+        # (path, size, frame count) of the index file if this index
+        # is the last thing saved there.
+        self.saved = None
+        self._date_index = None
+
+    def data(self, ledger_file, span=None):
+        """Return the indexed data of the file and its starting offset.
+
+        Once read whole, it's kept in memory along with the index, so
+        that the entry bodies can be served without reading the
+        journal again.  After an append only the new data gets read.
+        Until then, if only the (start, end) span is needed, only
+        that gets read.
+
+        """
+        if self._data is None:
+            if span is not None:
+                start, end = span
+                return self._read(ledger_file, start, end), start
+            data = self._read(ledger_file, 0, self.size)
+            if len(data) != self.size:
+                # Truncated in the meantime, let's not keep it.
+                return data, 0
+            self._data = data
+        return self._data, 0
+
+    def date_index(self):
+        """Return the DateIndex of the entries, built on the first use."""
+        if self._date_index is None:
+            self._date_index = DateIndex(self.entries.dates)
+        return self._date_index
+
+    @property
+    def size(self):
+        if self.stat_key is None:
+            return 0
+        return self.stat_key[1]
+
+    @staticmethod
+    def _read(ledger_file, start, end):
+        ledger_file.seek(start)
+        return ledger_file.read(end - start)
+
+    def _only_appended(self, ledger_file, file_stat):
+        if self.stat_key is None:
+            return False
+        inode, size, mtime = self.stat_key
+        return (
+            file_stat.st_ino == inode
+            # If the size didn't change, but the mtime did, it's an
+            # edit (possibly before the checked tail).
+            and file_stat.st_size > size
+            and tail_digest(ledger_file, size) == self.tail_digest
+        )
+
+    def refreshed(self, ledger_file):
+        """Return an index up to date with the passed binary file.
+
+        The index itself is never modified, so it can still be used
+        by the other threads.  If the file didn't change, the same
+        index is returned.
+
+        """
+        file_stat = os.fstat(ledger_file.fileno())
+        stat_key = (
+            file_stat.st_ino,
+            file_stat.st_size,
+            file_stat.st_mtime_ns,
+        )
+        if stat_key == self.stat_key:
+            return self
+
+        if not stat.S_ISREG(file_stat.st_mode):
+            # Not seekable in general (but also usually empty like
+            # /dev/null), don't bother being smart.
+            data = ledger_file.read()
+            return JournalIndex(
+                JournalEntries(scan_entries(data)),
+                stat_key=stat_key[:1] + (len(data),) + stat_key[2:],
+                data=data,
+            )
+
+        kept = 0
+        position = 0
+        data = None
+        size = file_stat.st_size
+        if self._only_appended(ledger_file, file_stat):
+            if self.entries:
+                # The last entry might have been extended, let's parse
+                # it once again.
+                kept = len(self.entries) - 1
+                position = self.entries.offsets[-1]
+            if self._data is not None:
+                data = self._data + self._read(ledger_file, self.size, size)
+                if len(data) != size:
+                    data = None
+
+        with mapped(ledger_file, size) as buf:
+            new_entries = self._scan(ledger_file, buf, position, size)
+        return JournalIndex(
+            self.entries[:kept] + new_entries,
+            stat_key=stat_key,
+            tail_digest=tail_digest(ledger_file, size),
+            base=self.saved,
+            kept=kept,
+            data=data,
+        )
+
+    @classmethod
+    def _scan(cls, ledger_file, buf, start, end):
+        if (cls.parse_workers > 1
+                and end - start >= cls.parallel_parse_threshold):
+            entries = parallel_scan_entries(
+                ledger_file, buf, start, end, cls.parse_workers,
+            )
+            if entries is not None:
+                return entries
+        return JournalEntries(scan_entries(buf, start, end))
+
+    @classmethod
+    def load(cls, index_path):
+        """Load a saved index, or return an empty one if impossible."""
+        try:
+            with open(index_path, 'rb') as index_file:
+                fcntl.flock(index_file.fileno(), fcntl.LOCK_SH)
+                if pickle.load(index_file) != cls.VERSION:
+                    return cls()
+                index = cls()
+                frames = 0
+                while True:
+                    try:
+                        kept, columns, stat_key, tail_digest = (
+                            pickle.load(index_file)
+                        )
+                    except EOFError:
+                        break
+                    index.entries = (
+                        index.entries[:kept]
+                        + JournalEntries.from_columns(columns)
+                    )
+                    index.stat_key = stat_key
+                    index.tail_digest = tail_digest
+                    frames += 1
+                index.saved = (index_path, index_file.tell(), frames)
+                return index
+        except Exception:
+            # The index is only a cache, it's never fatal if it's
+            # missing or corrupted.
+            return cls()
+
+    def save(self, index_path):
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            fd = os.open(index_path, os.O_RDWR | os.O_CREAT, 0o644)
+            with os.fdopen(fd, 'r+b') as index_file:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                size = index_file.seek(0, io.SEEK_END)
+                base = self.base
+                if (base is not None
+                        and base[:2] == (index_path, size)
+                        and base[2] < self.MAX_FRAMES):
+                    # Nobody saved anything there since our base, we
+                    # can just append the changes.
+                    kept = self.kept
+                    frames = base[2] + 1
+                else:
+                    index_file.seek(0)
+                    index_file.truncate()
+                    pickle.dump(self.VERSION, index_file)
+                    kept = 0
+                    frames = 1
+                pickle.dump(
+                    (
+                        kept,
+                        self.entries[kept:].columns(),
+                        self.stat_key,
+                        self.tail_digest,
+                    ),
+                    index_file,
+                    pickle.HIGHEST_PROTOCOL,
+                )
+                index_file.flush()
+                self.saved = (index_path, index_file.tell(), frames)
+        except OSError:
+            pass
+
+
+def _stat_key(path):
+    file_stat = os.stat(path)
+    return (file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns)
+
+
+class LedgerWorker:
+    """A ledger process running in its interactive mode.
+
+    The journal gets parsed once, when the process starts, and then
+    any number of commands can be run against it.  The end of the
+    output of each command is found by following it with an echo of
+    a unique marker.
+
+    """
+
+    # What ledger prints before reading each command.
+    PROMPT_REGEXP = re.compile(r'(?:\]+ )*')
+
+    def __init__(self, command, path):
+        self.path = path
+        # The journal the process has parsed.  Noticing the changes
+        # of the files it includes is beyond us.
+        self.stat_key = _stat_key(path)
+        self.process = subprocess.Popen(
+            [command, '-f', path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        os.set_blocking(self.process.stderr.fileno(), False)
+        self.encoding = locale.getpreferredencoding(False)
+        self.last_used = time.monotonic()
+        # What was read past the output of the last command, usually
+        # the prompt for the next one.
+        self.pending = b''
+        # Whether the process is out of sync with us, and whether
+        # that's because it exited.
+        self.broken = False
+        self.crashed = False
+
+    def fresh(self):
+        """Check whether the process is alive and the journal unchanged."""
+        try:
+            return (
+                self.process.poll() is None
+                and _stat_key(self.path) == self.stat_key
+            )
+        except OSError:
+            return False
+
+    def call(self, args, timeout):
+        """Return the output of the command, split into lines.
+
+        Returns None if the output can't be told apart from the errors
+        or warnings, or if the process stopped responding (and needs
+        to be closed, see broken).
+
+        """
+        if any(
+                not arg or re.search(r'[\s\'"\\#]', arg)
+                for arg in args
+        ):
+            # Would need quoting.
+            return None
+        marker = os.urandom(16).hex()
+        self.last_used = time.monotonic()
+        try:
+            self.process.stdin.write(
+                '{}\necho {}\n'.format(' '.join(args), marker).encode(
+                    self.encoding,
+                ),
+            )
+            self.process.stdin.flush()
+            output = self._read_until(
+                '{}\n'.format(marker).encode(), timeout,
+            )
+            try:
+                # Written before the marker, so it's there already.
+                errors = os.read(self.process.stderr.fileno(), 64 * 1024)
+            except BlockingIOError:
+                errors = b''
+        except (OSError, EOFError):
+            self.broken = self.crashed = True
+            return None
+        if output is None:
+            self.broken = True
+            return None
+        if errors:
+            return None
+
+        output = output.decode(self.encoding, 'replace')
+        line_start = output.rfind('\n') + 1
+        prompt = output[line_start:]
+        if not self.PROMPT_REGEXP.fullmatch(prompt):
+            self.broken = True
+            return None
+        output = output[:line_start]
+        if output.startswith(prompt):
+            output = output[len(prompt):]
+        return output.strip().splitlines()
+
+    def _read_until(self, terminator, timeout):
+        """Return the output preceding the terminator.
+
+        Returns None on a timeout.
+
+        """
+        deadline = time.monotonic() + timeout
+        data = self.pending
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.process.stdout, selectors.EVENT_READ)
+            while terminator not in data:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not selector.select(remaining):
+                    return None
+                chunk = os.read(self.process.stdout.fileno(), 64 * 1024)
+                if not chunk:
+                    raise EOFError()
+                data += chunk
+        output, self.pending = data.split(terminator, 1)
+        return output
+
+    def close(self):
+        try:
+            self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+        for pipe in [
+                self.process.stdin, self.process.stdout, self.process.stderr,
+        ]:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+class LedgerWorkerPool:
+    """A bounded pool of LedgerWorkers shared by all the journals.
+
+    Each worker serves a single journal and a single request at
+    a time.  The workers are restarted when their journal changes or
+    they crash, and stopped after being idle for a while or when the
+    pool is full and a worker for some other journal is needed.
+
+    """
+
+    def __init__(self, max_size=0, idle_timeout=300, timeout=60):
+        # 0 disables the workers altogether.
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        # How long to wait for the output of a single command.
+        self.timeout = timeout
+        # The idle workers, the least recently used first.
+        self._idle = []
+        # How many workers there are, including the busy ones.
+        self._size = 0
+        # The journals the workers failed to handle.
+        self._broken = set()
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def call(self, command, path, args):
+        """Run a ledger command against the journal.
+
+        Returns the output lines, or None if no worker could handle
+        it and the caller needs to run the command on its own.
+
+        """
+        worker = self._checkout(command, path)
+        if worker is None:
+            return None
+        output = worker.call(args, self.timeout)
+        self._checkin(worker)
+        return output
+
+    def _checkout(self, command, path):
+        stale = []
+        worker = None
+        with self._lock:
+            if not self.max_size or path in self._broken:
+                return None
+            for position in range(len(self._idle) - 1, -1, -1):
+                if self._idle[position].path == path:
+                    worker = self._idle.pop(position)
+                    break
+            else:
+                if self._size >= self.max_size:
+                    if not self._idle:
+                        return None
+                    stale.append(self._idle.pop(0))
+                else:
+                    self._size += 1
+        for old_worker in stale:
+            old_worker.close()
+        if worker is not None:
+            if worker.fresh():
+                return worker
+            worker.close()
+        try:
+            return LedgerWorker(command, path)
+        except OSError:
+            with self._lock:
+                self._size -= 1
+            return None
+
+    def _checkin(self, worker):
+        if worker.broken:
+            worker.close()
+            with self._lock:
+                self._size -= 1
+                if not worker.crashed:
+                    # It didn't crash but stopped responding or its
+                    # output was unexpected, it's bound to happen
+                    # again.
+                    self._broken.add(worker.path)
+            return
+        with self._lock:
+            self._idle.append(worker)
+            if self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._reap_idle,
+                    daemon=True,
+                )
+                self._reaper.start()
+
+    def reap(self):
+        """Stop the workers idle for longer than idle_timeout."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                worker
+                for worker in self._idle
+                if now - worker.last_used >= self.idle_timeout
+            ]
+            self._idle = [
+                worker
+                for worker in self._idle
+                if now - worker.last_used < self.idle_timeout
+            ]
+            self._size -= len(expired)
+        for worker in expired:
+            worker.close()
+
+    def close(self):
+        """Stop all the idle workers."""
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+        for worker in idle:
+            worker.close()
+
+    def _reap_idle(self):
+        while True:
+            time.sleep(self.idle_timeout / 2)
+            self.reap()
+            with self._lock:
+                if not self._idle:
+                    self._reaper = None
+                    return
+
+
+class ReportCache:
+    """The results of the recent ledger reports, by the journal state.
+
+    The state of a journal is its file's inode, size, mtime and the
+    digest of its tail, so any change to the file (but not to the
+    files it includes) makes the reports get run anew.  Only the
+    max_size most recently used results are kept.
+
+    """
+
+    def __init__(self, max_size=0):
+        # 0 disables the cache altogether.
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(path):
+        """Return the state of the journal, or None if it can't be told."""
+        try:
+            with open(path, 'rb') as ledger_file:
+                file_stat = os.fstat(ledger_file.fileno())
+                if not stat.S_ISREG(file_stat.st_mode):
+                    return None
+                return (
+                    file_stat.st_ino,
+                    file_stat.st_size,
+                    file_stat.st_mtime_ns,
+                    tail_digest(ledger_file, file_stat.st_size),
+                )
+        except OSError:
+            return None
+
+    def get(self, key, default=None):
+        with self._lock:
+            result = self._results.get(key, default)
+            if key not in self._results:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._results.move_to_end(key)
+            return result
+
+    def put(self, key, result):
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = self.misses = 0
+
+
+class JournalWriter:
+    """Appends data to a journal file, coalescing the concurrent appends.
+
+    The writes are done under an exclusive flock() of the file, the
+    same one Journal.revert and mapped() take, so they're serialized
+    with the other processes.  The appends coming from the other
+    threads while a batch is being written get queued and then written
+    together as the next batch, with a single write and fsync.
+
+    With a spool_dir, the batches of the other processes are coalesced
+    too.  Each batch is put in the spool before waiting for the lock,
+    and whoever gets the lock writes all the spooled batches at once,
+    leaving their positions in the spool for the processes still
+    waiting.  The batches of the processes gone in the meantime are
+    dropped.
+
+    """
+
+    def __init__(self, path, spool_dir=None):
+        self.path = path
+        self.spool_dir = spool_dir
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        self._queue = []
+        self._writing = False
+
+    def append(self, data):
+        """Append the bytes, returning their (old_position, new_position)."""
+        request = {'data': data}
+        with self._lock:
+            self._queue.append(request)
+            while self._writing and 'result' not in request:
+                self._written.wait()
+            if 'result' not in request:
+                # Nobody else is writing, so let's write everything
+                # queued so far.
+                self._writing = True
+                batch = self._queue
+                self._queue = []
+            else:
+                batch = None
+
+        if batch is not None:
+            try:
+                results = self._write([queued['data'] for queued in batch])
+            except BaseException as e:
+                results = [e] * len(batch)
+            with self._lock:
+                for queued, result in zip(batch, results):
+                    queued['result'] = result
+                self._writing = False
+                self._written.notify_all()
+
+        if isinstance(request['result'], BaseException):
+            raise request['result']
+        return request['result']
+
+    def _write(self, batch):
+        if self.spool_dir is None:
+            with open(self.path, 'ab') as ledger_file:
+                fcntl.flock(ledger_file.fileno(), fcntl.LOCK_EX)
+                return self._write_locked(ledger_file, [batch])[0]
+
+        # Fails early if the journal can't be opened, without leaving
+        # a request behind.
+        with open(self.path, 'ab') as ledger_file:
+            request = self._spool(batch)
+            try:
+                fcntl.flock(ledger_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    # Written by someone else already.
+                    with open(request + '.done', 'rb') as done_file:
+                        positions = pickle.load(done_file)
+                    os.unlink(request + '.done')
+                    return positions
+                except FileNotFoundError:
+                    pass
+
+                requests, batches = self._spooled(request, batch)
+                results = self._write_locked(ledger_file, batches)
+                for other_request, positions in zip(requests, results):
+                    if other_request != request:
+                        self._put(other_request + '.done', positions)
+                        os.unlink(other_request + '.req')
+                return results[requests.index(request)]
+            finally:
+                try:
+                    os.unlink(request + '.req')
+                except FileNotFoundError:
+                    pass
+
+    def _write_locked(self, ledger_file, batches):
+        """Write the batches, returning the positions of each data."""
+        position = ledger_file.seek(0, os.SEEK_END)
+        results = []
+        for batch in batches:
+            positions = []
+            for data in batch:
+                positions.append((position, position + len(data)))
+                position += len(data)
+            results.append(positions)
+        ledger_file.write(b''.join(itertools.chain.from_iterable(batches)))
+        ledger_file.flush()
+        if stat.S_ISREG(os.fstat(ledger_file.fileno()).st_mode):
+            # Can't be done for the devices like /dev/null.
+            os.fsync(ledger_file.fileno())
+        return results
+
+    def _spool(self, batch):
+        """Put the batch in the spool, returning the request path.
+
+        The requests are named after the time and the process putting
+        them there, so they sort in the order they were made.
+
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        request = os.path.join(self.spool_dir, '{:020d}-{}-{}'.format(
+            int(time.time() * 1000000), os.getpid(), os.urandom(8).hex(),
+        ))
+        self._put(request + '.req', batch)
+        return request
+
+    def _spooled(self, request, batch):
+        """Return the pending requests and their batches, ours included.
+
+        The files left by the processes that are gone are removed.
+
+        """
+        requests = []
+        batches = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            base, extension = os.path.splitext(path)
+            if base == request and extension == '.req':
+                requests.append(request)
+                batches.append(batch)
+                continue
+            try:
+                pid = int(name.split('-')[1])
+            except (IndexError, ValueError):
+                continue
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                os.unlink(path)
+                continue
+            except PermissionError:
+                pass
+            if extension == '.req':
+                try:
+                    with open(path, 'rb') as request_file:
+                        batches.append(pickle.load(request_file))
+                except (OSError, EOFError, pickle.UnpicklingError):
+                    continue
+                requests.append(base)
+        return requests, batches
+
+    @staticmethod
+    def _put(path, value):
+        # Renamed into place, so it's never seen half written.
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as temporary_file:
+            pickle.dump(value, temporary_file)
+        os.rename(temporary_path, path)
+
+
 class Journal:
 
     class CannotRevert(Exception):
@@ -189,58 +1714,174 @@ class Journal:
     class LedgerCliError(Exception):
         pass
 
+    class Unsupported(Exception):
+        """The journal uses what the native parser doesn't support."""
+
     # Not used but let's keep it as documentation of the expected
-    # fields of the passed objects.
+    # fields of the passed objects: the span of the file that was
+    # written and the digest() of what was written there.
     LastData = namedtuple(
         'LastData',
         [
-            'last_entry',
             'old_position',
             'new_position',
+            'digest',
         ],
     )
+    # What append() returns: the span of the file the entry got
+    # written to and the data written there.
+    Appended = namedtuple(
+        'Appended',
+        [
+            'old_position',
+            'new_position',
+            'data',
+        ],
+    )
+
+    # The directory to persist the entry indexes in.  If None, they
+    # are kept only in memory.
+    cache_dir = None
+
+    # How much of the file is read at once when reading it backwards.
+    reverse_block_size = 64 * 1024
+
+    # The ledger executable.
+    ledger_command = 'ledger'
+    # The ledger processes to run the commands with, instead of
+    # starting a new one (and parsing the journal) for each of them.
+    workers = LedgerWorkerPool()
+    # The memoized outputs of the ledger reports.
+    report_cache = ReportCache()
+
+    # Indexes already loaded by this process, by journal path.  Each
+    # one is loaded and refreshed under its own lock from
+    # _index_locks, _indexes_lock only guards getting that lock.
+    _indexes = {}
+    _index_locks = {}
+    _indexes_lock = threading.Lock()
+
+    # The JournalWriters of this process, by journal path.
+    _writers = {}
+    _writers_lock = threading.Lock()
 
     def __init__(self, ledger_path, last_data=None):
         self.path = ledger_path
         self.last_data = last_data
 
-    def can_revert(self):
-        if self.last_data is None:
-            return False
+    def _cache_path(self, extension):
+        if self.cache_dir is None:
+            return None
+        path_hash = hashlib.sha1(
+            os.path.abspath(self.path).encode(),
+        ).hexdigest()
+        return os.path.join(self.cache_dir, path_hash + extension)
+
+    def _index_path(self):
+        return self._cache_path('.index')
+
+    def _spool_dir(self):
+        """Return where the appends wait to be coalesced, see JournalWriter."""
+        return self._cache_path('.spool')
 
-        with open(self.path, 'r') as ledger_file:
-            current_end = ledger_file.seek(0, 2)
-            if current_end != self.last_data.new_position:
-                return False
+    def _index(self, ledger_file):
+        index_path = self._index_path()
+        with self._indexes_lock:
+            lock = self._index_locks.setdefault(self.path, threading.Lock())
+        with lock:
+            index = self._indexes.get(self.path)
+            if index is None:
+                if index_path is not None:
+                    index = JournalIndex.load(index_path)
+                else:
+                    index = JournalIndex()
+            new_index = index.refreshed(ledger_file)
+            if (new_index is not index
+                    and new_index.tail_digest is not None
+                    and index_path is not None):
+                # Only the indexes of the regular files are worth
+                # persisting.
+                new_index.save(index_path)
+            self._indexes[self.path] = new_index
+        return new_index
 
-            ledger_file.seek(self.last_data.old_position)
-            stored_entry = str(self.last_data.last_entry)
-            actual_entry = ledger_file.read().rstrip()
-            if stored_entry != actual_entry:
-                return False
+    def index(self):
+        """Return an up to date JournalIndex of this journal."""
+        with open(self.path, 'rb') as ledger_file:
+            return self._index(ledger_file)
 
-        return True
+    @staticmethod
+    def digest(data):
+        """Return the digest identifying the data written to the journal."""
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def _revertible(self, ledger_file):
+        if self.last_data is None:
+            return False
+        if ledger_file.seek(0, os.SEEK_END) != self.last_data.new_position:
+            return False
+        ledger_file.seek(self.last_data.old_position)
+        data = ledger_file.read(
+            self.last_data.new_position - self.last_data.old_position,
+        )
+        return self.digest(data) == bytes(self.last_data.digest)
+
+    def can_revert(self):
+        """Check whether last_data is still what the journal ends with."""
+        if self.last_data is None:
+            return False
+        with open(self.path, 'rb') as ledger_file:
+            return self._revertible(ledger_file)
 
     def revert(self):
+        """Remove last_data from the journal, if it's still at its end."""
         if self.last_data is None:
             raise Journal.CannotRevert()
 
-        with open(self.path, 'a+') as ledger_file:
-            if self.last_data.new_position != ledger_file.tell():
+        with open(self.path, 'rb+') as ledger_file:
+            # Wait for the readers having the file mapped to memory,
+            # see mapped(), and for the writers.
+            fcntl.flock(ledger_file.fileno(), fcntl.LOCK_EX)
+            if not self._revertible(ledger_file):
                 raise Journal.CannotRevert()
-
-            ledger_file.seek(self.last_data.old_position)
-            if ledger_file.read().rstrip() != str(self.last_data.last_entry):
-                raise Journal.CannotRevert()
-
             ledger_file.truncate(self.last_data.old_position)
 
+    def _writer(self):
+        path = os.path.abspath(self.path)
+        with self._writers_lock:
+            writer = self._writers.get(path)
+            if writer is None:
+                writer = self._writers[path] = JournalWriter(
+                    path, self._spool_dir(),
+                )
+        return writer
+
     def append(self, entry):
-        with open(self.path, 'a') as ledger_file:
-            old_position = ledger_file.tell()
-            print(entry, file=ledger_file)
-            new_position = ledger_file.tell()
-        return old_position, new_position
+        """Append the entry, returning an Appended.
+
+        The concurrent appends get written together, see JournalWriter.
+
+        """
+        return self.append_entries([entry])[0]
+
+    def append_entries(self, entries):
+        """Append the entries with a single write, like append() does.
+
+        Returns an Appended for each of them.
+
+        """
+        encoding = locale.getpreferredencoding(False)
+        data = ['{}\n'.format(entry).encode(encoding) for entry in entries]
+        position, _ = self._writer().append(b''.join(data))
+        appended = []
+        for entry_data in data:
+            appended.append(Journal.Appended(
+                position,
+                position + len(entry_data),
+                entry_data,
+            ))
+            position += len(entry_data)
+        return appended
 
     def accounts(self):
         return self._call("accounts")
@@ -251,13 +1892,108 @@ class Journal:
     def currencies(self):
         return self._call("commodities")
 
+    def metadata(self):
+        """Return the accounts, currencies and payees.
+
+        The reports are run concurrently.  If any of them fails, the
+        LedgerCliError of the first one is raised.
+
+        """
+        reports = [self.accounts, self.currencies, self.payees]
+        with concurrent.futures.ThreadPoolExecutor(len(reports)) as executor:
+            futures = [executor.submit(report) for report in reports]
+        return tuple(future.result() for future in futures)
+
     def csv(self, *args):
         return io.StringIO("\n".join(self._call("csv", *args)))
 
+    @contextlib.contextmanager
+    def csv_stream(self, *args):
+        """Run the csv report, yielding its output as a text stream.
+
+        The report is run by one of the workers if there's any, so
+        the journal isn't parsed again, and the output is collected
+        first.  Otherwise ledger is run on its own and the output can
+        be read as it's produced, without collecting it first, and
+        needs to be read whole.  Raises LedgerCliError if the report
+        fails, even if it's noticed by the reader first.
+
+        """
+        output = self.workers.call(
+            self.ledger_command, self.path, ["csv"] + list(args),
+        )
+        if output is not None:
+            yield io.StringIO("".join(line + "\n" for line in output))
+            return
+
+        command = [self.ledger_command, "-f", self.path, "csv"] + list(args)
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=errors,
+                universal_newlines=True,
+            )
+            try:
+                yield process.stdout
+            except BaseException:
+                # The reader might have failed because of the report
+                # failing, let's report that instead.  If the report
+                # is still running, it's not the case.
+                try:
+                    returncode = process.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    returncode = None
+                if not returncode:
+                    raise
+            finally:
+                process.stdout.close()
+                process.wait()
+            if process.returncode != 0:
+                errors.seek(0)
+                raise Journal.LedgerCliError() from (
+                    subprocess.CalledProcessError(
+                        process.returncode, command,
+                        stderr=errors.read().decode(errors='replace'),
+                    )
+                )
+
+    def memoized(self, key, compute):
+        """Return compute(), remembered until the journal changes.
+
+        key tells apart the computations done on the same journal.
+        The result is shared with the other callers, so it must not
+        be modified.
+
+        """
+        if not self.report_cache.max_size:
+            return compute()
+        fingerprint = self.report_cache.fingerprint(self.path)
+        if fingerprint is None:
+            return compute()
+        key = (os.path.abspath(self.path), key, fingerprint)
+        missing = object()
+        result = self.report_cache.get(key, missing)
+        if result is missing:
+            result = compute()
+            self.report_cache.put(key, result)
+        return result
+
     def _call(self, *args):
+        return list(self.memoized(
+            ('report', args),
+            lambda: tuple(self._run(*args)),
+        ))
+
+    def _run(self, *args):
+        output = self.workers.call(self.ledger_command, self.path, args)
+        if output is not None:
+            return output
+
         try:
             output = subprocess.check_output(
-                ["ledger", "-f", self.path] + list(args),
+                [self.ledger_command, "-f", self.path] + list(args),
                 universal_newlines=True,
                 stderr=subprocess.PIPE,
             )
@@ -266,60 +2002,107 @@ class Journal:
 
         return output.strip().splitlines()
 
-    def __iter__(self):
-        date_regexp = r'\d{4}-\d{2}-\d{2}|\d{4}/\d{2}/\d{2}'
-        def prepare_entry(entry_lines):
-            match = re.match(
-                '({date}){cleared}\s+({payee})'.format(
-                    date=date_regexp,
-                    cleared=r'(?: [!*])?',
-                    payee=r'.*'
-                ),
-                entry_lines[0],
-            )
-            date = match.group(1)
-            payee = match.group(2)
+    def entries(self, since=None, until=None):
+        """Return the entries as JournalEntries.
 
-            match = re.fullmatch(
-                '\s*;\s*(.*)',
-                entry_lines[1],
-            )
-            if match:
-                note = match.group(1)
-            else:
-                # In Django strings usually aren't nullable, let's
-                # keep this convention and just store an empty string.
-                note = ''
+        The entry bodies are decoded only when accessed, from a single
+        copy of the journal data shared by all of them, and kept by the
+        index (see JournalIndex.data()).
 
-            return {
-                'body': "\n".join(entry_lines),
-                'date': date,
-                'payee': payee,
-                'note': note,
-            }
+        If since or until are passed, only the entries dated within
+        this range (inclusive, YYYY-MM-DD) are returned, still in the
+        file order.  They're found in a DateIndex so the other entries
+        aren't even looked at.
 
-        entry = []
-        with open(self.path, 'r') as ledger_file:
-            for line in map(str.rstrip, ledger_file):
-                if not entry:
-                    # Skipping the empty space and non-entries between entries.
-                    if re.match(r'{} '.format(date_regexp), line):
-                        # A beginning of a next entry.
-                        entry.append(line)
+        """
+        with open(self.path, 'rb') as ledger_file:
+            index = self._index(ledger_file)
+            entries = index.entries
+            span = None
+            if since is not None or until is not None:
+                positions = index.date_index().positions(since, until)
+                if isinstance(positions, range):
+                    entries = entries[positions.start:positions.stop]
                 else:
-                    # In the middle of parsing an entry.
-                    if line:
-                        # Let's parse some more of it.
-                        entry.append(line)
-                    else:
-                        # End of an entry.
-                        yield prepare_entry(entry)
-                        entry = []
-            if entry:
-                yield prepare_entry(entry)
+                    entries = entries.take(positions)
+                # Only the data of the returned entries is needed.
+                span = entries.span()
+            data, data_start = index.data(ledger_file, span)
+        return entries.with_data(data, data_start)
+
+    def __iter__(self):
+        return iter(self.entries())
+
+    def postings(self):
+        """Return the Postings of all the entries, parsed without ledger.
+
+        Raises Journal.Unsupported if the journal uses anything
+        parse_postings() doesn't support, or any directives other than
+        the commodity prices (which make no difference to them).
+
+        """
+        entries = self.entries()
+        # What's between the entries.
+        start = 0
+        for offset, length in zip(entries.offsets, entries.lengths):
+            self._check_neutral(entries.data[start:offset])
+            start = offset + length
+        self._check_neutral(entries.data[start:])
+        try:
+            return parse_postings(entries)
+        except ValueError as e:
+            raise Journal.Unsupported(str(e)) from e
+
+    @staticmethod
+    def _check_neutral(data):
+        for line in re.split(rb'\r\n?|\n', data):
+            if not NEUTRAL_LINE_REGEXP.fullmatch(line):
+                raise Journal.Unsupported(
+                    'Unsupported line: {}'.format(decode(line)),
+                )
+
+    def reverse_entries(self, before=None):
+        """Iterate over (offset, entry) pairs starting from the last entry.
+
+        If before is passed, start from the last entry preceding this
+        offset instead, which is expected to be either the end of the
+        file or an offset of another entry.  Unlike iterating the
+        journal normally, it only reads the file from the oldest entry
+        actually consumed up to the starting point, so getting just
+        the few entries preceding it doesn't depend on the journal
+        size.
+
+        """
+        with open(self.path, 'rb') as ledger_file:
+            end = ledger_file.seek(0, io.SEEK_END)
+            if before is not None:
+                end = min(end, before)
+            for entry, body in reverse_scan_entries(
+                    ledger_file, end, self.reverse_block_size,
+            ):
+                yield entry.offset, {
+                    'body': body,
+                    'date': entry.date,
+                    'payee': entry.payee,
+                    'note': entry.note,
+                }
+
+    def iter_reverse(self, before=None):
+        """Iterate over the entries starting from the last one.
+
+        See reverse_entries() for the details.
+
+        """
+        for _, entry in self.reverse_entries(before):
+            yield entry
+
+    def tail(self, count):
+        """Return the last count entries in the chronological order."""
+        entries = list(itertools.islice(self.iter_reverse(), count))
+        entries.reverse()
+        return entries
 
 
 if __name__ == '__main__':
     import doctest
-    import sys
     sys.exit(doctest.testmod()[0])